@@ -22,6 +22,7 @@
 #
 import numpy as np
 import random
+from scipy.spatial import cKDTree
 
 
 def distance_connector(source, target, d_weight_min, d_weight_max, d_max, nsyn_min, nsyn_max):
@@ -53,4 +54,67 @@ def distance_connector(source, target, d_weight_min, d_weight_max, d_max, nsyn_m
 
 
 def connect_random(source, target, nsyn_min=0, nsyn_max=10, distribution=None):
-    return np.random.randint(nsyn_min, nsyn_max)
\ No newline at end of file
+    return np.random.randint(nsyn_min, nsyn_max)
+
+
+def distance_connector_kdtree(sources, targets, d_weight_min, d_weight_max, d_max, nsyn_min, nsyn_max):
+    """Same connectivity rules as distance_connector(), but for use with add_edges(iterator='all_to_all') so that all
+    the source and target nodes are connected at once. Source/target positions are indexed using a KD-tree and only
+    pairs within d_max of each other are considered, so the time it takes scales with the number of nearby pairs rather
+    than n_sources x n_targets::
+
+        net.add_edges(source=..., target=...,
+                      connection_rule=distance_connector_kdtree,
+                      connection_params={'d_weight_min': 0.0, 'd_weight_max': 0.34, 'd_max': 300.0, 'nsyn_min': 3,
+                                         'nsyn_max': 7},
+                      iterator='all_to_all')
+
+    :param sources: DataFrame of source nodes, must have a 'positions' column
+    :param targets: DataFrame of target nodes, must have a 'positions' column
+    :param d_weight_min: connection probability for nodes d_max apart
+    :param d_weight_max: connection probability for nodes at the same position
+    :param d_max: maximum distance between connected nodes
+    :param nsyn_min: minimum number of synapses per connection
+    :param nsyn_max: maximum number of synapses per connection (inclusive)
+    :return: (src_idxs, trg_idxs, nsyns) arrays for every connected pair
+    """
+    src_idxs, trg_idxs, r = pairs_within_distance(_positions(sources), _positions(targets), d_max)
+
+    # Avoid self-connections.
+    not_self = sources['node_id'].values[src_idxs] != targets['node_id'].values[trg_idxs]
+    src_idxs, trg_idxs, r = src_idxs[not_self], trg_idxs[not_self], r[not_self]
+
+    # weights by euclidean distance between cells, treated as the probability of connection
+    t = r / d_max
+    dw = d_weight_max * (1.0 - t) + d_weight_min * t
+    connected = (dw > 0) & (np.random.random(len(dw)) <= dw)
+    src_idxs, trg_idxs = src_idxs[connected], trg_idxs[connected]
+
+    # Add the number of synapses for every connection.
+    nsyns = np.random.randint(nsyn_min, nsyn_max + 1, size=len(src_idxs))
+    return src_idxs, trg_idxs, nsyns
+
+
+def pairs_within_distance(source_positions, target_positions, d_max):
+    """Finds all source/target pairs whose positions are within d_max of each other using KD-trees.
+
+    :param source_positions: N x D array of source positions
+    :param target_positions: M x D array of target positions
+    :param d_max: maximum euclidean distance
+    :return: (src_idxs, trg_idxs, distances) arrays, sorted by source then target index
+    """
+    if len(source_positions) == 0 or len(target_positions) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=float)
+
+    src_tree = cKDTree(source_positions)
+    trg_tree = cKDTree(target_positions)
+    pairs = src_tree.sparse_distance_matrix(trg_tree, max_distance=d_max, output_type='ndarray')
+    order = np.lexsort((pairs['j'], pairs['i']))
+    pairs = pairs[order]
+    return pairs['i'].astype(np.int64), pairs['j'].astype(np.int64), pairs['v'].astype(float)
+
+
+def _positions(nodes_table):
+    if 'positions' not in nodes_table.columns:
+        raise ValueError('Nodes are missing "positions" property.')
+    return np.array([np.asarray(p, dtype=float) for p in nodes_table['positions'].values]).reshape(len(nodes_table), -1)
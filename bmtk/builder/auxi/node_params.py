@@ -22,10 +22,12 @@
 #
 import numpy as np
 import math
+import multiprocessing
 # import nrrd
 import matplotlib.pyplot as plt
 from collections import defaultdict
 from types import SimpleNamespace
+from scipy.spatial import cKDTree
 
 try:
     from sklearn.neighbors import KDTree
@@ -79,7 +81,7 @@ class CellLocations(object):
         self._CCF_orientation = value
 
     def add_positions_nrrd(self, nrrd_filename, max_dens_per_mm3, pop_names, partitions=[1], split_bilateral=None,
-                          method='prog', verbose = False):
+                           method='prog', verbose=False, n_workers=1):
 
         if self._all_positions:
             existing_positions = np.vstack(self._all_positions)
@@ -87,7 +89,8 @@ class CellLocations(object):
             existing_positions = np.array([]).reshape(0, 3)
         positions = positions_nrrd(nrrd_filename, max_dens_per_mm3, split_bilateral, self._dmin,
                                    CCF_orientation=self._CCF_orientation, plot=False,
-                                   method=method, existing_positions=existing_positions, verbose=verbose)
+                                   method=method, existing_positions=existing_positions, verbose=verbose,
+                                   n_workers=n_workers)
         # list of position arrays
         positions_pop = partition_locations(positions, partitions)
         self.add_positions(pop_names, positions_pop)
@@ -400,7 +403,7 @@ def positions_list(positions=np.array([(0, 0, 0), (0, 0, 1)])):
 
 def positions_density_matrix(mat, position_scale=np.array([[1,0,0],[0,1,0],[0,0,1]]), origin=np.array([0,0,0]),
                              plot=False, CCF_orientation=False, dmin=0.0, method='prog',
-                             existing_positions=np.array([]).reshape(0, 3), verbose=False):
+                             existing_positions=np.array([]).reshape(0, 3), verbose=False, n_workers=1):
     """This function places random x,y,z coordinates according to a supplied 3D array of densities (cells/mm^3).
     The optional position_scale parameter defines a transformation matrix A to physical space such that::
     
@@ -415,13 +418,16 @@ def positions_density_matrix(mat, position_scale=np.array([[1,0,0],[0,1,0],[0,0,
            See https://help.brain-map.org/display/mouseconnectivity/API#API-DownloadAtlas3-DReferenceModels
     :param dmin: Minimum distance allowed between cell centers - using this function can severely slow down cell
            placement, especially as we approach the maximal possible density for this minimum distance
+    :param method: 'prog' for progressive sampling, 'grid' for progressive sampling using a spatial grid that can be
+           split across n_workers processes (faster for large numbers of cells), or 'lattice' for lattice jittering
     :param verbose: If set to true, prints every 100 units placed for monitoring progress
+    :param n_workers: number of processes used by the 'grid' method
 
     :return: A (N, 3) matrix (microns)
     """
 
     ind_nz = np.nonzero(mat)
-    if method == 'prog':
+    if method in ['prog', 'grid']:
         # Use batch progressive sampling
         def sampling_func(ndraws):
             rand_pos_new = np.random.uniform(size=(3, ndraws))  # Or for simple geometries, draw over max_dims
@@ -434,8 +440,13 @@ def positions_density_matrix(mat, position_scale=np.array([[1,0,0],[0,1,0],[0,0,
 
             return positions
 
-        positions = positions_dmin_prog(mat, position_scale=position_scale, sampling_func=sampling_func, dmin=dmin,
-                                        existing_positions=existing_positions, verbose=verbose)
+        if method == 'prog':
+            positions = positions_dmin_prog(mat, position_scale=position_scale, sampling_func=sampling_func, dmin=dmin,
+                                            existing_positions=existing_positions, verbose=verbose)
+        else:
+            positions = positions_dmin_grid(mat, position_scale=position_scale, sampling_func=sampling_func, dmin=dmin,
+                                            existing_positions=existing_positions, n_workers=n_workers,
+                                            verbose=verbose)
     elif method == 'lattice':
         # Use lattice jittering
         vol_per_voxel = np.abs(np.linalg.det(position_scale.astype(float))) / (1000) ** 3
@@ -444,8 +455,8 @@ def positions_density_matrix(mat, position_scale=np.array([[1,0,0],[0,1,0],[0,0,
         positions = positions_dmin_lattice(mat, position_scale=position_scale, N=N, vol_tot=vol, dmin=dmin,
                                            existing_positions=existing_positions, verbose=verbose)
     else:
-        raise ValueError("The 'method' argument can be either 'prog' for progressive sampling "
-                         "or 'lattice' for lattice jittering")
+        raise ValueError("The 'method' argument can be either 'prog' for progressive sampling, 'grid' for grid "
+                         "based progressive sampling, or 'lattice' for lattice jittering")
 
     # Remove cells to achieve non-uniform density, if applicable
 
@@ -513,19 +524,7 @@ def positions_dmin_prog(mat=None, position_scale=np.array([[1, 0, 0], [0, 1, 0],
     if (dmin < 0):
         raise ValueError('Minimum distance between cell centers (dmin) must not be negative')
 
-    if isinstance(mat, np.ndarray):    # Density matrix
-        max_dens=np.max(mat)
-        vol_per_voxel = np.abs(np.linalg.det(position_scale.astype(float))) / (1000) ** 3
-        mat = mat.astype(float) * vol_per_voxel
-        max_dens_n = np.max(mat)
-        n_vox_nz = np.nonzero(mat)[0].shape[0]
-        ndraws_tot = int(max_dens_n * n_vox_nz)
-        vol_tot = vol_per_voxel * n_vox_nz
-    elif N is not None:     # Desired total N
-        ndraws_tot = N
-        max_dens = N/(vol_tot)
-    else:
-        raise Exception('Must specify either a cell density matrix (mat) or a total number of cells (N)')
+    ndraws_tot, max_dens, vol_tot = _dmin_target_counts(mat, position_scale, N, vol_tot)
 
     if dmin != 0:
         # Number of spheres at FCC/HCP packing: 0.74*V/V_sphere
@@ -552,14 +551,18 @@ def positions_dmin_prog(mat=None, position_scale=np.array([[1, 0, 0], [0, 1, 0],
         positions_new = []
         itercount = 0
         n_pass = 0
+        if dmin > 0:
+            # placed positions don't change during the rejection iterations, only build the tree once
+            positions_all = np.vstack((existing_positions, positions))
+            if positions_all.shape[0] > 0:
+                tree = KDTree(positions_all, leaf_size=2)
+
         while (itercount < max_iter) and (n_pass < thresh):
             positions_new.append(sampling_func(ndraws))
             if dmin>0:
                 # Check against existing tree
                 # Find nearest neighbor
-                positions_all = np.vstack((existing_positions, positions))
                 if positions_all.shape[0] > 0:
-                    tree = KDTree(positions_all, leaf_size=2)
                     dists, d_inds = tree.query(positions_new[-1], k=1)
                     conf_inds = np.squeeze(dists < dmin)
                     positions_new[-1][conf_inds,:] = [np.nan, np.nan, np.nan]
@@ -618,6 +621,223 @@ def positions_dmin_prog(mat=None, position_scale=np.array([[1, 0, 0], [0, 1, 0],
 
     return positions
 
+
+def positions_dmin_grid(mat=None, position_scale=np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]]), N=None, vol_tot=None,
+                        sampling_func=None, dmin=0.0, existing_positions=np.array([]).reshape(0, 3), n_workers=1,
+                        n_blocks=None, verbose=False):
+    """Places random x,y,z coordinates with a minimal distance, like positions_dmin_prog(), but scales to millions of
+    cells.
+
+    New points are checked against a uniform grid (cells smaller than dmin/sqrt(3), so each holds at most one point)
+    that is updated incrementally as points are accepted, rather than rebuilding a tree of all placed points. The volume
+    is split into n_blocks slabs along its longest axis which are sampled independently; even slabs first and then odd
+    slabs, which also check the points of their neighbours within dmin of the slab boundaries (the halo). Slabs in the
+    same phase never interact so they can be placed in parallel using n_workers processes.
+
+    Points are placed by random sequential addition, which jams at a lower density than the swapping used by
+    positions_dmin_prog(), use method='prog' when very close packing is required.
+
+    :param mat: A 3-dimensional matrix of densities (cells/mm^3)
+    :param position_scale: A (3, 3) matrix (microns)
+    :param N: total number of cells, used when mat is not specified
+    :param vol_tot: total volume (mm^3) when N is specified
+    :param sampling_func: function sampling_func(n) that returns n random (n, 3) positions
+    :param dmin: Minimum distance allowed between cell centers (microns)
+    :param existing_positions: (n, 3) positions of already placed cells that new cells must also be dmin away from
+    :param n_workers: number of processes used for placing cells, requires the 'fork' start method
+    :param n_blocks: number of independently sampled slabs, default 1 when running serially or 2*n_workers
+    :param verbose: If set to true, prints the number of cells placed in each slab
+
+    :return: A (N, 3) matrix (microns)
+    """
+    if dmin < 0:
+        raise ValueError('Minimum distance between cell centers (dmin) must not be negative')
+
+    ndraws_tot, max_dens, vol_tot = _dmin_target_counts(mat, position_scale, N, vol_tot)
+    if dmin == 0 or ndraws_tot == 0:
+        return sampling_func(ndraws_tot)
+
+    # Random sequential addition can't reach close packing, jamming occurs at approx. 0.38 volume fraction
+    V_sphere = 4 / 3 * np.pi * (dmin/1000/2) ** 3
+    dens_lim = 0.38 / V_sphere
+    if max_dens > dens_lim:
+        raise ValueError('Requested density ({:.3f}) is too high for grid placement with minimum distance (limit '
+                         '{:.3f}): either reduce the density or dmin, or use the prog method.'.format(max_dens,
+                                                                                                      dens_lim))
+
+    # Draw an initial sample to find the bounds of the volume and how many cells to place in each slab
+    pilot = sampling_func(ndraws_tot)
+    lo = np.min(pilot, axis=0) - dmin
+    hi = np.max(pilot, axis=0) + dmin
+    axis = int(np.argmax(hi - lo))
+
+    if n_blocks is None:
+        n_blocks = 1 if n_workers <= 1 else 2*n_workers
+    # Slabs that are sampled at the same time must be at least dmin apart
+    n_blocks = int(max(1, min(n_blocks, np.floor((hi[axis] - lo[axis]) / dmin))))
+    block_edges = np.linspace(lo[axis], hi[axis], n_blocks + 1)
+    block_edges[-1] = np.inf
+    block_targets = np.histogram(pilot[:, axis], bins=block_edges)[0]
+    block_fracs = block_targets / float(ndraws_tot)
+
+    existing_positions = np.asarray(existing_positions, dtype=float).reshape(-1, 3)
+    block_seeds = np.random.randint(0, 2**31 - 1, size=n_blocks)
+    block_positions = [None]*n_blocks
+
+    global _grid_placement_ctx
+    _grid_placement_ctx = {
+        'sampling_func': sampling_func, 'dmin': dmin, 'lo': lo, 'hi': hi, 'axis': axis, 'block_edges': block_edges,
+        'block_targets': block_targets, 'block_fracs': block_fracs, 'verbose': verbose
+    }
+    rng_state = np.random.get_state()
+    try:
+        for phase in [0, 1]:
+            block_args = []
+            for block_id in range(phase, n_blocks, 2):
+                # halo: already placed points within dmin of this slab
+                b_lo, b_hi = block_edges[block_id] - dmin, block_edges[block_id + 1] + dmin
+                halo = [existing_positions] + [block_positions[b] for b in (block_id - 1, block_id + 1)
+                                               if 0 <= b < n_blocks and block_positions[b] is not None]
+                halo = np.concatenate(halo, axis=0)
+                halo = halo[(halo[:, axis] >= b_lo) & (halo[:, axis] < b_hi)]
+                block_args.append((block_id, block_seeds[block_id], halo))
+
+            if n_workers > 1 and len(block_args) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context('fork')
+                with ctx.Pool(processes=min(n_workers, len(block_args))) as pool:
+                    results = pool.map(_place_grid_block, block_args)
+            else:
+                results = [_place_grid_block(args) for args in block_args]
+
+            for (block_id, _, _), positions in zip(block_args, results):
+                block_positions[block_id] = positions
+    finally:
+        _grid_placement_ctx = None
+        np.random.set_state(rng_state)
+
+    positions = np.concatenate(block_positions, axis=0)
+    if positions.shape[0] < ndraws_tot:
+        print('Unable to place all cells with minimum distance {}, placed {}/{} cells'.format(dmin, positions.shape[0],
+                                                                                              ndraws_tot))
+    if verbose:
+        print(f'{positions.shape[0]} cells')
+
+    return positions
+
+
+class _DminGrid(object):
+    """Uniform grid of placed points for checking minimum distances. The cells are slightly smaller than dmin/sqrt(3)
+    so two points at least dmin apart can't be in the same cell, and only the 5x5x5 neighbouring cells need to be
+    checked.
+    """
+    def __init__(self, lo, hi, dmin):
+        self.dmin = dmin
+        self.cell_size = dmin / 1.75
+        self.pad = 2
+        self.origin = np.asarray(lo, dtype=float)
+        self.shape = tuple(np.ceil((np.asarray(hi) - self.origin) / self.cell_size).astype(int) + 2*self.pad + 1)
+        self.grid = np.full(self.shape, -1, dtype=np.int32)
+        self.positions = np.zeros((0, 3), dtype=float)
+        r = np.arange(-self.pad, self.pad + 1)
+        offsets = np.stack(np.meshgrid(r, r, r, indexing='ij'), axis=-1).reshape(-1, 3)
+        is_inner = np.all(np.abs(offsets) <= 1, axis=1)
+        self.offsets = [offsets[is_inner], offsets[~is_inner]]  # nearest 3x3x3 cells are most likely to conflict
+
+    def cells(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64) + self.pad
+
+    def conflicts(self, points, chunk_size=50000):
+        """Returns a bool array, True if the point is within dmin of an already placed point."""
+        conflicts = np.zeros(len(points), dtype=bool)
+        if len(self.positions) == 0:
+            return conflicts
+
+        # a point in an occupied cell is always too close, only check the neighbouring cells for the rest
+        cells = self.cells(points)
+        conflicts[self.grid[cells[:, 0], cells[:, 1], cells[:, 2]] >= 0] = True
+        for offsets in self.offsets:
+            check_idxs = np.flatnonzero(~conflicts)
+            for beg in range(0, len(check_idxs), chunk_size):
+                idxs = check_idxs[beg:beg + chunk_size]
+                nbr_cells = cells[idxs, np.newaxis, :] + offsets[np.newaxis, :, :]
+                nbr_idxs = self.grid[nbr_cells[..., 0], nbr_cells[..., 1], nbr_cells[..., 2]]
+                rows, cols = np.nonzero(nbr_idxs >= 0)
+                d2 = np.sum((self.positions[nbr_idxs[rows, cols]] - points[idxs[rows]])**2, axis=1)
+                conflicts[idxs[rows[d2 < self.dmin**2]]] = True
+
+        return conflicts
+
+    def add(self, points):
+        cells = self.cells(points)
+        idxs = np.arange(len(self.positions), len(self.positions) + len(points))
+        self.grid[cells[:, 0], cells[:, 1], cells[:, 2]] = idxs
+        self.positions = np.concatenate((self.positions, points), axis=0)
+
+
+_grid_placement_ctx = None  # shared with forked workers, sampling functions are usually closures that can't be pickled
+
+
+def _place_grid_block(args):
+    block_id, seed, halo = args
+    ctx = _grid_placement_ctx
+    np.random.seed(seed)
+    dmin, axis = ctx['dmin'], ctx['axis']
+    lo, hi = ctx['lo'], ctx['hi']
+    b_lo, b_hi = ctx['block_edges'][block_id], ctx['block_edges'][block_id + 1]
+    n_target = ctx['block_targets'][block_id]
+    frac = max(ctx['block_fracs'][block_id], 1.0e-3)
+
+    # grid only needs to cover this slab, points in the neighbouring slabs are checked using the halo
+    grid_lo, grid_hi = lo.copy(), hi.copy()
+    grid_lo[axis], grid_hi[axis] = b_lo, min(b_hi, hi[axis])
+    grid = _DminGrid(grid_lo, grid_hi, dmin)
+    halo_tree = cKDTree(halo) if len(halo) > 0 else None
+
+    max_fails = 20
+    n_fails = 0
+    while len(grid.positions) < n_target and n_fails < max_fails:
+        n_remaining = n_target - len(grid.positions)
+        ndraws = int(min(max(1000, 2*n_remaining / frac), 1000000))
+        candidates = ctx['sampling_func'](ndraws)
+        candidates = candidates[(candidates[:, axis] >= b_lo) & (candidates[:, axis] < b_hi)]
+        candidates = candidates[np.all((candidates >= lo) & (candidates <= hi), axis=1)]
+
+        if halo_tree is not None and len(candidates) > 0:
+            dists, _ = halo_tree.query(candidates, k=1, distance_upper_bound=dmin)
+            candidates = candidates[dists >= dmin]
+        candidates = candidates[~grid.conflicts(candidates)]
+
+        # Check new candidates against each other, removes both points of a conflicting pair
+        if len(candidates) > 1:
+            pairs = cKDTree(candidates).query_pairs(r=dmin, output_type='ndarray')
+            keep = np.ones(len(candidates), dtype=bool)
+            keep[pairs.flatten()] = False
+            candidates = candidates[keep]
+
+        candidates = candidates[:n_remaining]
+        grid.add(candidates)
+        n_fails = n_fails + 1 if len(candidates) == 0 else 0
+
+    if ctx['verbose']:
+        print(f'block {block_id}: {len(grid.positions)}/{n_target} cells placed')
+
+    return grid.positions
+
+
+def _dmin_target_counts(mat, position_scale, N, vol_tot):
+    """Returns the total number of cells to place, the max density (cells/mm^3) and the total volume (mm^3)."""
+    if isinstance(mat, np.ndarray):    # Density matrix
+        max_dens = np.max(mat)
+        vol_per_voxel = np.abs(np.linalg.det(position_scale.astype(float))) / (1000) ** 3
+        max_dens_n = max_dens * vol_per_voxel
+        n_vox_nz = np.nonzero(mat)[0].shape[0]
+        return int(max_dens_n * n_vox_nz), max_dens, vol_per_voxel * n_vox_nz
+    elif N is not None:     # Desired total N
+        return N, N/vol_tot, vol_tot
+    else:
+        raise Exception('Must specify either a cell density matrix (mat) or a total number of cells (N)')
+
+
 def positions_dmin_lattice(mat, position_scale=np.array([0,0,0]), N=1, vol_tot=None, dmin=0.0,
                            existing_positions=np.array([]).reshape(0, 3), filter_func=None, verbose=False):
     '''Packing with a minimum distance, starting from a hexagonal close packing lattice
@@ -821,7 +1041,7 @@ def positions_dmin_lattice(mat, position_scale=np.array([0,0,0]), N=1, vol_tot=N
 
 
 def positions_nrrd (nrrd_filename, max_dens_per_mm3, split_bilateral=None, dmin = 0.0, CCF_orientation=True, plot=False, method='prog',
-                    existing_positions=np.array([]).reshape(0, 3), verbose=False):
+                    existing_positions=np.array([]).reshape(0, 3), verbose=False, n_workers=1):
     '''Generates random cell positions based on a .nrrd file. Matrix values are interpreted as cell densities
     for each voxel. The maximum density is scaled to max_dens_per_mm3 (cells/mm^3).
     If the .nrrd file is a structural mask, cells will be placed uniformly at max_dens_per_mm3 within the
@@ -833,6 +1053,8 @@ def positions_nrrd (nrrd_filename, max_dens_per_mm3, split_bilateral=None, dmin
     :param max_dens_per_mm3: desired density at maximum value of nrrd array (cells/mm^3)
     :param split_bilateral: return only unilateral structure by removing half of the array along the given axis.
             If no splitting is desired, pass in None
+    :param method: 'prog', 'grid' or 'lattice', see positions_density_matrix()
+    :param n_workers: number of processes used by the 'grid' method
     :return: A (N, 3) matrix (microns)
     '''
 
@@ -859,7 +1081,7 @@ def positions_nrrd (nrrd_filename, max_dens_per_mm3, split_bilateral=None, dmin
 
     positions = positions_density_matrix(readdata_scaled, position_scale=space_dir, origin = origin, plot=plot,
                                          CCF_orientation=CCF_orientation, dmin=dmin, method=method,
-                                         existing_positions=existing_positions, verbose=verbose)
+                                         existing_positions=existing_positions, verbose=verbose, n_workers=n_workers)
 
     return positions
 
@@ -1,5 +1,7 @@
 import os
 import re
+import hashlib
+import tempfile
 from collections import namedtuple
 import numpy as np
 import pandas as pd
@@ -39,12 +41,10 @@ class SWCReader(object):
     }
 
     def __init__(self, swc_path, rng_seed=None):
-        nrn.load_neuron_modules(None, None)
-
         self.swc_path = swc_path
-        self.hobj = h.Biophys1(swc_path)
         self.rng_seed = rng_seed
 
+        self._hobj = None
         self._prng = np.random.RandomState(self.rng_seed)
         self._sections = None
         self._n_sections = None
@@ -53,28 +53,86 @@ class SWCReader(object):
         self._seg_coords = None
         self._nseg = None
         self._swc_map = None
+        self._sec_types = None
+        self._sec_nameindices = None
+        self._segment_dl = None
         self._axon_fixed = False
         self._axon_deleted = False
 
+    @property
+    def hobj(self):
+        """The NEURON cell object, morphology is only loaded (and any segmentation or axon processing reapplied) the
+        first time it is needed. Readers created from cached segment tables usually never need it.
+        """
+        if self._hobj is None:
+            nrn.load_neuron_modules(None, None)
+            self._hobj = h.Biophys1(self.swc_path)
 
-    def _copy(self):
-        new_swc = SWCReader(swc_path=self.swc_path, rng_seed=self.rng_seed)
-
-        if self._axon_fixed:
-            new_swc.fix_axon()
+            if self._segment_dl is not None:
+                self._segment_hobj(self._segment_dl)
 
-        if self._axon_deleted:
-            new_swc.delete_axon()
+            if self._axon_fixed:
+                self._fix_hobj_axon()
 
+            if self._axon_deleted:
+                self._delete_hobj_axon()
 
+        return self._hobj
 
+    def _copy(self):
+        new_swc = SWCReader(swc_path=self.swc_path, rng_seed=self.rng_seed)
+        new_swc._segment_dl = self._segment_dl
+        new_swc._axon_fixed = self._axon_fixed
+        new_swc._axon_deleted = self._axon_deleted
+        new_swc._sec_types = self._sec_types
+        new_swc._sec_nameindices = self._sec_nameindices
         return new_swc
 
+    @classmethod
+    def from_tables(cls, swc_path, tables, rng_seed=None):
+        """Creates a reader from segment tables previously saved with to_tables() (see SWCCache), without having to
+        parse the morphology.
+        """
+        swc = cls(swc_path, rng_seed=rng_seed)
+        swc._segment_dl = None if np.isnan(tables['segment_dl']) else float(tables['segment_dl'])
+        swc._axon_fixed = bool(tables['axon_fixed'])
+        swc._seg_props = SegmentProps(**{f: tables['seg_props_' + f] for f in SegmentProps._fields})
+        swc._seg_coords = SegmentCoords(**{f: tables['seg_coords_' + f] for f in SegmentCoords._fields})
+        swc._soma_pos = tables['soma_position']
+        swc._nseg = int(tables['nseg'])
+        swc._n_sections = len(tables['sec_types'])
+        swc._sec_types = tables['sec_types']
+        swc._sec_nameindices = tables['sec_nameindices']
+        swc._swc_map = pd.DataFrame({
+            'id': tables['swc_map_id'], 'type': tables['swc_map_type'], 'nameindex': tables['swc_map_nameindex']
+        })
+        return swc
+
+    def to_tables(self):
+        """Returns a dictionary of arrays with the parsed segment properties and coordinates, used to cache the
+        morphology.
+        """
+        tables = {
+            'segment_dl': np.nan if self._segment_dl is None else self._segment_dl,
+            'axon_fixed': self._axon_fixed,
+            'soma_position': self.soma_position,
+            'nseg': self.nseg,
+            'sec_types': self.sec_types,
+            'sec_nameindices': self.sec_nameindices,
+            'swc_map_id': self.swc_map['id'].values,
+            'swc_map_type': self.swc_map['type'].values,
+            'swc_map_nameindex': self.swc_map['nameindex'].values
+        }
+        tables.update({'seg_props_' + f: v for f, v in zip(SegmentProps._fields, self.seg_props)})
+        tables.update({'seg_coords_' + f: v for f, v in zip(SegmentCoords._fields, self.seg_coords)})
+        return tables
+
     @property
     def sections(self):
         if self._sections is None:
+            hobj = self.hobj
             self._sections = []
-            for sec in self.hobj.all:
+            for sec in hobj.all:
                 self._sections.append(sec)
 
         return self._sections
@@ -193,6 +251,20 @@ class SWCReader(object):
 
         return self._nseg
 
+    @property
+    def sec_types(self):
+        """swc type of every section."""
+        if self._sec_types is None:
+            self._sec_types = np.array([self._get_sec_type(sec) for sec in self.sections], dtype=int)
+        return self._sec_types
+
+    @property
+    def sec_nameindices(self):
+        """index of every section within its type, eg. 3 for dend[3]"""
+        if self._sec_nameindices is None:
+            self._sec_nameindices = np.array([self._get_sec_nameindex(sec) for sec in self.sections], dtype=int)
+        return self._sec_nameindices
+
     @property
     def soma_position(self):
         if self._soma_pos is None:
@@ -255,6 +327,10 @@ class SWCReader(object):
 
     def fix_axon(self):
         """Removes and refixes axon"""
+        self._fix_hobj_axon()
+        self._axon_fixed = True
+
+    def _fix_hobj_axon(self):
         axon_diams = [self.hobj.axon[0].diam, self.hobj.axon[0].diam]
         for sec in self.hobj.all:
             section_name = sec.name().split(".")[1][:4]
@@ -276,25 +352,34 @@ class SWCReader(object):
         self.hobj.axon[1].connect(self.hobj.axon[0], 1.0, 0)
 
         h.define_shape()
-
-        self._sections = None
-        self._n_sections = None
-        self._axon_fixed = True
+        self._reset_sections()
 
     def delete_axon(self):
+        self._delete_hobj_axon()
+        self._axon_deleted = True
+
+    def _delete_hobj_axon(self):
         for sec in self.hobj.axon:
             h.delete_section(sec=sec)
 
         h.define_shape()
+        self._reset_sections()
 
+    def _reset_sections(self):
         self._sections = None
         self._n_sections = None
-        self._axon_deleted = True
+        self._nseg = None
+        self._sec_types = None
+        self._sec_nameindices = None
 
     def set_segment_dl(self, dl):
         """Define number of segments in a cell"""
         if self._seg_coords is not None:
             raise RuntimeError('Unable to segment the morphology after coordinates have already been calculated')
+        self._segment_hobj(dl)
+        self._segment_dl = dl
+
+    def _segment_hobj(self, dl):
         self._nseg = 0
         for sec in self.hobj.all:
             sec.nseg = 1 + 2 * int(sec.L/(2*dl))
@@ -352,41 +437,30 @@ class SWCReader(object):
         return tar_seg_ix, tar_seg_prob
 
     def move_and_rotate(self, soma_coords=None, rotation_angles=None, inplace=False):
-        old_seg_coords = self.seg_coords
-        new_p0 = old_seg_coords.p0.copy()
-        new_p1 = old_seg_coords.p1.copy()
-        new_p05 = old_seg_coords.p05.copy()
-        new_soma_pos = self.soma_position.copy()
-
+        # Rotation (around the soma center) and translation are combined into a single affine transform which is
+        # applied to the p0, p1 and p05 coordinates at the same time.
+        soma_pos = self.soma_position.copy()
+        new_soma_pos = soma_pos.copy()
+        rotxyz_mat = np.eye(3)
         if rotation_angles is not None:
             assert(len(rotation_angles) == 3)
-            # try to calc the euler rotation matrix around an arbitary point was causing problems, instead move coords
-            # so the the soma center (p05[0]) is at the origin
-            soma_pos_mat = new_soma_pos.reshape((3, 1))
-            new_p0 = new_p0 - soma_pos_mat
-            new_p1 = new_p1 - soma_pos_mat
-            new_p05 = new_p05 - soma_pos_mat
-
             rotx_mat = rotation_matrix([1, 0, 0], rotation_angles[0])
             roty_mat = rotation_matrix([0, 1, 0], rotation_angles[1])
             rotz_mat = rotation_matrix([0, 0, 1], rotation_angles[2])
             rotxyz_mat = np.dot(rotx_mat, roty_mat.dot(rotz_mat))
 
-            new_p0 = np.dot(rotxyz_mat, new_p0) + soma_pos_mat
-            new_p1 = np.dot(rotxyz_mat, new_p1) + soma_pos_mat
-            new_p05 = np.dot(rotxyz_mat, new_p05) + soma_pos_mat
-
         if soma_coords is not None:
             assert(len(soma_coords) == 3)
-            soma_coords = soma_coords if isinstance(soma_coords, np.ndarray) else np.array(soma_coords)
-            displacement = soma_coords - self.soma_position
-            displacement = displacement.reshape((3, 1))  # Req to allow adding vector to matrix
-            new_p0 += displacement
-            new_p1 += displacement
-            new_p05 += displacement
-            new_soma_pos = soma_coords
+            new_soma_pos = np.array(soma_coords, dtype=float)
 
-        new_seg_coords = SegmentCoords(p0=new_p0, p1=new_p1, p05=new_p05)
+        old_seg_coords = self.seg_coords
+        nseg = old_seg_coords.p0.shape[1]
+        all_coords = np.concatenate((old_seg_coords.p0, old_seg_coords.p1, old_seg_coords.p05), axis=1)
+        all_coords = np.dot(rotxyz_mat, all_coords - soma_pos.reshape((3, 1))) + new_soma_pos.reshape((3, 1))
+
+        new_seg_coords = SegmentCoords(
+            p0=all_coords[:, :nseg], p1=all_coords[:, nseg:2*nseg], p05=all_coords[:, 2*nseg:]
+        )
 
         if inplace:
             self._seg_coords = new_seg_coords
@@ -396,6 +470,7 @@ class SWCReader(object):
             new_swc_reader._seg_props = self.seg_props
             new_swc_reader._swc_map = self._swc_map
             new_swc_reader._nseg = self.nseg
+            new_swc_reader._n_sections = self._n_sections
             new_swc_reader._seg_coords = new_seg_coords
             new_swc_reader._soma_pos = new_soma_pos
 
@@ -409,9 +484,8 @@ class SWCReader(object):
 
     def get_swc_id(self, sec_id, sec_x):
         # use sec type and nameindex to find all rows in the swc that correspond to sec_id
-        sec = self.sections[sec_id]
-        sec_nameindex = self._get_sec_nameindex(sec)
-        sec_type = self._get_sec_type(sec)
+        sec_nameindex = self.sec_nameindices[sec_id]
+        sec_type = self.sec_types[sec_id]
         filtered_swc = self.swc_map[(self.swc_map['type'] == sec_type) & (self.swc_map['nameindex'] == sec_nameindex)]
         swc_ids = filtered_swc['id'].values
 
@@ -440,10 +514,99 @@ class SWCReader(object):
         return int(nameindex_str)
 
 
+class SWCCache(object):
+    """Content-addressed cache of parsed morphologies. Parsing an swc file and building the segments is done only once
+    for each unique combination of morphology file contents, segment length (dL) and axon processing; all cells that
+    share the same morphology get a copy of the segment tables which is then moved and rotated.
+
+    If cache_dir is set the segment tables are also saved to disk (as numpy .npz files) so they can be reused in later
+    runs. The file contents are hashed, so editing/replacing a morphology file will not use out-of-date tables.
+    """
+    version = 1
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._tables = {}  # cache_key --> segment tables
+        self._file_hashes = {}  # swc_path --> (mtime, size, sha1 of file contents)
+
+    def cache_key(self, swc_path, dL=None, fix_axon=False):
+        stat = os.stat(swc_path)
+        file_hash = self._file_hashes.get(swc_path, None)
+        if file_hash is None or file_hash[:2] != (stat.st_mtime, stat.st_size):
+            with open(swc_path, 'rb') as f:
+                file_hash = (stat.st_mtime, stat.st_size, hashlib.sha1(f.read()).hexdigest())
+            self._file_hashes[swc_path] = file_hash
+
+        return '{}_dl{}_{}_v{}'.format(file_hash[2], 'None' if dL is None else repr(float(dL)),
+                                       'fixaxon' if fix_axon else 'noaxonfix', self.version)
+
+    def get(self, swc_path, dL=None, fix_axon=False):
+        """Returns a SWCReader for the given morphology, only parsing the swc if it is not already in the cache."""
+        key = self.cache_key(swc_path, dL=dL, fix_axon=fix_axon)
+        tables = self._tables.get(key, None)
+        if tables is None and self.cache_dir is not None:
+            tables = self._load(key)
+
+        if tables is None:
+            swc = SWCReader(swc_path)
+            if dL:
+                swc.set_segment_dl(dL)
+
+            if fix_axon:
+                swc.fix_axon()
+
+            tables = swc.to_tables()
+            if self.cache_dir is not None:
+                self._save(key, tables)
+
+        self._tables[key] = tables
+        return SWCReader.from_tables(swc_path, tables)
+
+    def clear(self):
+        self._tables = {}
+        self._file_hashes = {}
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _load(self, key):
+        cache_path = self._cache_path(key)
+        if not os.path.exists(cache_path):
+            return None
+
+        with np.load(cache_path) as npz:
+            return {k: npz[k] for k in npz.files}
+
+    def _save(self, key, tables):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        # write to a temp file first so other processes never read a partially written cache
+        fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **tables)
+            os.replace(tmp_path, self._cache_path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
 swc_cache = {}
+morphology_caches = {}  # cache_dir --> SWCCache
 
 
-def get_swc(cell, morphology_dir=None, use_cache=False, dL=None):
+def get_swc(cell, morphology_dir=None, use_cache=False, dL=None, cache_dir=None):
+    """Returns a SWCReader for the cell's morphology, moved and rotated to the cell's position.
+
+    :param cell: node with 'morphology' property
+    :param morphology_dir: directory of the morphology files
+    :param use_cache: if True the reader is cached for each cell, and each morphology file is only parsed once
+    :param dL: max segment length
+    :param cache_dir: directory for storing parsed morphologies so they can be reused across runs (see SWCCache). Only
+        used when use_cache is True.
+    """
     cell_pop = cell.get('population', 'default')
     cell_node_id = cell['node_id']
     if use_cache and cell_pop in swc_cache and cell_node_id in swc_cache[cell_pop]:
@@ -459,12 +622,19 @@ def get_swc(cell, morphology_dir=None, use_cache=False, dL=None):
     if not os.path.exists(swc_path):
         raise ValueError('File {} does not exists.'.format(swc_path))
 
-    swc = SWCReader(swc_path)
-    if dL:
-        swc.set_segment_dl(dL)
+    fix_axon = cell.get('model_processing', 'NULL') == 'aibs_perisomatic'
+    if use_cache:
+        if cache_dir not in morphology_caches:
+            morphology_caches[cache_dir] = SWCCache(cache_dir)
+        swc = morphology_caches[cache_dir].get(swc_path, dL=dL, fix_axon=fix_axon)
+
+    else:
+        swc = SWCReader(swc_path)
+        if dL:
+            swc.set_segment_dl(dL)
 
-    if cell.get('model_processing', 'NULL') == 'aibs_perisomatic':
-        swc.fix_axon()
+        if fix_axon:
+            swc.fix_axon()
 
     if any([cn in cell for cn in ['x', 'y', 'z']]):
         soma_coords = [cell.get('x', 0.0), cell.get('y', 0.0), cell.get('z', 0.0)]
@@ -76,11 +76,12 @@ class ConnectionMap(object):
 
     class ParamsRules(object):
         """A subclass to store indvidiual synpatic parameter rules"""
-        def __init__(self, names, rule, rule_params, dtypes):
+        def __init__(self, names, rule, rule_params, dtypes, iterator='one_to_one'):
             self._names = names
             self._rule = rule
             self._rule_params = rule_params
             self._dtypes = self.__create_dtype_dict(names, dtypes)
+            self._iterator = iterator
 
         def __create_dtype_dict(self, names, dtypes):
             if isinstance(names, list):
@@ -101,6 +102,14 @@ class ConnectionMap(object):
         def dtypes(self):
             return self._dtypes
 
+        @property
+        def iterator(self):
+            return self._iterator
+
+        @property
+        def is_vectorized(self):
+            return self._iterator == 'all_to_all'
+
         def get_prop_dtype(self, prop_name):
             return self._dtypes[prop_name]
 
@@ -171,7 +180,7 @@ class ConnectionMap(object):
     def max_connections(self):
         return len(self._source_nodes) * len(self._target_nodes)
 
-    def add_properties(self, names, rule=None, rule_params=None, values=None, dtypes=None):
+    def add_properties(self, names, rule=None, rule_params=None, values=None, dtypes=None, iterator='one_to_one'):
         """Add a synaptic property for an individual edge.
 
         Typically this requires a custom rule that will be used for every source/target pair of nodes and returns
@@ -205,11 +214,29 @@ class ConnectionMap(object):
                               rule_params={'min_weigth':1.0e-7, 'max_weight': 5.0e-6},
                               dtypes=[np.float, str, np.float])
 
+        For large numbers of edges calling the rule once per edge can be slow. When iterator='all_to_all' the rule will
+        only be called once for all the edges of the connection map. It is passed two pandas DataFrames, the source
+        and target node properties, with one row for each edge (so sources.iloc[i] and targets.iloc[i] are the two
+        nodes of the i-th edge), and should return an array with one value per edge (or a list of arrays when
+        setting multiple properties)::
+
+            def syn_weights_by_dist(sources, targets, max_weight):
+                dists = np.abs(sources['x'].values - targets['x'].values)
+                return max_weight*np.exp(-dists)
+
+            cm.add_properties('syn_weight',
+                              rule=syn_weights_by_dist,
+                              rule_params={'max_weight': 5.0e-6},
+                              dtypes=np.float,
+                              iterator='all_to_all')
+
         :param names: list, or single string, of the property
         :param rule: function, list or value of property
         :param values: A list of values to use for property
         :param rule_params: when rule is a function, rule_params will be passed into function when called.
         :param dtypes: expected property type
+        :param iterator: 'one_to_one' (default) to call rule for every edge, or 'all_to_all' to call the rule once
+            with tables of the source and target node properties of every edge.
         """
         if not (bool(values is not None) != bool(rule is not None)):
             raise ValueError('Please specify either the "rule" or "values" parameters')
@@ -217,11 +244,15 @@ class ConnectionMap(object):
         if values is not None:
             rule = values
 
+        if iterator not in ['one_to_one', 'all_to_all']:
+            raise ValueError('Unknown add_properties iterator "{}".'.format(iterator))
+
         if isinstance(rule, list) or isinstance(rule, np.ndarray):
             rule = ListIterator(rule)
             rule_params = {}
+            iterator = 'one_to_one'
 
-        self._params.append(self.ParamsRules(names, rule, rule_params, dtypes))
+        self._params.append(self.ParamsRules(names, rule, rule_params, dtypes, iterator))
         self._param_keys += names
 
     def connection_itr(self):
@@ -232,6 +263,19 @@ class ConnectionMap(object):
         itr = iterator.create(self.iterator, conr, **({}))
         return itr(self.source_nodes, self.target_nodes, conr)
 
+    @property
+    def is_vectorized(self):
+        """True if the connection rule is called once for all source/target nodes (iterator='all_to_all')."""
+        return self.iterator == 'all_to_all'
+
+    def connection_coo(self):
+        """For 'all_to_all' connection rules, calls the connector once and returns the connectivity as three arrays
+        (src_idxs, trg_idxs, nsyns), where src_idxs/trg_idxs are the positions of the nodes in the source/target node
+        pools.
+        """
+        conr = connector.create(self.connector, **(self.connector_params or {}))
+        return iterator.all_to_all_coo(self.source_nodes, self.target_nodes, conr)
+
 
 class ListIterator(object):
     def __init__(self, my_list):
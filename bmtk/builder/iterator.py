@@ -23,6 +23,7 @@
 import itertools
 import functools
 import types
+import numpy as np
 
 
 class IteratorCache(object):
@@ -111,10 +112,73 @@ def lambda_iterator(source_nodes, target_nodes, lambda_val):
         yield (source.node_id, target.node_id, lambda_val())
 
 
+def all_to_all_coo(source_nodes, target_nodes, connector):
+    """Calls the connector function only once, passing in tables (DataFrames) of all the source and target nodes
+    properties. Returns three arrays (src_idxs, trg_idxs, nsyns) with the row indices of each connected source/target
+    pair, and the number of synapses between them; pairs without any synapses are not included.
+
+    The connector can either return a dense (n_sources x n_targets) matrix of nsyns, a scipy.sparse matrix of the same
+    shape, or a tuple of (src_idxs, trg_idxs, nsyns) arrays. The indices are the row positions of the nodes in the
+    source and target tables (not their node_ids).
+    """
+    sources_table = source_nodes.to_dataframe()
+    targets_table = target_nodes.to_dataframe()
+    n_sources, n_targets = len(sources_table), len(targets_table)
+    if n_sources == 0 or n_targets == 0:
+        empty = np.array([], dtype=np.uint64)
+        return empty, empty, np.array([], dtype=np.uint32)
+
+    vals = connector(sources_table, targets_table)
+    if isinstance(vals, tuple):
+        if len(vals) != 3:
+            raise ValueError('all_to_all connection_rule must return a matrix or a (src_idxs, trg_idxs, nsyns) tuple.')
+        src_idxs, trg_idxs, nsyns = (np.asarray(v).ravel() for v in vals)
+        if not (len(src_idxs) == len(trg_idxs) == len(nsyns)):
+            raise ValueError('all_to_all connection_rule returned (src_idxs, trg_idxs, nsyns) of different lengths.')
+
+    elif hasattr(vals, 'tocoo'):
+        # scipy.sparse matrix
+        if vals.shape != (n_sources, n_targets):
+            raise ValueError('all_to_all connection_rule returned a matrix of shape {}, expected {}.'.format(
+                vals.shape, (n_sources, n_targets)))
+        coo_mat = vals.tocoo()
+        src_idxs, trg_idxs, nsyns = coo_mat.row, coo_mat.col, coo_mat.data
+
+    else:
+        nsyns_mat = np.asarray(vals)
+        if nsyns_mat.shape != (n_sources, n_targets):
+            raise ValueError('all_to_all connection_rule returned a matrix of shape {}, expected {}.'.format(
+                nsyns_mat.shape, (n_sources, n_targets)))
+        src_idxs, trg_idxs = np.nonzero(nsyns_mat)
+        nsyns = nsyns_mat[src_idxs, trg_idxs]
+
+    if len(nsyns) > 0 and np.min(nsyns) < 0:
+        raise ValueError('all_to_all connection_rule returned a negative number of synapses.')
+
+    nonzero_mask = nsyns > 0
+    return (
+        np.asarray(src_idxs[nonzero_mask], dtype=np.uint64),
+        np.asarray(trg_idxs[nonzero_mask], dtype=np.uint64),
+        np.asarray(nsyns[nonzero_mask], dtype=np.uint32)
+    )
+
+
+def all_to_all_iterator(source_nodes, target_nodes, connector):
+    """Calls the connector function once with all sources and all targets, see all_to_all_coo(). Only yields the
+    source/target pairs that have at least one synapse.
+    """
+    src_idxs, trg_idxs, nsyns = all_to_all_coo(source_nodes, target_nodes, connector)
+    source_node_ids = source_nodes.node_ids
+    target_node_ids = target_nodes.node_ids
+    for src_idx, trg_idx, val in zip(src_idxs, trg_idxs, nsyns):
+        yield (int(source_node_ids[src_idx]), int(target_node_ids[trg_idx]), val)
+
+
 ITERATOR_CACHE = IteratorCache()
 register('one_to_one', functools.partial, one_to_one_iterator)
 register('all_to_one', functools.partial, all_to_one_iterator)
 register('one_to_all', functools.partial, one_to_all_iterator)
+register('all_to_all', functools.partial, all_to_all_iterator)
 
 register('one_to_one', list, one_to_one_list_iterator)
 register('one_to_all', list, one_to_all_list_iterator)
@@ -21,19 +21,22 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 import os
+import random
+import multiprocessing
 import numpy as np
 import h5py
 import logging
 
 from .network import Network
 from bmtk.builder.node import Node
+from bmtk.builder.node_table import NodeTable
 from bmtk.builder.edge import Edge
 from bmtk.utils import sonata
 
 from .edges_collator import EdgesCollator
-from .edge_props_table import EdgeTypesTable
+from .edge_props_table import EdgeTypesTable, EdgeTypesTableMemory
 from ..index_builders import create_index_in_memory, create_index_on_disk
-from ..builder_utils import mpi_rank, mpi_size, barrier
+from ..builder_utils import mpi_rank, mpi_size, barrier, build_time_uuid
 from ..edges_sorter import sort_edges
 
 
@@ -48,16 +51,24 @@ class DenseNetwork(Network):
         # self.__networks = {}
         # self.__node_count = 0
         self._nodes = []
+        self._nodes_table = None
         self.__edges_tables = []
         self._target_networks = {}
 
     def _initialize(self):
         self.__id_map = []
         self.__lookup = []
+        self._nodes_table = None
 
     def _add_nodes(self, nodes):
         self._nodes.extend(nodes)
         self._nnodes = len(self._nodes)
+        self._nodes_table = None
+
+    def nodes_table(self):
+        if self._nodes_table is None:
+            self._nodes_table = NodeTable(self._nodes)
+        return self._nodes_table
 
     def edges_table(self):
         return self.__edges_tables
@@ -155,6 +166,7 @@ class DenseNetwork(Network):
         for node in node_pop:
             self._node_id_gen.remove_id(node.node_id)
             self._nodes.append(Node(node.node_id, node.group_props, node.node_type_properties))
+        self._nodes_table = None
 
     def _add_edges(self, connection_map, i):
         """
@@ -162,20 +174,42 @@ class DenseNetwork(Network):
         :param connection_map:
         :param i:
         """
-        edge_type_id = connection_map.edge_type_properties['edge_type_id']
-        logger.debug('Generating edges data for edge_types_id {}.'.format(edge_type_id))
         edges_table = EdgeTypesTable(connection_map, network_name=self.name)
-        connections = connection_map.connection_itr()
-
-        # iterate through all possible SxT source/target pairs and use the user-defined function/list/value to update
-        # the number of syns between each pair. TODO: See if this can be vectorized easily.
-        for conn in connections:
-            if conn[2]:
-                edges_table.set_nsyns(source_id=conn[0], target_id=conn[1], nsyns=conn[2])
+        self._fill_edges_table(connection_map, edges_table)
+        edges_table.save()
+        self._append_edges_table(connection_map, edges_table)
 
+    def _append_edges_table(self, connection_map, edges_table):
         target_net = connection_map.target_nodes
         self._target_networks[target_net.network_name] = target_net.network
 
+        # To EdgeTypesTable the number of synaptic/gap connections between all source/target paris, which can be more
+        # than the number of actual edges stored (for efficency), may be a better user-representation.
+        self._nedges += edges_table.n_syns  # edges_table.n_edges
+        self.__edges_tables.append(edges_table)
+
+    def _fill_edges_table(self, connection_map, edges_table):
+        """Uses the connection-map rules to generate the number of synapses and the edge properties of edges_table.
+
+        :param connection_map: ConnectionMap
+        :param edges_table: EdgeTypesTable
+        """
+        edge_type_id = connection_map.edge_type_properties['edge_type_id']
+        logger.debug('Generating edges data for edge_types_id {}.'.format(edge_type_id))
+
+        if connection_map.is_vectorized:
+            # connection rule is called only once with tables of all the sources and targets, and returns a matrix (or
+            # coo arrays) of the number of syns between each pair.
+            src_idxs, trg_idxs, nsyns = connection_map.connection_coo()
+            edges_table.set_nsyns_coo(source_idxs=src_idxs, target_idxs=trg_idxs, nsyns=nsyns)
+
+        else:
+            # iterate through all possible SxT source/target pairs and use the user-defined function/list/value to
+            # update the number of syns between each pair.
+            for conn in connection_map.connection_itr():
+                if conn[2]:
+                    edges_table.set_nsyns(source_id=conn[0], target_id=conn[1], nsyns=conn[2])
+
         # For when the user specified individual edge properties to be put in the hdf5 (syn_weight, syn_location, etc),
         # get prop value and add it to the edge-types table. Need to fetch and store SxTxN value (where N is the avg
         # num of nsyns between each source/target pair) and it is necessary that the nsyns table be finished.
@@ -183,7 +217,22 @@ class DenseNetwork(Network):
             rule = param.rule
             rets_multiple_vals = isinstance(param.names, (list, tuple, np.ndarray))
 
-            if not rets_multiple_vals:
+            if param.is_vectorized:
+                # rule is called once with the source/target node properties of every edge and returns the arrays
+                pnames = param.names if rets_multiple_vals else [param.names]
+                for prop_name in pnames:
+                    edges_table.create_property(prop_name=prop_name, prop_type=param.dtypes.get(prop_name, None))
+
+                sources_table, targets_table = edges_table.edges_tables()
+                pvals = rule(sources_table, targets_table)
+                pvals = pvals if rets_multiple_vals else [pvals]
+                if len(pvals) != len(pnames):
+                    raise ValueError('Rule for properties {} returned {} arrays.'.format(pnames, len(pvals)))
+
+                for prop_name, prop_vals in zip(pnames, pvals):
+                    edges_table.set_property_values(prop_name=prop_name, prop_values=prop_vals)
+
+            elif not rets_multiple_vals:
                 prop_name = param.names  # name of property
                 prop_type = param.dtypes.get(prop_name, None)
                 edges_table.create_property(prop_name=param.names, prop_type=prop_type)  # initialize property array
@@ -209,12 +258,73 @@ class DenseNetwork(Network):
             edge_type_id, edges_table.n_edges, edges_table.n_syns)
         )
 
-        edges_table.save()
+    def _add_edges_parallel(self, connection_maps, n_workers):
+        """Builds the edges for each connection-map using a pool of n_workers local processes. Each process builds a
+        subset of the edge-types and saves them to a temporary hdf5 table (like when building with MPI), which are then
+        loaded back into memory in the same order as the connection_maps.
 
-        # To EdgeTypesTable the number of synaptic/gap connections between all source/target paris, which can be more
-        # than the number of actual edges stored (for efficency), may be a better user-representation.
-        self._nedges += edges_table.n_syns  # edges_table.n_edges
-        self.__edges_tables.append(edges_table)
+        Uses the fork start-method, so that the workers have access to all the nodes and (possibly non-picklable)
+        connection rules. If not available, or when running with MPI, the edges are built serially.
+        """
+        if mpi_size > 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            logger.warning('Unable to build edges using local processes, building with {} rank(s).'.format(mpi_size))
+            return super(DenseNetwork, self)._add_edges_parallel(connection_maps, n_workers)
+
+        n_workers = min(n_workers, len(connection_maps))
+        worker_cms = assign_connection_maps(connection_maps, n_workers)
+
+        # Seed each worker differently, otherwise every forked process starts with the same random state
+        worker_seeds = np.random.randint(0, 2**31 - 1, size=n_workers)
+        tmp_tables = [get_worker_tmp_table_path(w) for w in range(n_workers)]
+
+        logger.debug('Building {} edge-types using {} processes.'.format(len(connection_maps), n_workers))
+        ctx = multiprocessing.get_context('fork')
+        procs = []
+        for worker_id in range(n_workers):
+            proc = ctx.Process(
+                target=self._build_edges_worker,
+                args=([connection_maps[i] for i in worker_cms[worker_id]], tmp_tables[worker_id],
+                      int(worker_seeds[worker_id]))
+            )
+            proc.start()
+            procs.append(proc)
+
+        for proc in procs:
+            proc.join()
+
+        try:
+            failed = [w for w, proc in enumerate(procs) if proc.exitcode != 0]
+            if failed:
+                raise Exception('Edges building process(es) {} failed.'.format(failed))
+
+            cm_workers = {cm_idx: w for w, cm_idxs in enumerate(worker_cms) for cm_idx in cm_idxs}
+            tmp_h5s = [h5py.File(path, 'r') for path in tmp_tables]
+            for cm_idx, connection_map in enumerate(connection_maps):
+                edge_type_grp_path = '/unprocessed/{}/{}'.format(self.name, connection_map.edge_type_id)
+                tmp_h5 = tmp_h5s[cm_workers[cm_idx]]
+                edges_table = EdgeTypesTableMemory.from_hdf5(
+                    connection_map, network_name=self.name,
+                    edge_type_grp=tmp_h5[edge_type_grp_path] if edge_type_grp_path in tmp_h5 else None
+                )
+                self._append_edges_table(connection_map, edges_table)
+
+            for tmp_h5 in tmp_h5s:
+                tmp_h5.close()
+
+        finally:
+            for path in tmp_tables:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _build_edges_worker(self, connection_maps, tmp_table_path, seed):
+        np.random.seed(seed)
+        random.seed(seed)
+        with h5py.File(tmp_table_path, 'w') as h5:
+            h5.create_group('unprocessed')
+            for connection_map in connection_maps:
+                edges_table = EdgeTypesTableMemory(connection_map, network_name=self.name)
+                self._fill_edges_table(connection_map, edges_table)
+                edges_table.to_hdf5(h5)
 
     def _get_edge_group_id(self, params_hash):
         return int(params_hash)  # pragma: no cover
@@ -410,6 +520,27 @@ class DenseNetwork(Network):
         return self._nedges
 
 
+def get_worker_tmp_table_path(worker_id):
+    return '.edge_types_table.worker.{}.{}.h5'.format(worker_id, build_time_uuid())
+
+
+def assign_connection_maps(connection_maps, n_workers):
+    """Splits the connection-maps across workers, trying to balance the number of source/target pairs each worker has
+    to evaluate (largest first, to the least loaded worker).
+
+    :return: list of size n_workers, the indices of the connection_maps assigned to each worker.
+    """
+    costs = [cm.max_connections() for cm in connection_maps]
+    worker_loads = np.zeros(n_workers)
+    worker_cms = [[] for _ in range(n_workers)]
+    for cm_idx in np.argsort(costs, kind='stable')[::-1]:
+        worker_id = int(np.argmin(worker_loads))
+        worker_cms[worker_id].append(int(cm_idx))
+        worker_loads[worker_id] += costs[cm_idx]
+
+    return [sorted(cm_idxs) for cm_idxs in worker_cms]
+
+
 def add_hdf5_attrs(hdf5_handle):
     # TODO: move this as a utility function
     hdf5_handle['/'].attrs['magic'] = np.uint32(0x0A7A)
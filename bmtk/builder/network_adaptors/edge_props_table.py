@@ -1,4 +1,5 @@
 import os
+import array
 import numpy as np
 import h5py
 import hashlib
@@ -21,6 +22,97 @@ class EdgeTypesTableIFace(object):
         raise NotImplementedError()
 
 
+class NSynsTableSparse(object):
+    """Sparse (COO) storage for the number of synapses between each source/target pair of an edge-type, so that memory
+    scales with the number of connected pairs rather than n_sources x n_targets.
+
+    Updates are appended to compact buffers and consolidated lazily into arrays of (src_idxs, trg_idxs, nsyns) sorted
+    by source then target index, which is the same row-major ordering as a dense SxT table. If the same pair is set
+    more than once the last value is kept, and pairs set to 0 are dropped.
+    """
+
+    def __init__(self, n_sources, n_targets, dtype=np.uint32):
+        self.shape = (n_sources, n_targets)
+        self.dtype = np.dtype(dtype)
+
+        self._src_idxs = np.array([], dtype=np.uint64)
+        self._trg_idxs = np.array([], dtype=np.uint64)
+        self._nsyns = np.array([], dtype=self.dtype)
+
+        # buffers for individual set() calls, and for blocks of coo values
+        self._src_buffer = array.array('Q')
+        self._trg_buffer = array.array('Q')
+        self._nsyns_buffer = array.array('Q')
+        self._blocks = []
+
+    @property
+    def src_idxs(self):
+        self._consolidate()
+        return self._src_idxs
+
+    @property
+    def trg_idxs(self):
+        self._consolidate()
+        return self._trg_idxs
+
+    @property
+    def nsyns(self):
+        self._consolidate()
+        return self._nsyns
+
+    @property
+    def nnz(self):
+        """Number of source/target pairs with at least one synapse."""
+        return len(self.nsyns)
+
+    def sum(self):
+        return int(np.sum(self.nsyns, dtype=np.uint64))
+
+    def set(self, src_idx, trg_idx, nsyns):
+        self._src_buffer.append(int(src_idx))
+        self._trg_buffer.append(int(trg_idx))
+        self._nsyns_buffer.append(int(nsyns))
+
+    def set_coo(self, src_idxs, trg_idxs, nsyns):
+        self._flush_buffer()
+        self._blocks.append((
+            np.asarray(src_idxs, dtype=np.uint64),
+            np.asarray(trg_idxs, dtype=np.uint64),
+            np.asarray(nsyns, dtype=self.dtype)
+        ))
+
+    def _flush_buffer(self):
+        if len(self._nsyns_buffer) > 0:
+            self._blocks.append((
+                np.frombuffer(self._src_buffer, dtype=np.uint64).copy(),
+                np.frombuffer(self._trg_buffer, dtype=np.uint64).copy(),
+                np.frombuffer(self._nsyns_buffer, dtype=np.uint64).astype(self.dtype)
+            ))
+            self._src_buffer = array.array('Q')
+            self._trg_buffer = array.array('Q')
+            self._nsyns_buffer = array.array('Q')
+
+    def _consolidate(self):
+        self._flush_buffer()
+        if not self._blocks:
+            return
+
+        src_idxs = np.concatenate([self._src_idxs] + [b[0] for b in self._blocks])
+        trg_idxs = np.concatenate([self._trg_idxs] + [b[1] for b in self._blocks])
+        nsyns = np.concatenate([self._nsyns] + [b[2] for b in self._blocks])
+        self._blocks = []
+
+        # Use the linear (row-major) index of each pair to sort and remove duplicates, keeping the most recent value.
+        lin_idxs = src_idxs*np.uint64(self.shape[1]) + trg_idxs
+        _, last_idxs = np.unique(lin_idxs[::-1], return_index=True)
+        keep_idxs = len(lin_idxs) - 1 - last_idxs
+        keep_idxs = keep_idxs[nsyns[keep_idxs] > 0]
+
+        self._src_idxs = src_idxs[keep_idxs]
+        self._trg_idxs = trg_idxs[keep_idxs]
+        self._nsyns = nsyns[keep_idxs]
+
+
 class EdgeTypesTableMemory(object):
     """A class for creating and storing the actual connectivity matrix plus all the possible (hdf5 bound) properties
     of an edge - unlike the ConnectionMap class which only stores the unevaluated rules each edge-types. There should
@@ -30,6 +122,8 @@ class EdgeTypesTableMemory(object):
     cells. If individual edge properties (syn_weight, syn_location, etc) and added then it must be stored in a SxTxN
     table, N the avg. number of synapses between each source/target pair. The actually number of edges (ie rows)
     saved in the SONATA file will vary.
+
+    The nsyns table is stored sparsely (see NSynsTableSparse) so memory is proportional to the number of connections.
     """
 
     def __init__(self, connection_map, network_name):
@@ -42,26 +136,23 @@ class EdgeTypesTableMemory(object):
         self.edge_group_id = -1  # This will be assigned later during save_edges
 
         # Create the nsyns table to store the num of synapses/edges between each possible source/target node pair
-        self._nsyns_idx2src = [n.node_id for n in connection_map.source_nodes]
-        self._nsyns_src2idx = {node_id: i for i, node_id in enumerate(self._nsyns_idx2src)}
-        self._nsyns_idx2trg = [n.node_id for n in connection_map.target_nodes]
-        self._nsyns_trg2idx = {node_id: i for i, node_id in enumerate(self._nsyns_idx2trg)}
-        self._nsyns_updated = False
-        self._n_syns = 0
-        self.nsyn_table = np.zeros((len(self._nsyns_idx2src), len(self._nsyns_idx2trg)), dtype=np.uint32)
+        self._nsyns_idx2src = connection_map.source_nodes.node_ids
+        self._nsyns_src2idx = {node_id: i for i, node_id in enumerate(self._nsyns_idx2src.tolist())}
+        self._nsyns_idx2trg = connection_map.target_nodes.node_ids
+        self._nsyns_trg2idx = {node_id: i for i, node_id in enumerate(self._nsyns_idx2trg.tolist())}
+        self.nsyn_table = NSynsTableSparse(len(self._nsyns_idx2src), len(self._nsyns_idx2trg), dtype=np.uint32)
 
         self._prop_vals = {}  # used to store the arrays for each property
         self._prop_node_ids = None  # used to save the source_node_id and target_node_id for each edge
         self._source_nodes_map = None  # map source_node_id --> Node object
         self._target_nodes_map = None  # map target_node_id --> Node object
+        self._source_nodes_table = None  # DataFrame of source node properties
+        self._target_nodes_table = None  # DataFrame of target node properties
 
     @property
     def n_syns(self):
         """Number of synapses."""
-        if self._nsyns_updated:
-            self._nsyns_updated = False
-            self._n_syns = int(np.sum(self.nsyn_table))
-        return self._n_syns
+        return self.nsyn_table.sum()
 
     @property
     def n_edges(self):
@@ -71,34 +162,52 @@ class EdgeTypesTableMemory(object):
         if self._prop_vals:
             return self.n_syns
         else:
-            return np.count_nonzero(self.nsyn_table)
+            return self.nsyn_table.nnz
 
     @property
     def edge_type_node_ids(self):
         """Returns a table n_edges x 2, first column containing source_node_ids and second target_node_ids."""
-        if self._prop_node_ids is None or self._nsyns_updated:
+        if self._prop_node_ids is None:
             if len(self._prop_vals) == 0:
-                # Get the source and target node ids from the rows/columns of nsyns table cells that are greater than 0
-                nsyn_table_flat = self.nsyn_table.ravel()
-                src_trg_prods = np.array(np.meshgrid(self._nsyns_idx2src, self._nsyns_idx2trg)).T.reshape(-1, 2)
-                nonzero_idxs = np.argwhere(nsyn_table_flat > 0).flatten()
-                self._prop_node_ids = src_trg_prods[nonzero_idxs, :].astype(np.uint64)
-
+                self._prop_node_ids = np.zeros((self.n_edges, 2), dtype=np.uint64)
             else:
-                # If there are synaptic properties go through each source/target pair and add their node-ids N times,
-                # where N is the number of synapses between the two nodes
                 self._prop_node_ids = np.zeros((self.n_edges, 2), dtype=np.int64)
-                idx = 0
-                for r, src_id in enumerate(self._nsyns_idx2src):
-                    for c, trg_id in enumerate(self._nsyns_idx2trg):
-                        nsyns = self.nsyn_table[r, c]
 
-                        self._prop_node_ids[idx:(idx + nsyns), 0] = src_id
-                        self._prop_node_ids[idx:(idx + nsyns), 1] = trg_id
-                        idx += nsyns
+            idx_beg = 0
+            for node_ids in self.itr_edge_type_node_ids():
+                idx_end = idx_beg + node_ids.shape[0]
+                self._prop_node_ids[idx_beg:idx_end, :] = node_ids
+                idx_beg = idx_end
 
         return self._prop_node_ids
 
+    def itr_edge_type_node_ids(self, chunk_size=1000000):
+        """Generator that returns the (source_node_id, target_node_id) of each edge, as blocks of n x 2 arrays, without
+        having to create the full n_edges x 2 table in memory.
+
+        If there are no edge properties then there is one edge for every connected source/target pair. Otherwise
+        each pair's node-ids are repeated N times, where N is the number of synapses between the two nodes.
+        """
+        src_idxs = self.nsyn_table.src_idxs
+        trg_idxs = self.nsyn_table.trg_idxs
+        nsyns = self.nsyn_table.nsyns
+        repeat_syns = len(self._prop_vals) > 0
+
+        # chunk by the number of pairs, when repeating node-ids for each synapse use the avg. number of synapses per
+        # pair so that each block has approx. chunk_size rows.
+        pairs_per_chunk = chunk_size
+        if repeat_syns and len(nsyns) > 0:
+            pairs_per_chunk = max(1, int(chunk_size*len(nsyns)/max(self.n_syns, 1)))
+
+        for beg in range(0, len(nsyns), pairs_per_chunk):
+            end = beg + pairs_per_chunk
+            src_ids = self._nsyns_idx2src[src_idxs[beg:end]]
+            trg_ids = self._nsyns_idx2trg[trg_idxs[beg:end]]
+            if repeat_syns:
+                src_ids = np.repeat(src_ids, nsyns[beg:end])
+                trg_ids = np.repeat(trg_ids, nsyns[beg:end])
+            yield np.column_stack((src_ids, trg_ids))
+
     @property
     def source_nodes_map(self):
         if self._source_nodes_map is None:
@@ -111,6 +220,18 @@ class EdgeTypesTableMemory(object):
             self._target_nodes_map = {t.node_id: t for t in self._connection_map.target_nodes}
         return self._target_nodes_map
 
+    @property
+    def source_nodes_table(self):
+        if self._source_nodes_table is None:
+            self._source_nodes_table = self._connection_map.source_nodes.to_dataframe()
+        return self._source_nodes_table
+
+    @property
+    def target_nodes_table(self):
+        if self._target_nodes_table is None:
+            self._target_nodes_table = self._connection_map.target_nodes.to_dataframe()
+        return self._target_nodes_table
+
     @property
     def hash_key(self):
         """Creates a hash key for edge-types based on their (hdf5) properties, for grouping together properties of
@@ -136,37 +257,61 @@ class EdgeTypesTableMemory(object):
 
     def set_nsyns(self, source_id, target_id, nsyns):
         assert(nsyns >= 0)
-        indexed_pair = (self._nsyns_src2idx[source_id], self._nsyns_trg2idx[target_id])
-        self.nsyn_table[indexed_pair] = nsyns
-        self._nsyns_updated = True
+        self.nsyn_table.set(self._nsyns_src2idx[source_id], self._nsyns_trg2idx[target_id], nsyns)
+        self._prop_node_ids = None
+
+    def set_nsyns_coo(self, source_idxs, target_idxs, nsyns):
+        """Sets the number of synapses for many source/target pairs at once, where source_idxs and target_idxs are
+        positions (not node_ids) of the nodes within the connection-map source and target node pools.
+        """
+        nsyns = np.asarray(nsyns)
+        if len(nsyns) == 0:
+            return
+        assert(np.min(nsyns) >= 0)
+        self.nsyn_table.set_coo(source_idxs, target_idxs, nsyns)
+        self._prop_node_ids = None
 
     def create_property(self, prop_name, prop_type=None):
         assert(prop_name not in self._prop_vals)
 
         prop_size = self.n_syns
         self._prop_vals[prop_name] = np.zeros(prop_size, dtype=prop_type)
+        self._prop_node_ids = None
 
     def iter_edges(self):
-        prop_node_ids = self.edge_type_node_ids
         src_nodes_lu = self.source_nodes_map
         trg_nodes_lu = self.target_nodes_map
-        for edge_index in range(self.n_edges):
-            src_id = prop_node_ids[edge_index, 0]
-            trg_id = prop_node_ids[edge_index, 1]
-            source_node = src_nodes_lu[src_id]
-            target_node = trg_nodes_lu[trg_id]
-
-            yield source_node, target_node, edge_index
+        edge_index = 0
+        for node_ids in self.itr_edge_type_node_ids():
+            for src_id, trg_id in node_ids:
+                yield src_nodes_lu[src_id], trg_nodes_lu[trg_id], edge_index
+                edge_index += 1
+
+    def edges_tables(self):
+        """Returns two DataFrames (sources, targets) of the node properties of each edge, the i-th rows of both tables
+        being the source and target nodes of the i-th edge. Used to set the properties of all edges at once.
+        """
+        prop_node_ids = self.edge_type_node_ids
+        src_table = self.source_nodes_table
+        src_rows = pd.Index(src_table['node_id']).get_indexer(prop_node_ids[:, 0])
+        trg_table = self.target_nodes_table
+        trg_rows = pd.Index(trg_table['node_id']).get_indexer(prop_node_ids[:, 1])
+        return src_table.iloc[src_rows].reset_index(drop=True), trg_table.iloc[trg_rows].reset_index(drop=True)
 
     def set_property_value(self, prop_name, edge_index, prop_value):
         self._prop_vals[prop_name][edge_index] = prop_value
 
+    def set_property_values(self, prop_name, prop_values):
+        """Sets the property values of all the edges at once."""
+        prop_values = np.asarray(prop_values)
+        if prop_values.shape[0] != self.n_edges:
+            raise ValueError('Property {} has {} values, expected one value for each of the {} edges.'.format(
+                prop_name, prop_values.shape[0], self.n_edges))
+        self._prop_vals[prop_name][:] = prop_values
+
     def get_property_value(self, prop_name):
         if prop_name == 'nsyns':
-            nsyns_table_flat = self.nsyn_table.ravel()
-            nonzero_indxs = np.argwhere(nsyns_table_flat > 0).flatten()
-
-            return nsyns_table_flat[nonzero_indxs]
+            return self.nsyn_table.nsyns
         else:
             return self._prop_vals[prop_name]
 
@@ -186,6 +331,71 @@ class EdgeTypesTableMemory(object):
     def save(self):
         pass
 
+    def to_hdf5(self, h5_handle):
+        """Writes the edges data into the /unprocessed/<network_name>/<edge_type_id> group of an open temporary hdf5
+        file, the format read by EdgesCollatorMPI and from_hdf5().
+        """
+        src_trg_ids = self.edge_type_node_ids
+        if src_trg_ids.shape[0] == 0:
+            # ignore if no actual edges
+            return
+
+        # Create a new group
+        edge_type_id_str = str(self.edge_type_id)
+        if edge_type_id_str in h5_handle:
+            del h5_handle[edge_type_id_str]
+
+        edge_type_grp = h5_handle.create_group('/unprocessed/{}/{}'.format(self._network_name, edge_type_id_str))
+
+        edge_type_grp.create_dataset('source_node_id', data=src_trg_ids[:, 0])
+        edge_type_grp.create_dataset('target_node_id', data=src_trg_ids[:, 1])
+
+        for prop_mdata in self.get_property_metatadata():
+            pname = prop_mdata['name']
+            ptype = prop_mdata['dtype']
+            pvals = self.get_property_value(pname)
+            edge_type_grp.create_dataset(pname, data=pvals, dtype=ptype)
+            edge_type_grp.attrs['size'] = len(pvals)
+            edge_type_grp.attrs['hash_key'] = self.hash_key
+
+    @classmethod
+    def from_hdf5(cls, connection_map, network_name, edge_type_grp):
+        """Recreates an edge-types table from the data saved by to_hdf5(), eg. by a different process.
+
+        :param connection_map: ConnectionMap used to originally build the table
+        :param network_name: name of network
+        :param edge_type_grp: hdf5 group /unprocessed/<network_name>/<edge_type_id>, or None if there are no edges
+        :return: EdgeTypesTableMemory
+        """
+        edges_table = cls(connection_map, network_name)
+        if edge_type_grp is None:
+            return edges_table
+
+        src_ids = edge_type_grp['source_node_id'][()]
+        trg_ids = edge_type_grp['target_node_id'][()]
+        prop_names = [n for n in edge_type_grp.keys() if n not in ['source_node_id', 'target_node_id']]
+        if prop_names == ['nsyns']:
+            nsyns = edge_type_grp['nsyns'][()]
+        else:
+            # One row for each synapse, with the synapses between the same source/target pair stored consecutively
+            new_pair = np.ones(len(src_ids), dtype=bool)
+            new_pair[1:] = (src_ids[1:] != src_ids[:-1]) | (trg_ids[1:] != trg_ids[:-1])
+            pair_idxs = np.flatnonzero(new_pair)
+            nsyns = np.diff(np.append(pair_idxs, len(src_ids)))
+            src_ids = src_ids[pair_idxs]
+            trg_ids = trg_ids[pair_idxs]
+
+        edges_table.set_nsyns_coo(
+            source_idxs=pd.Index(edges_table._nsyns_idx2src).get_indexer(src_ids),
+            target_idxs=pd.Index(edges_table._nsyns_idx2trg).get_indexer(trg_ids),
+            nsyns=nsyns
+        )
+        for pname in prop_names:
+            if pname != 'nsyns':
+                edges_table._prop_vals[pname] = edge_type_grp[pname][()]
+
+        return edges_table
+
     def free_data(self):
         del self.nsyn_table
         del self._prop_vals
@@ -229,30 +439,12 @@ class EdgeTypesTableMPI(EdgeTypesTableMemory):
         """Saves edges data to hdf5 on the disk so that other ranks can read it (without MPISend)."""
         self._init_tmp_table()
 
-        src_trg_ids = super().edge_type_node_ids
-        if src_trg_ids.shape[0] == 0:
+        if self.edge_type_node_ids.shape[0] == 0:
             # ignore if no actual edges
             return
 
         with h5py.File(self.tmp_table_name, 'r+') as h5:
-            # Create a new group
-            edge_type_id_str = str(self.edge_type_id)
-            if edge_type_id_str in h5:
-                del h5[edge_type_id_str]
-
-            edge_type_grp = h5.create_group('/unprocessed/{}/{}'.format(self._network_name, edge_type_id_str))
-
-            edge_type_grp.create_dataset('source_node_id', data=src_trg_ids[:, 0])
-            edge_type_grp.create_dataset('target_node_id', data=src_trg_ids[:, 1])
-
-            for prop_mdata in super().get_property_metatadata():
-                pname = prop_mdata['name']
-                ptype = prop_mdata['dtype']
-                pvals = super().get_property_value(pname)
-                edge_type_grp.create_dataset(pname, data=pvals, dtype=ptype)
-                edge_type_grp.attrs['size'] = len(pvals)
-                edge_type_grp.attrs['hash_key'] = self.hash_key
-
+            self.to_hdf5(h5)
             h5.flush()
 
     def __del__(self):
@@ -127,6 +127,7 @@ class Network(object):
 
         self._network_conns = set()
         self._connected_networks = {}
+        self._n_workers = 1
 
     @property
     def name(self):
@@ -288,6 +289,22 @@ class Network(object):
             There is also a 'all_to_one' iterator option that will pair each source node with a list of all available
             target nodes.
 
+            For large populations calling a python function for every source/target pair can be very slow. Using the
+            'all_to_all' iterator the connection_rule will only be called once and is passed in two pandas DataFrames
+            containing the properties of all the source and target nodes, one row per node. The function should
+            return either a (n_sources x n_targets) matrix with the number of synapses between each pair, a
+            scipy.sparse matrix, or a tuple of arrays (src_idxs, trg_idxs, nsyns) where src_idxs and trg_idxs are
+            the row positions within the sources and targets tables::
+
+                def vectorized_conn_fnc(sources, targets, max_dist):
+                    src_pos = np.vstack(sources['positions'])
+                    trg_pos = np.vstack(targets['positions'])
+                    dists = np.linalg.norm(src_pos[:, np.newaxis, :] - trg_pos[np.newaxis, :, :], axis=2)
+                    return (dists < max_dist).astype(np.uint32)
+
+                net.add_edges(connection_rule=vectorized_conn_fnc, connection_params={'max_dist': 100.0},
+                              iterator='all_to_all', ...)
+
         Edge Properties:
             Normally the properties used when creating a given type of edge will be shared by all the indvidual
             connections. To create unique values for each edge, the add_edges() method returns a ConnectionMap object::
@@ -314,10 +331,11 @@ class Network(object):
             between each source and target node
         :param connection_params: A dictionary, used when the 'connection_rule' is a function that requires additional
             argments
-        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all'. When 'connection_rule' is a function this sets
-            how the subsets of source/target nodes are passed in. By default (one-to-one) the connection_rule is
-            called for every source/target pair. 'all-to-one' will pass in a list of all possible source nodes for
-            each target, and 'all-to-one' will pass in a list of all possible targets for each source.
+        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all', 'all_to_all'. When 'connection_rule' is a
+            function this sets how the subsets of source/target nodes are passed in. By default (one-to-one) the
+            connection_rule is called for every source/target pair. 'all-to-one' will pass in a list of all possible
+            source nodes for each target, and 'all-to-one' will pass in a list of all possible targets for each source.
+            'all-to-all' will call the connection_rule once with tables of all the sources and targets.
         :param edge_type_properties: properties/attributes of the given edge type
         :return: A ConnectionMap object
         """
@@ -377,7 +395,7 @@ class Network(object):
             connection_rule=connection_rule, iterator=iterator, **edge_type_properties
         )
 
-    def nodes(self, **properties):
+    def nodes(self, property_name=None, **properties):
         """Returns an iterator of Node (glorified dictionary) objects, filtered by parameters.
 
         To get all nodes on a network::
@@ -390,17 +408,31 @@ class Network(object):
             for nod in net.nodes(param1=value1, param2=value2, ...):
                 ...
 
+        Node pools can be combined using |, &, - and ~ operators, and if a property_name is given the nodes can be
+        selected by comparing that property::
+
+            for node in net.nodes(model='biophysical') | (net.nodes('rotation_angle_yaxis') > 0.5):
+                ...
+
+        :param property_name: name of node property to use with comparison operators (<, <=, >, >=, ==, !=)
         :param properties: key-value pair of node attributes to filter returned nodes
         :return: An iterator of Node objects
         """
         if not self.nodes_built:
             self._build_nodes()
 
-        return NodePool(self, **properties)
+        node_pool = NodePool(self, **properties)
+        return node_pool if property_name is None else node_pool.prop(property_name)
 
     def nodes_iter(self, nids=None):
         raise NotImplementedError
 
+    def nodes_table(self):
+        """Returns a NodeTable, a columnar representation of all the nodes used for quickly selecting nodes. Returns
+        None if not supported by the network adaptor.
+        """
+        return None
+
     def edges(self, target_nodes=None, source_nodes=None, target_network=None, source_network=None, **properties):
         """Returns a list of dictionary-like Edge objects, given filter parameters.
 
@@ -520,19 +552,25 @@ class Network(object):
             self._build_nodes()
 
         logger.debug('Building edges.')
-        # for i, conn_map in enumerate(self._connection_maps):
-        for i, conn_map in enumerate(self._connection_maps[mpi_rank::mpi_size]):
-            self._add_edges(conn_map, i)
+        if self._n_workers > 1 and len(self._connection_maps) > 1:
+            self._add_edges_parallel(self._connection_maps, self._n_workers)
+        else:
+            # for i, conn_map in enumerate(self._connection_maps):
+            for i, conn_map in enumerate(self._connection_maps[mpi_rank::mpi_size]):
+                self._add_edges(conn_map, i)
 
         # exit()
         self._edges_built = True
 
-    def build(self, force=False):
+    def build(self, force=False, n_workers=1):
         """Builds nodes and edges.
 
         :param force: set true to force complete rebuilding of nodes and edges, if nodes() or save_nodes() has been
             called before then forcing a rebuild may change gids of each node.
+        :param n_workers: number of local processes used to build the edges (each edge-type is built by one process).
+            Use None to use all available cores. Default 1, ignored when running with MPI.
         """
+        self._n_workers = (os.cpu_count() or 1) if n_workers is None else n_workers
         # if nodes() or save_nodes() is called by user prior to calling build() - make sure the nodes
         # are completely rebuilt (unless a node set has been added).
         if force:
@@ -699,5 +737,9 @@ class Network(object):
     def _add_edges(self, edge_tuples, i):
         raise NotImplementedError
 
+    def _add_edges_parallel(self, connection_maps, n_workers):
+        for i, conn_map in enumerate(connection_maps[mpi_rank::mpi_size]):
+            self._add_edges(conn_map, i)
+
     def _clear(self):
         raise NotImplementedError
@@ -124,7 +124,7 @@ class NetworkBuilder(object):
         """
         self.adaptor.add_nodes(N=N, **properties)
 
-    def nodes(self, **properties):
+    def nodes(self, property_name=None, **properties):
         """Returns an iterator of Node (glorified dictionary) objects, filtered by parameters.
 
         To get all nodes on a network::
@@ -137,10 +137,17 @@ class NetworkBuilder(object):
             for nod in net.nodes(param1=value1, param2=value2, ...):
                 ...
 
+        Node pools can be combined using |, &, - and ~ operators, and if a property_name is given the nodes can be
+        selected by comparing that property::
+
+            for node in net.nodes(model='biophysical') | (net.nodes('rotation_angle_yaxis') > 0.5):
+                ...
+
+        :param property_name: name of node property to use with comparison operators (<, <=, >, >=, ==, !=)
         :param properties: key-value pair of node attributes to filter returned nodes
         :return: An iterator of Node objects
         """
-        return self.adaptor.nodes(**properties)
+        return self.adaptor.nodes(property_name=property_name, **properties)
 
     def add_edges(self, source=None, target=None, connection_rule=1, connection_params=None, iterator='one_to_one',
                   **edge_type_properties):
@@ -203,6 +210,22 @@ class NetworkBuilder(object):
             There is also a 'one_to_all' iterator option that will pair each source node with a list of all available
             target nodes.
 
+            For large populations calling a python function for every source/target pair can be very slow. Using the
+            'all_to_all' iterator the connection_rule will only be called once and is passed in two pandas DataFrames
+            containing the properties of all the source and target nodes, one row per node. The function should
+            return either a (n_sources x n_targets) matrix with the number of synapses between each pair, a
+            scipy.sparse matrix, or a tuple of arrays (src_idxs, trg_idxs, nsyns) where src_idxs and trg_idxs are
+            the row positions within the sources and targets tables::
+
+                def vectorized_conn_fnc(sources, targets, max_dist):
+                    src_pos = np.vstack(sources['positions'])
+                    trg_pos = np.vstack(targets['positions'])
+                    dists = np.linalg.norm(src_pos[:, np.newaxis, :] - trg_pos[np.newaxis, :, :], axis=2)
+                    return (dists < max_dist).astype(np.uint32)
+
+                net.add_edges(connection_rule=vectorized_conn_fnc, connection_params={'max_dist': 100.0},
+                              iterator='all_to_all', ...)
+
         Edge Properties:
             Normally the properties used when creating a given type of edge will be shared by all the individual
             connections. To create unique values for each edge, the add_edges() method returns a ConnectionMap object::
@@ -229,10 +252,11 @@ class NetworkBuilder(object):
             between each source and target node
         :param connection_params: A dictionary, used when the 'connection_rule' is a function that requires additional
             argments
-        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all'. When 'connection_rule' is a function this sets
-            how the subsets of source/target nodes are passed in. By default (one-to-one) the connection_rule is
-            called for every source/target pair. 'all-to-one' will pass in a list of all possible source nodes for
-            each target, and 'one-to-all' will pass in a list of all possible targets for each source.
+        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all', 'all_to_all'. When 'connection_rule' is a
+            function this sets how the subsets of source/target nodes are passed in. By default (one-to-one) the
+            connection_rule is called for every source/target pair. 'all-to-one' will pass in a list of all possible
+            source nodes for each target, and 'one-to-all' will pass in a list of all possible targets for each source.
+            'all-to-all' will call the connection_rule once with tables of all the sources and targets.
         :param edge_type_properties: properties/attributes of the given edge type
         :return: A ConnectionMap object
         """
@@ -275,13 +299,15 @@ class NetworkBuilder(object):
             **properties
         )
 
-    def build(self, force=False):
+    def build(self, force=False, n_workers=1):
         """Builds nodes and edges.
 
         :param force: set true to force complete rebuilding of nodes and edges, if nodes() or save_nodes() has been
             called before then forcing a rebuild may change gids of each node.
+        :param n_workers: number of local processes used to build the edges (each edge-type is built by one process).
+            Use None to use all available cores. Default 1, ignored when running with MPI.
         """
-        self.adaptor.build(force=force)
+        self.adaptor.build(force=force, n_workers=n_workers)
 
     def save(self, output_dir='.', force_overwrite=True, compression='gzip'):
         """Used to save the network files in the appropriate (eg SONATA) format into the output_dir directory. The file
@@ -418,10 +444,11 @@ class BioNetBuilder(NetworkBuilder):
             between each source and target node
         :param connection_params: A dictionary, used when the 'connection_rule' is a function that requires additional
             argments
-        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all'. When 'connection_rule' is a function this sets
-            how the subsets of source/target nodes are passed in. By default (one-to-one) the connection_rule is
-            called for every source/target pair. 'all-to-one' will pass in a list of all possible source nodes for
-            each target, and 'one-to-all' will pass in a list of all possible targets for each source.
+        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all', 'all_to_all'. When 'connection_rule' is a
+            function this sets how the subsets of source/target nodes are passed in. By default (one-to-one) the
+            connection_rule is called for every source/target pair. 'all-to-one' will pass in a list of all possible
+            source nodes for each target, and 'one-to-all' will pass in a list of all possible targets for each source.
+            'all-to-all' will call the connection_rule once with tables of all the sources and targets.
         :param model_template: A predefined or user generated NEURON function name for generating connection. (default:
             exp2syn).
         :param dynamics_params: A json file path or a dictionary of edge/synapse dynamics parameter values used for
@@ -502,10 +529,11 @@ class PointNetBuilder(NetworkBuilder):
             between each source and target node
         :param connection_params: A dictionary, used when the 'connection_rule' is a function that requires additional
             argments
-        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all'. When 'connection_rule' is a function this sets
-            how the subsets of source/target nodes are passed in. By default (one-to-one) the connection_rule is
-            called for every source/target pair. 'all-to-one' will pass in a list of all possible source nodes for
-            each target, and 'one-to-all' will pass in a list of all possible targets for each source.
+        :param iterator: 'one_to_one', 'all_to_one', 'one_to_all', 'all_to_all'. When 'connection_rule' is a
+            function this sets how the subsets of source/target nodes are passed in. By default (one-to-one) the
+            connection_rule is called for every source/target pair. 'all-to-one' will pass in a list of all possible
+            source nodes for each target, and 'one-to-all' will pass in a list of all possible targets for each source.
+            'all-to-all' will call the connection_rule once with tables of all the sources and targets.
         :param model_template: A predefined or user generated NEURON function name for generating connection. (default:
             exp2syn).
         :param dynamics_params: A json file path or a dictionary of edge/synapse dynamics parameter values used for
@@ -20,8 +20,11 @@
 # WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import operator
 from ast import literal_eval
 from six import string_types
+import numpy as np
+import pandas as pd
 
 
 class NodePool(object):
@@ -31,29 +34,211 @@ class NodePool(object):
     saved by the network, this just stores the query information and provides iterator methods for accessing different
     nodes.
 
-    TODO:
-        * Implement a collection-set algebra including | and not operators. ie.
-            nodes = net.nodes(type=1) | net.nodes(type=2)
-        * Implement operators on properties
-            nodes = net.nodes(val) > 100
-            nodes = 100 in net.nodes(val)
+    Node pools of the same network can be combined using set operators, and if a pool was created with a property name
+    it can be compared against a value to select the nodes by that property::
+
+        nodes = net.nodes(type=1) | net.nodes(type=2)  # union
+        nodes = net.nodes(ei='e') & net.nodes(location='L4')  # intersection
+        nodes = net.nodes(ei='e') - net.nodes(location='L4')  # difference
+        nodes = ~net.nodes(ei='e')  # all nodes not in the pool
+        nodes = net.nodes('val') > 100
+        nodes = (net.nodes('val', ei='e') >= 10) & (net.nodes('val') < 20)
+        has_val = 100 in net.nodes('val')
+
+    Combined pools are evaluated lazily, only when they are iterated over. The selected nodes are cached and will only
+    be recalculated if the network's nodes have changed, so a pool used by multiple add_edges() calls is only evaluated
+    once.
     """
 
     def __init__(self, network, **properties):
         self.__network = network
         self.__properties = properties
         self.__filter_str = None
+        self.__selection = None  # row indices of matching nodes in the network's NodeTable
+        self.__selection_table = None  # the NodeTable used to create the current selection
+        self.__operation = None  # key into _operations when pool is the result of combining/comparing other pools
+        self.__operands = None  # NodePools (and compare value) the operation is applied to
+        self.__property_name = None  # property used for comparisons, eg net.nodes('val') > 100
+
+    @classmethod
+    def _from_operation(cls, network, operation, operands, property_name=None):
+        node_pool = cls(network)
+        node_pool.__operation = operation
+        node_pool.__operands = operands
+        node_pool.__property_name = property_name
+        return node_pool
 
     def __len__(self):
-        return sum(1 for _ in self)
+        selection = self._get_selection()
+        if selection is None:
+            return sum(1 for _ in self)
+        return len(selection)
 
     def __iter__(self):
-        return (n for n in self.__network.nodes_iter() if self.__query_object_properties(n, self.__properties))
+        selection = self._get_selection()
+        if selection is None:
+            return (n for n in self.__network.nodes_iter() if self._match_node(n))
+
+        nodes = self.__selection_table.nodes
+        return (nodes[i] for i in selection)
+
+    def __contains__(self, item):
+        """Either check if a node is in the pool, or if the pool has a property_name then check if any of the nodes in
+        the pool has a matching property value; eg 100 in net.nodes('val')
+        """
+        if self.__property_name is None:
+            node_id = item.node_id if hasattr(item, 'node_id') else item
+            return bool(np.any(self.node_ids == node_id))
+
+        return len(self == item) > 0
+
+    def _get_selection(self):
+        """Returns the row indices of the selected nodes in the network's NodeTable. The selection is only reevaluated
+        if the network nodes have changed. Returns None if the network doesn't support node tables.
+        """
+        nodes_table = self.__network.nodes_table()
+        if nodes_table is None:
+            return None
+
+        if self.__selection_table is not nodes_table:
+            if self.__operation is None:
+                self.__selection = nodes_table.select(self.__properties)
+            else:
+                self.__selection = self.__select_operation(nodes_table)
+            self.__selection_table = nodes_table
+
+        return self.__selection
+
+    def __select_operation(self, nodes_table):
+        op, operands = self.__operation, self.__operands
+        if op == 'property':
+            return operands[0]._get_selection()
+        elif op == '|':
+            return np.union1d(operands[0]._get_selection(), operands[1]._get_selection())
+        elif op == '&':
+            return np.intersect1d(operands[0]._get_selection(), operands[1]._get_selection(), assume_unique=True)
+        elif op == '-':
+            return np.setdiff1d(operands[0]._get_selection(), operands[1]._get_selection(), assume_unique=True)
+        elif op == '~':
+            return np.setdiff1d(np.arange(len(nodes_table)), operands[0]._get_selection(), assume_unique=True)
+        else:
+            return nodes_table.compare(self.__property_name, _comparisons[op], operands[1],
+                                       rows=operands[0]._get_selection())
+
+    def _match_node(self, node):
+        """Checks if an individual node is part of the pool, used when the network doesn't support node tables."""
+        op, operands = self.__operation, self.__operands
+        if op is None:
+            return self.__query_object_properties(node, self.__properties)
+        elif op == 'property':
+            return operands[0]._match_node(node)
+        elif op == '|':
+            return operands[0]._match_node(node) or operands[1]._match_node(node)
+        elif op == '&':
+            return operands[0]._match_node(node) and operands[1]._match_node(node)
+        elif op == '-':
+            return operands[0]._match_node(node) and not operands[1]._match_node(node)
+        elif op == '~':
+            return not operands[0]._match_node(node)
+        else:
+            node_val = node.get(self.__property_name, None)
+            if node_val is None or not operands[0]._match_node(node):
+                return False
+            try:
+                return bool(_comparisons[op](node_val, operands[1]))
+            except (TypeError, ValueError):
+                return False
+
+    def prop(self, property_name):
+        """Returns the same set of nodes, with property_name being used for comparisons operators. Same as calling
+        net.nodes(property_name, **properties).
+
+        :param property_name: name of node property, eg. net.nodes(ei='e').prop('val') > 100
+        :return: A NodePool
+        """
+        return NodePool._from_operation(self.__network, 'property', [self], property_name=property_name)
+
+    @property
+    def property_name(self):
+        return self.__property_name
+
+    @property
+    def node_ids(self):
+        """Array of the node_ids of all the nodes in the pool."""
+        selection = self._get_selection()
+        if selection is None:
+            return np.array([n.node_id for n in self], dtype=np.uint64)
+        return self.__selection_table.get_column('node_id', selection).astype(np.uint64)
+
+    def __combine(self, other, op):
+        if not isinstance(other, NodePool):
+            return NotImplemented
+        if other.network is not self.__network:
+            raise ValueError('Unable to use operator {} on nodes from different networks ({}, {}).'.format(
+                op, self.network_name, other.network_name))
+        return NodePool._from_operation(self.__network, op, [self, other])
+
+    def __or__(self, other):
+        return self.__combine(other, '|')
+
+    def __and__(self, other):
+        return self.__combine(other, '&')
+
+    def __sub__(self, other):
+        return self.__combine(other, '-')
+
+    def __invert__(self):
+        return NodePool._from_operation(self.__network, '~', [self])
+
+    def __compare(self, value, op):
+        if self.__property_name is None:
+            if op in ['==', '!=']:
+                return NotImplemented
+            raise ValueError('Unable to compare node pool, no property name specified, eg. net.nodes(prop_name) {} '
+                             'value'.format(op))
+        return NodePool._from_operation(self.__network, op, [self, value], property_name=self.__property_name)
+
+    def __eq__(self, value):
+        return self.__compare(value, '==')
+
+    def __ne__(self, value):
+        return self.__compare(value, '!=')
+
+    def __lt__(self, value):
+        return self.__compare(value, '<')
+
+    def __le__(self, value):
+        return self.__compare(value, '<=')
+
+    def __gt__(self, value):
+        return self.__compare(value, '>')
+
+    def __ge__(self, value):
+        return self.__compare(value, '>=')
+
+    __hash__ = object.__hash__
 
     @property
     def network(self):
         return self.__network
 
+    def to_dataframe(self):
+        """Returns a pandas DataFrame of the nodes in the pool, one row for every node and one column for every node
+        (and node-type) property. Properties not shared by all the nodes will have None values.
+        """
+        selection = self._get_selection()
+        if selection is not None:
+            return self.__selection_table.to_dataframe(selection)
+
+        nodes = list(self)
+        columns = ['node_id', 'node_type_id']
+        for node in nodes:
+            for key in list(node.params.keys()) + list(node.node_type_properties.keys()):
+                if key not in columns:
+                    columns.append(key)
+
+        return pd.DataFrame({col: [n.get(col, None) for n in nodes] for col in columns}, columns=columns)
+
     @property
     def network_name(self):
         return self.__network.name
@@ -61,7 +246,18 @@ class NodePool(object):
     @property
     def filter_str(self):
         if self.__filter_str is None:
-            if len(self.__properties) == 0:
+            op, operands = self.__operation, self.__operands
+            if op == 'property':
+                self.__filter_str = operands[0].filter_str
+            elif op in ['|', '&', '-']:
+                self.__filter_str = '({}){}({})'.format(operands[0].filter_str, op, operands[1].filter_str)
+            elif op == '~':
+                self.__filter_str = '~({})'.format(operands[0].filter_str)
+            elif op is not None:
+                conditional = '{}{}{!r}'.format(self.__property_name, op, operands[1])
+                base_str = operands[0].filter_str
+                self.__filter_str = conditional if base_str == '*' else '{}&{}'.format(base_str, conditional)
+            elif len(self.__properties) == 0:
                 self.__filter_str = '*'
             else:
                 self.__filter_str = ''
@@ -104,3 +300,13 @@ class NodePool(object):
                 return False
 
         return True
+
+
+_comparisons = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
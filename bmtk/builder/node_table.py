@@ -0,0 +1,281 @@
+# Copyright 2017. Allen Institute. All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+# disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+# disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import numbers
+import numpy as np
+import pandas as pd
+from six import string_types
+
+
+class NodeTable(object):
+    """Columnar (numpy) representation of all the nodes in a network, used for quickly selecting subsets of nodes.
+
+    Every node (and node-type) property is stored as an array with one value per node, in the same order as the list
+    of Node objects. If a property only exists for some of the nodes a "present" mask is also kept for the column.
+    Selections (see select() method) are returned as an array of row indices, and are cached so that the same
+    filter used multiple times, eg. net.nodes(ei='e'), only needs to be evaluated once.
+
+    The table should be rebuilt every time nodes are added to the network.
+    """
+
+    def __init__(self, nodes):
+        self._nodes = nodes
+        self._n_nodes = len(nodes)
+        self._columns = {}
+        self._present = {}  # column_name --> bool array, or None when property exists for all nodes
+        self._selection_cache = {}
+        self._build_columns()
+
+    @property
+    def nodes(self):
+        """List of Node objects, in the same order as the rows of the table."""
+        return self._nodes
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def __len__(self):
+        return self._n_nodes
+
+    def _build_columns(self):
+        # Nodes created by the same add_nodes() call share the same node-type properties and have the same params,
+        # group them together so the node-type values can be set in bulk.
+        col_chunks = {}
+        beg = 0
+        while beg < self._n_nodes:
+            node_type_props = self._nodes[beg].node_type_properties
+            param_keys = list(self._nodes[beg].params.keys())
+            end = beg + 1
+            while end < self._n_nodes and self._nodes[end].node_type_properties is node_type_props \
+                    and list(self._nodes[end].params.keys()) == param_keys:
+                end += 1
+
+            group = self._nodes[beg:end]
+            for key in param_keys:
+                col_chunks.setdefault(key, []).append((beg, end, [n.params[key] for n in group]))
+            for key, val in node_type_props.items():
+                if key not in param_keys:
+                    col_chunks.setdefault(key, []).append((beg, end, val))
+            beg = end
+
+        for col_name, chunks in col_chunks.items():
+            values = np.empty(self._n_nodes, dtype=object)
+            present = np.zeros(self._n_nodes, dtype=bool)
+            for beg, end, vals in chunks:
+                if isinstance(vals, list):
+                    values[beg:end] = _to_object_array(vals)
+                else:
+                    values[beg:end] = [vals]*(end - beg)
+                present[beg:end] = True
+
+            if present.all():
+                self._columns[col_name] = _try_typed_array(values)
+                self._present[col_name] = None
+            else:
+                self._columns[col_name] = values
+                self._present[col_name] = present
+
+    def get_column(self, col_name, rows=None):
+        """Returns the values of a property for the given row indices (or all nodes). Nodes missing the property will
+        have value None.
+        """
+        values = self._columns[col_name]
+        return values if rows is None else values[rows]
+
+    def has_column(self, col_name, rows=None):
+        """Returns a bool array for whether or not each node has the given property."""
+        present = self._present.get(col_name, None)
+        if col_name not in self._columns:
+            present = np.zeros(self._n_nodes, dtype=bool)
+        elif present is None:
+            present = np.ones(self._n_nodes, dtype=bool)
+        return present if rows is None else present[rows]
+
+    def select(self, filters):
+        """Find the row indices of all nodes that match the filter, using the same rules as NodePool; a node matches if
+        for every key it has a non-None value and the value either equals the filter value, is in a filter list, or
+        returns True when passed to a filter function.
+
+        :param filters: dictionary of property_name --> value/list/function
+        :return: sorted array of row indices
+        """
+        cache_key = _filter_cache_key(filters)
+        if cache_key is not None and cache_key in self._selection_cache:
+            return self._selection_cache[cache_key]
+
+        mask = np.ones(self._n_nodes, dtype=bool)
+        for col_name, filter_val in filters.items():
+            if col_name not in self._columns:
+                mask[:] = False
+                break
+
+            values = self._columns[col_name]
+            if values.dtype == object:
+                # missing or None values never match
+                mask &= self.has_column(col_name) & np.array([v is not None for v in values], dtype=bool)
+
+            if callable(filter_val):
+                # only call the function for nodes that haven't been filtered out already
+                rows = np.flatnonzero(mask)
+                mask[rows] = [bool(filter_val(v)) for v in values[rows]]
+            elif isinstance(filter_val, list):
+                mask &= _match_list(values, filter_val)
+            else:
+                mask &= _match_value(values, filter_val)
+
+        selection = np.flatnonzero(mask)
+        if cache_key is not None:
+            self._selection_cache[cache_key] = selection
+        return selection
+
+    def compare(self, col_name, compare_fnc, value, rows=None):
+        """Find the row indices of all nodes where compare_fnc(property_value, value) is True. Nodes without the
+        property (or with value None) are never selected.
+
+        :param col_name: name of property
+        :param compare_fnc: comparison function, eg operator.gt
+        :param value: value to compare node properties against
+        :param rows: subset of row indices to search, default all nodes
+        :return: sorted array of row indices
+        """
+        rows = np.arange(self._n_nodes) if rows is None else rows
+        if col_name not in self._columns:
+            return rows[:0]
+
+        values = self._columns[col_name][rows]
+        if values.dtype != object:
+            try:
+                matches = compare_fnc(values, value)
+                if isinstance(matches, np.ndarray) and matches.shape == values.shape and matches.dtype == bool:
+                    return rows[matches]
+            except (TypeError, ValueError):
+                pass
+
+        def safe_cmp(v):
+            try:
+                return v is not None and bool(compare_fnc(v, value))
+            except (TypeError, ValueError):
+                return False
+
+        present = self.has_column(col_name, rows)
+        matches = np.array([p and safe_cmp(v) for p, v in zip(present, values)], dtype=bool)
+        return rows[matches]
+
+    def to_dataframe(self, rows=None):
+        """Returns a DataFrame of the selected rows, containing only the properties that exist for at least one of the
+        selected nodes.
+        """
+        rows = np.arange(self._n_nodes) if rows is None else rows
+        columns = [c for c in ['node_id', 'node_type_id'] if c in self._columns]
+        columns += [c for c in self._columns.keys() if c not in columns]
+        data = {}
+        for col_name in columns:
+            present = self.has_column(col_name, rows)
+            if present.all() and self._present[col_name] is not None:
+                # property exists for all the selected nodes but not for the entire network
+                data[col_name] = _try_typed_array(self._columns[col_name][rows])
+            elif present.any() or col_name in ['node_id', 'node_type_id']:
+                data[col_name] = self._columns[col_name][rows]
+
+        return pd.DataFrame(data, columns=list(data.keys()))
+
+
+def _to_object_array(values):
+    # np.array(values, dtype=object) would create a 2D array when the values are tuples/lists (eg. positions)
+    obj_array = np.empty(len(values), dtype=object)
+    if len(values) > 0 and isinstance(values[0], (tuple, list, np.ndarray)):
+        for i, v in enumerate(values):
+            obj_array[i] = v
+    else:
+        obj_array[:] = values
+    return obj_array
+
+
+def _try_typed_array(values):
+    """Converts an object array into a numeric or string array, when all the values are numbers or all strings."""
+    if len(values) == 0:
+        return values
+
+    if all(isinstance(v, numbers.Number) and not isinstance(v, (bool, np.bool_)) for v in values):
+        typed_array = np.array(values.tolist())
+    elif all(isinstance(v, string_types) for v in values):
+        typed_array = np.array(values.tolist(), dtype=str)
+    else:
+        return values
+
+    return typed_array if typed_array.ndim == 1 and typed_array.dtype != object else values
+
+
+def _match_value(values, filter_val):
+    if values.dtype != object:
+        try:
+            matches = values == filter_val
+            if isinstance(matches, np.ndarray) and matches.shape == values.shape:
+                return matches
+        except (TypeError, ValueError):
+            pass
+
+    def safe_eq(v):
+        try:
+            return bool(v == filter_val)
+        except (TypeError, ValueError):
+            return False
+
+    return np.array([safe_eq(v) for v in values], dtype=bool)
+
+
+def _match_list(values, filter_list):
+    # np.isin() converts the list into a single dtype, only use it when the values and list are the same kind.
+    if values.dtype.kind in 'iuf' and all(isinstance(v, numbers.Number) for v in filter_list):
+        return np.isin(values, filter_list)
+    elif values.dtype.kind == 'U' and all(isinstance(v, string_types) for v in filter_list):
+        return np.isin(values, filter_list)
+
+    def safe_in(v):
+        try:
+            return v in filter_list
+        except (TypeError, ValueError):
+            return False
+
+    return np.array([safe_in(v) for v in values], dtype=bool)
+
+
+def _filter_cache_key(filters):
+    """Creates a hashable key from a filters dictionary, or returns None if it is not possible to cache (eg. filter
+    contains functions, which may have side-effects).
+    """
+    key = []
+    for k in sorted(filters.keys()):
+        val = filters[k]
+        if callable(val):
+            return None
+        elif isinstance(val, list):
+            val = ('__list__', ) + tuple(val)
+        key.append((k, val))
+
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
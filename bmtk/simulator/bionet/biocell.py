@@ -199,6 +199,62 @@ class BioCell(Cell):
                 self._src_gids += [src_node.node_id]*edge_prop.nsyns
                 return self._set_connections(edge_prop, src_node, syn_weight, stim)
 
+    def set_syn_connections(self, edges):
+        """Sets up the synapses for a list of incoming (non gap-junction) edges, same as calling set_syn_connection()
+        for each edge in order but faster when there are a lot of edges.
+
+        Rather than calling prng.choice() for every edge, uniform values for all the synapses of all the edges are
+        drawn from prng at once, and each edge's synapse locations are found with a searchsorted() on the cached
+        cdf of its target_sections/target_distance. Values are drawn in the same order, so the synapses are placed in
+        exactly the same locations as when set one edge at a time.
+
+        :param edges: list of (edge_prop, src_node, stim) tuples, stim may be None.
+        :return: list of the number of synapses created for each edge.
+        """
+        # Find the target segments of all the edges without preselected targets
+        placements = []
+        n_syns_total = 0
+        for edge_prop, src_node, stim in edges:
+            if edge_prop.is_gap_junction:
+                raise Exception("Gap junctions must be set with set_syn_connection.")
+            elif edge_prop.preselected_targets:
+                placements.append(None)
+                continue
+
+            tar_seg_ix, tar_seg_cdf = self.morphology.find_sections_cdf(
+                section_names=edge_prop.target_sections,
+                distance_range=edge_prop.target_distance
+            )
+            if len(tar_seg_ix) == 0:
+                # no random values are used, _set_connections will log the warning
+                placements.append(None)
+                continue
+
+            nsyns = edge_prop.nsyns
+            placements.append((tar_seg_ix, tar_seg_cdf, n_syns_total, n_syns_total + nsyns))
+            n_syns_total += nsyns
+
+        rand_vals = self.prng.random_sample(n_syns_total)
+
+        syns_counts = []
+        for (edge_prop, src_node, stim), placement in zip(edges, placements):
+            segs_ix = None
+            if placement is not None:
+                tar_seg_ix, tar_seg_cdf, beg, end = placement
+                segs_ix = tar_seg_ix[tar_seg_cdf.searchsorted(rand_vals[beg:end], side='right')]
+
+            syn_weight = edge_prop.syn_weight(src_node=src_node, trg_node=self._node)
+            if edge_prop.preselected_targets:
+                self._edge_props.append(edge_prop)
+                self._src_gids.append(src_node.node_id)
+                syns_counts.append(self._set_connection_preselected(edge_prop, src_node, syn_weight, stim))
+            else:
+                self._edge_props += [edge_prop]*edge_prop.nsyns
+                self._src_gids += [src_node.node_id]*edge_prop.nsyns
+                syns_counts.append(self._set_connections(edge_prop, src_node, syn_weight, stim, segs_ix=segs_ix))
+
+        return syns_counts
+
     def _set_gap_junc_preselected(self, edge_prop, src_node, syn_weight, gj_ids):
         if edge_prop.nsyns < 1:
             return 1
@@ -305,20 +361,23 @@ class BioCell(Cell):
 
         return 1
 
-    def _set_connections(self, edge_prop, src_node, syn_weight, stim=None):
-        tar_seg_ix, tar_seg_prob = self.morphology.find_sections(
-            section_names=edge_prop.target_sections,
-            distance_range=edge_prop.target_distance,
-            cache=True
-        )
+    def _set_connections(self, edge_prop, src_node, syn_weight, stim=None, segs_ix=None):
         nsyns = edge_prop.nsyns
+        if segs_ix is None:
+            tar_seg_ix, tar_seg_prob = self.morphology.find_sections(
+                section_names=edge_prop.target_sections,
+                distance_range=edge_prop.target_distance,
+                cache=True
+            )
 
-        if len(tar_seg_ix) == 0:
-            msg = 'Could not find target synaptic location for edge-type {}, Please check target_section and/or distance_range properties'.format(edge_prop.edge_type_id)
-            io.log_warning(msg, all_ranks=True, display_once=True)
-            return 0
+            if len(tar_seg_ix) == 0:
+                msg = 'Could not find target synaptic location for edge-type {}, Please check target_section and/or ' \
+                      'distance_range properties'.format(edge_prop.edge_type_id)
+                io.log_warning(msg, all_ranks=True, display_once=True)
+                return 0
+
+            segs_ix = self.prng.choice(tar_seg_ix, nsyns, p=tar_seg_prob)
 
-        segs_ix = self.prng.choice(tar_seg_ix, nsyns, p=tar_seg_prob)
         secs = self._secs[segs_ix]  # sections where synapases connect
         xs = self.morphology.seg_props.x[segs_ix]  # distance along the section where synapse connects, i.e., seg_x
 
@@ -331,12 +390,14 @@ class BioCell(Cell):
         # TODO: Don't save this if not needed
         self._edge_type_ids.extend([edge_prop.edge_type_id]*len(synapses))
 
+        if not stim:
+            src_gid = self._network.gid_pool.get_gid(name=src_node.population_name, node_id=src_node.node_id)
+
         for syn in synapses:
             # connect synapses
             if stim:
                 nc = h.NetCon(stim.hobj, syn)
             else:
-                src_gid = self._network.gid_pool.get_gid(name=src_node.population_name, node_id=src_node.node_id)
                 nc = pc.gid_connect(src_gid, syn)
 
             nc.weight[0] = syn_weight
@@ -379,7 +440,8 @@ class BioCell(Cell):
     def setup_ecp(self):
         self.im_ptr = h.PtrVector(self.morphology.nseg)  # pointer vector
         # used for gathering an array of  i_membrane values from the pointer vector
-        self.im_ptr.ptr_update_callback(self.set_im_ptr)
+        if hasattr(self.im_ptr, 'ptr_update_callback'):
+            self.im_ptr.ptr_update_callback(self.set_im_ptr)
         self.imVec = h.Vector(self.morphology.nseg)
 
         self.__set_extracell_mechanism()
@@ -388,7 +450,9 @@ class BioCell(Cell):
 
     def setup_xstim(self, set_nrn_mechanism=True):
         self.ptr2e_extracellular = h.PtrVector(self.morphology.nseg)
-        self.ptr2e_extracellular.ptr_update_callback(self.set_ptr2e_extracellular)
+        if hasattr(self.ptr2e_extracellular, 'ptr_update_callback'):
+            # not needed (nor available) in newer versions of NEURON
+            self.ptr2e_extracellular.ptr_update_callback(self.set_ptr2e_extracellular)
 
         # Set the e_extracellular mechanism for all sections on this hoc object
         if set_nrn_mechanism:
@@ -480,18 +544,20 @@ class BioCellSpontSyn(BioCell):
         
         return True
 
-    def _set_connections(self, edge_prop, src_node, syn_weight, stim=None):
-        tar_seg_ix, tar_seg_prob = self.morphology.find_sections(
-            section_names=edge_prop.target_sections,
-            distance_range=edge_prop.target_distance,
-            cache=True
-        )
+    def _set_connections(self, edge_prop, src_node, syn_weight, stim=None, segs_ix=None):
         # tar_seg_ix, tar_seg_prob = self.morphology.get_target_segments(edge_prop)
         src_gid = src_node.node_id
         nsyns = edge_prop.nsyns
 
-        # choose nsyn elements from seg_ix with probability proportional to segment area
-        segs_ix = self.prng.choice(tar_seg_ix, nsyns, p=tar_seg_prob)
+        if segs_ix is None:
+            tar_seg_ix, tar_seg_prob = self.morphology.find_sections(
+                section_names=edge_prop.target_sections,
+                distance_range=edge_prop.target_distance,
+                cache=True
+            )
+
+            # choose nsyn elements from seg_ix with probability proportional to segment area
+            segs_ix = self.prng.choice(tar_seg_ix, nsyns, p=tar_seg_prob)
         secs = self._secs[segs_ix]  # sections where synapases connect
         xs = self.morphology.seg_props.x[segs_ix]  # distance along the section where synapse connects, i.e., seg_x
 
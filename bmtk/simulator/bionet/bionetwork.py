@@ -22,6 +22,7 @@
 #
 import os
 import numpy as np
+from six import string_types
 from neuron import h
 
 from bmtk.simulator.core.simulator_network import SimNetwork
@@ -33,6 +34,7 @@ from bmtk.simulator.bionet.virtualcell import VirtualCell
 from bmtk.simulator.bionet.morphology import Morphology
 from bmtk.simulator.bionet.io_tools import io
 from bmtk.simulator.bionet import nrn
+from bmtk.simulator.bionet import load_balance
 from bmtk.simulator.bionet.sonata_adaptors import BioNodeAdaptor, BioEdgeAdaptor
 from .gids import GidPool
 
@@ -76,6 +78,9 @@ class BioNetwork(SimNetwork):
 
         self._gid_pool = GidPool()
 
+        self.load_balance = None  # method (or dict of options) used to distribute cells, None for round-robin
+        self._predicted_load_balance = None
+
         self.has_spont_syns = False
         self.spont_syns_filter_pre = None
         self.spont_syns_filter_post = None
@@ -171,12 +176,60 @@ class BioNetwork(SimNetwork):
         self._node_adaptors['sonata'] = BioNodeAdaptor
         self._edge_adaptors['sonata'] = BioEdgeAdaptor
 
+    @property
+    def predicted_load_balance(self):
+        return self._predicted_load_balance
+
+    def _distribute_nodes(self):
+        """Uses the load_balance option to estimate the cost of every cell and determine which cells will be built on
+        the current rank. Returns a dictionary of population --> row indicies, or None to use round-robin.
+        """
+        if self.load_balance is None:
+            return None
+
+        if isinstance(self.load_balance, string_types):
+            lb_opts = {'method': self.load_balance}
+        else:
+            lb_opts = dict(self.load_balance)
+
+        method = lb_opts.get('method', 'round_robin')
+        if method not in load_balance.partition_methods:
+            self.io.log_exception('Unknown load_balance method "{}", options: {}.'.format(
+                method, ', '.join(load_balance.partition_methods.keys())))
+
+        node_pops = [node_pop for node_pop in self.node_populations if not node_pop.virtual_nodes_only]
+        pop_costs = []
+        for node_pop in node_pops:
+            edge_pops = [ep for ep in self._edge_populations if ep.target_nodes == node_pop.name]
+            pop_costs.append(load_balance.estimate_cell_costs(
+                node_pop, edge_pops, dL=self.dL,
+                compartment_cost=lb_opts.get('compartment_cost', load_balance.DEFAULT_COMPARTMENT_COST),
+                synapse_cost=lb_opts.get('synapse_cost', load_balance.DEFAULT_SYNAPSE_COST),
+                io=self.io
+            ))
+
+        costs = np.concatenate(pop_costs) if pop_costs else np.zeros(0)
+        ranks = np.asarray(load_balance.partition_methods[method](costs, MPI_size))
+        self._predicted_load_balance = load_balance.predicted_balance(costs, ranks, MPI_size)
+        self.io.log_info('Distributing cells using "{}" method, predicted load balance is {:.3f}.'.format(
+            method, self._predicted_load_balance))
+
+        rank_rows = {}
+        offset = 0
+        for node_pop, costs in zip(node_pops, pop_costs):
+            rank_rows[node_pop.name] = np.flatnonzero(ranks[offset:(offset + len(costs))] == MPI_rank)
+            offset += len(costs)
+        return rank_rows
+
     def build_nodes(self):
+        rank_rows = self._distribute_nodes()
         for node_pop in self.node_populations:
             self._remote_node_cache[node_pop.name] = {}
             node_ids_map = {}
+            rank_nodes = node_pop[MPI_rank::MPI_size] if rank_rows is None \
+                else node_pop[rank_rows.get(node_pop.name, [])]
             if node_pop.internal_nodes_only:
-                for node in node_pop[MPI_rank::MPI_size]:
+                for node in rank_nodes:
                     cell = self._build_cell(bionode=node, population_name=node_pop.name)
                     node_ids_map[node.node_id] = cell
                     self._rank_node_gids[cell.gid] = cell
@@ -185,7 +238,7 @@ class BioNetwork(SimNetwork):
                 # node population contains both internal and virtual (external) nodes and the virtual nodes must be
                 # filtered out
                 self._virtual_nodes[node_pop.name] = {}
-                for node in node_pop[MPI_rank::MPI_size]:
+                for node in rank_nodes:
                     if node.model_type == 'virtual':
                         continue
                     else:
@@ -200,6 +253,9 @@ class BioNetwork(SimNetwork):
 
             self._rank_node_ids[node_pop.name] = node_ids_map
 
+        # Only keep the gap junctions connected to cells on this rank
+        self.index_gap_juncs(local_node_ids=self._rank_node_ids)
+
         # self.make_morphologies()
         # self.set_seg_props()  # set segment properties by creating Morphologies
         # self.calc_seg_coords()  # use for computing the ECP
@@ -257,32 +313,6 @@ class BioNetwork(SimNetwork):
                 cell.init_connections()
             self._connections_initialized = True
 
-    def get_gj_id(self, network, src_nid, trg_nid, source_gap):
-        '''
-        Returns the gap junction id for the given nodes on a given network.
-
-        :param source_gap: whether to return the id of the gap junction on the source node or the target node.
-        '''
-        if src_nid == trg_nid:
-            raise Exception("Cells cannot have gap junctions with themselves.")
-
-        gap_ids = self._gap_juncs[network]
-
-        loc = np.where(np.logical_and(gap_ids["source_ids"] == src_nid, gap_ids["target_ids"] == trg_nid))[0]
-
-        if len(loc) > 1:
-            raise Exception("The gap junction file has more than one gap junction with the same ids.")
-        elif len(loc) == 0:
-            raise Exception("The gap junction file does not contain a gap junction with source id " +
-             str(src_nid) + " and target id " + str(trg_nid) + " on network " + network)
-
-        ids = [gap_ids["src_gap_ids"][loc[0]], gap_ids["trg_gap_ids"][loc[0]]]
-
-        if not source_gap:
-            ids.reverse()
-        
-        return ids
-
     def build_recurrent_edges(self):
         recurrent_edge_pops = [ep for ep in self._edge_populations if not ep.virtual_connections]
         if not recurrent_edge_pops:
@@ -292,17 +322,26 @@ class BioNetwork(SimNetwork):
         for edge_pop in recurrent_edge_pops:
             if edge_pop.recurrent_connections:
                 source_population = edge_pop.source_nodes
-                for trg_nid, trg_cell in self._rank_node_ids[edge_pop.target_nodes].items():
-                    for edge in edge_pop.get_target(trg_nid):
+                trg_cells = self._rank_node_ids[edge_pop.target_nodes]
+                for trg_ids in self._target_batches(trg_cells):
+                    pending_edges = {}
+                    for edge in edge_pop.get_targets(trg_ids):
+                        trg_nid = edge.target_node_id
+                        trg_cell = trg_cells[trg_nid]
                         src_node = self.get_node_id(source_population, edge.source_node_id)
 
                         if edge.is_gap_junction:
                             if source_population != edge_pop.target_nodes:
                                 raise Exception("Gap junctions must be from the same network builder")
                             gj_ids = self.get_gj_id(source_population, edge.source_node_id, trg_nid, False)
+                            # keep the edges of each cell in order, so the synapses are placed the same
+                            if trg_nid in pending_edges:
+                                trg_cell.set_syn_connections(pending_edges.pop(trg_nid))
                             trg_cell.set_syn_connection(edge, src_node, gj_ids=gj_ids)
                         else:
-                            trg_cell.set_syn_connection(edge, src_node)
+                            pending_edges.setdefault(trg_nid, []).append((edge, src_node, None))
+                    self._set_syn_connections(trg_cells, pending_edges)
+
                 for src_nid, src_cell in self._rank_node_ids[source_population].items():
                     for edge in edge_pop.get_source(src_nid):
                         if edge.is_gap_junction:
@@ -320,15 +359,39 @@ class BioNetwork(SimNetwork):
                 # node to see if is virtual (bc virtual nodes can't be built yet). This conditional can significantly
                 # slow down build time so we use a special loop that can be ignored.
                 source_population = edge_pop.source_nodes
-                for trg_nid, trg_cell in self._rank_node_ids[edge_pop.target_nodes].items():
-                    for edge in edge_pop.get_target(trg_nid):
+                trg_cells = self._rank_node_ids[edge_pop.target_nodes]
+                for trg_ids in self._target_batches(trg_cells):
+                    pending_edges = {}
+                    for edge in edge_pop.get_targets(trg_ids):
                         src_node = self.get_node_id(source_population, edge.source_node_id)
                         if src_node.model_type == 'virtual':
                             continue
-                        trg_cell.set_syn_connection(edge, src_node)
+                        pending_edges.setdefault(edge.target_node_id, []).append((edge, src_node, None))
+                    self._set_syn_connections(trg_cells, pending_edges)
 
         self.io.barrier()
 
+    @staticmethod
+    def _target_batches(trg_cells, batch_size=1000):
+        """Splits the target node ids into batches. All the edges of a target node are returned by the same
+        get_targets() call, so the buffered edges can be placed after each batch instead of holding on to the edges of
+        the entire population.
+        """
+        node_ids = list(trg_cells.keys())
+        for beg in range(0, len(node_ids), batch_size):
+            yield node_ids[beg:beg + batch_size]
+
+    def _set_syn_connections(self, trg_cells, pending_edges):
+        """Creates the synapses for all the buffered edges. Placing the synapses for all the incoming edges of a cell at
+        once is a lot faster than one edge at a time (see BioCell.set_syn_connections()).
+
+        :param trg_cells: dictionary of node_id --> cell
+        :param pending_edges: dictionary of target node_id --> list of (edge, src_node, stim) in order, is cleared.
+        """
+        for trg_nid, edges in pending_edges.items():
+            trg_cells[trg_nid].set_syn_connections(edges)
+        pending_edges.clear()
+
     def build_replay_inputs(self, spike_trains, edges_path, edge_types_path, source_node_set, target_node_set):
         self._init_connections()
 
@@ -350,13 +413,15 @@ class BioNetwork(SimNetwork):
                 if trg_nid not in valid_trg_ids:
                     continue
 
+                trg_edges = []
                 for edge in edges_pop.get_target(trg_nid):
                     src_nid = edge.source_node_id
                     if src_nid not in valid_src_ids:
                         continue
 
                     src_cell = self.get_disconnected_cell(src_population, src_nid, spike_trains)
-                    trg_cell.set_syn_connection(edge, src_cell, src_cell)
+                    trg_edges.append((edge, src_cell, src_cell))
+                trg_cell.set_syn_connections(trg_edges)
 
         self.io.barrier()
 
@@ -379,10 +444,14 @@ class BioNetwork(SimNetwork):
             source_population = src_node_pop.name
             for edge_pop in self.find_edges(source_nodes=source_population):
                 if edge_pop.virtual_connections:
-                    for trg_nid, trg_cell in self._rank_node_ids[edge_pop.target_nodes].items():
-                        for edge in edge_pop.get_target(trg_nid):
-                            src_cell = self.get_virtual_cells(source_population, edge.source_node_id, spike_trains, spikes_generator, sim)
-                            trg_cell.set_syn_connection(edge, src_cell, src_cell)
+                    trg_cells = self._rank_node_ids[edge_pop.target_nodes]
+                    for trg_ids in self._target_batches(trg_cells):
+                        pending_edges = {}
+                        for edge in edge_pop.get_targets(trg_ids):
+                            src_cell = self.get_virtual_cells(source_population, edge.source_node_id, spike_trains,
+                                                              spikes_generator, sim)
+                            pending_edges.setdefault(edge.target_node_id, []).append((edge, src_cell, src_cell))
+                        self._set_syn_connections(trg_cells, pending_edges)
 
                 elif edge_pop.mixed_connections:
                     raise NotImplementedError()
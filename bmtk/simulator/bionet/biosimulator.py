@@ -281,6 +281,9 @@ class BioSimulator(Simulator):
             mod.finalize(self)
         pc.barrier()
 
+        if self.net.load_balance is not None:
+            self.report_load_balance()
+
         end_time = time.time()
 
         sim_time = self.__elapsed_time(end_time - s_time)
@@ -294,6 +297,8 @@ class BioSimulator(Simulator):
         io.log_info('Approximate exchange time is {} seconds.'.format(comptime - maxcomp))
         if maxcomp != 0.0:
             io.log_info('Load balance is {}.'.format(avgcomp/maxcomp))
+        if self.net.predicted_load_balance is not None:
+            io.log_info('Predicted load balance was {:.3f}.'.format(self.net.predicted_load_balance))
 
     def post_fadvance(self): 
         """
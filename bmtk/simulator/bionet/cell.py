@@ -104,8 +104,17 @@ class Cell(object):
     def get_connection_info(self):
         return []
 
-    def set_syn_connections(self, edge_prop, src_node, stim=None):
+    def set_syn_connection(self, edge_prop, src_node, stim=None):
         raise NotImplementedError
+
+    def set_syn_connections(self, edges):
+        """Sets up the synapses for a list of incoming edges, same as calling set_syn_connection() for each one in
+        order. Subclasses may override to handle all the edges at once.
+
+        :param edges: list of (edge_prop, src_node, stim) tuples, stim may be None.
+        :return: list of values returned by set_syn_connection()
+        """
+        return [self.set_syn_connection(edge_prop, src_node, stim) for edge_prop, src_node, stim in edges]
     
     def get_section(self, sec_name, sec_index):
         raise NotImplementedError
@@ -0,0 +1,178 @@
+# Copyright 2017. Allen Institute. All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+# disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+# disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""Functions for distributing the cells of a network across MPI ranks.
+
+The cost of simulating each cell is estimated from the nodes/edges files as
+
+    cost = compartment_cost*(number of compartments) + synapse_cost*(number of incoming edges)
+
+where the number of compartments of a biophysical cell is estimated from its SWC morphology file, and is 1 for point
+cells. The cells are then partitioned using one of the methods in partition_methods, which can be selected in the
+"run" section of the config, eg. "load_balance": "lpt" or "load_balance": {"method": "lpt", "synapse_cost": 0.5}.
+"""
+import os
+import heapq
+import numpy as np
+
+
+DEFAULT_COMPARTMENT_COST = 1.0
+DEFAULT_SYNAPSE_COST = 0.5
+DEFAULT_N_COMPARTMENTS = 100  # used for biophysical cells when the morphology can't be read
+
+_swc_compartments_cache = {}
+
+
+def partition_round_robin(costs, n_ranks):
+    """Assigns cell i to rank i % n_ranks, regardless of cost."""
+    return np.arange(len(costs)) % n_ranks
+
+
+def partition_greedy(costs, n_ranks):
+    """Goes through the cells in order and assigns each one to the rank with the lowest load so far."""
+    return _assign_min_load(costs, n_ranks, order=np.arange(len(costs)))
+
+
+def partition_lpt(costs, n_ranks):
+    """Longest-processing-time partitioning, same as greedy but starting with the most expensive cells."""
+    return _assign_min_load(costs, n_ranks, order=np.argsort(-np.asarray(costs), kind='stable'))
+
+
+def _assign_min_load(costs, n_ranks, order):
+    ranks = np.zeros(len(costs), dtype=np.int64)
+    rank_loads = [(0.0, r) for r in range(n_ranks)]  # heap of (load, rank), ties go to the lowest rank
+    for i in order:
+        load, rank = heapq.heappop(rank_loads)
+        ranks[i] = rank
+        heapq.heappush(rank_loads, (load + costs[i], rank))
+    return ranks
+
+
+partition_methods = {
+    'round_robin': partition_round_robin,
+    'greedy': partition_greedy,
+    'lpt': partition_lpt
+}
+
+
+def add_partition_method(name, func):
+    """Registers a custom partition method. The function should take an array of cell costs and the number of ranks,
+    and return an array with the rank of each cell.
+    """
+    partition_methods[name] = func
+
+
+def swc_compartments(swc_path, dL=20.0):
+    """Estimates the number of compartments NEURON will create for a SWC morphology, using the same rule as
+    Morphology.set_segment_dl(), ie. nseg = 1 + 2*int(L/(2*dL)) for each section and one compartment for the soma.
+
+    :param swc_path: path to swc file
+    :param dL: maximum segment length (um)
+    :return: number of compartments
+    """
+    cache_key = (swc_path, dL)
+    if cache_key in _swc_compartments_cache:
+        return _swc_compartments_cache[cache_key]
+
+    swc = np.loadtxt(swc_path, comments='#', ndmin=2)
+    point_ids = swc[:, 0].astype(np.int64)
+    point_types = swc[:, 1].astype(np.int64)
+    parent_ids = swc[:, 6].astype(np.int64)
+
+    sort_idx = np.argsort(point_ids)
+    parent_rows = sort_idx[np.minimum(np.searchsorted(point_ids, parent_ids, sorter=sort_idx), len(point_ids) - 1)]
+    parent_rows[point_ids[parent_rows] != parent_ids] = -1
+    has_parent = parent_rows >= 0
+
+    lengths = np.zeros(len(point_ids))
+    lengths[has_parent] = np.linalg.norm(swc[has_parent, 2:5] - swc[parent_rows[has_parent], 2:5], axis=1)
+
+    # A new section starts at a point whose parent is a branch point, the soma or of a different type
+    n_children = np.bincount(parent_rows[has_parent], minlength=len(point_ids))
+    sec_start = np.ones(len(point_ids), dtype=bool)
+    sec_start[has_parent] = (n_children[parent_rows[has_parent]] != 1) | \
+                            (point_types[parent_rows[has_parent]] != point_types[has_parent]) | \
+                            (point_types[parent_rows[has_parent]] == 1)
+
+    # Sum up the lengths of each section, assumes parents come before their children like the SWC spec requires
+    point_secs = np.zeros(len(point_ids), dtype=np.int64)
+    sec_lengths = []
+    for i in range(len(point_ids)):
+        if point_types[i] == 1:
+            continue
+        elif sec_start[i]:
+            point_secs[i] = len(sec_lengths)
+            sec_lengths.append(lengths[i])
+        else:
+            point_secs[i] = point_secs[parent_rows[i]]
+            sec_lengths[point_secs[i]] += lengths[i]
+
+    n_comps = 1 + int(np.sum(1 + 2*(np.array(sec_lengths)/(2*dL)).astype(np.int64)))
+    _swc_compartments_cache[cache_key] = n_comps
+    return n_comps
+
+
+def estimate_cell_costs(node_pop, edge_pops, dL=20.0, compartment_cost=DEFAULT_COMPARTMENT_COST,
+                        synapse_cost=DEFAULT_SYNAPSE_COST, io=None):
+    """Estimates the simulation cost of every node in a population, from the number of compartments and the number of
+    edges targeting each node. Virtual nodes have cost 0.
+
+    :param node_pop: SonataNodes population
+    :param edge_pops: list of SonataEdges populations that target node_pop
+    :param dL: maximum segment length (um)
+    :param compartment_cost: cost of each compartment
+    :param synapse_cost: cost of each incoming edge
+    :param io: optional io object, used for logging warnings
+    :return: array of costs, in the same order as the node population
+    """
+    model_types = node_pop.get_values('model_type')
+    morphologies = node_pop.get_values('morphology')
+
+    n_comps = np.ones(len(model_types))
+    is_biophys = model_types == 'biophysical'
+    for morph_file in set(morphologies[is_biophys]):
+        try:
+            if morph_file is None or os.path.splitext(morph_file)[1].lower() != '.swc':
+                raise ValueError('only swc morphologies are supported')
+            morph_comps = swc_compartments(morph_file, dL)
+        except Exception as e:
+            if io is not None:
+                io.log_warning('Unable to estimate compartments of morphology {} ({}), using {}.'.format(
+                    morph_file, e, DEFAULT_N_COMPARTMENTS))
+            morph_comps = DEFAULT_N_COMPARTMENTS
+        n_comps[is_biophys & (morphologies == morph_file)] = morph_comps
+
+    n_syns = np.zeros(len(model_types))
+    node_ids = node_pop.node_ids
+    for edge_pop in edge_pops:
+        n_syns += edge_pop.target_counts(node_ids)
+
+    costs = compartment_cost*n_comps + synapse_cost*n_syns
+    costs[model_types == 'virtual'] = 0.0
+    return costs
+
+
+def predicted_balance(costs, ranks, n_ranks):
+    """Returns average/maximum of the predicted load of each rank, 1.0 being perfectly balanced."""
+    rank_loads = np.bincount(ranks, weights=costs, minlength=n_ranks)
+    max_load = np.max(rank_loads) if len(rank_loads) > 0 else 0.0
+    return np.mean(rank_loads)/max_load if max_load > 0 else 1.0
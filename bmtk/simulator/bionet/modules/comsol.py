@@ -1,12 +1,22 @@
+import os
+import h5py
 import pandas as pd
 import numpy as np
 from neuron import h
 
-from scipy.interpolate import NearestNDInterpolator as NNip
-from scipy.interpolate import LinearNDInterpolator as Lip
+from scipy.spatial import cKDTree, Delaunay
 
 from bmtk.simulator.bionet.modules.sim_module import SimulatorMod
 from bmtk.simulator.bionet.modules.xstim_waveforms import stimx_waveform_factory
+from bmtk.simulator.bionet.modules.xstim import VextPointers
+from bmtk.simulator.bionet.io_tools import io
+
+
+pc = h.ParallelContext()
+MPI_RANK = int(pc.id())
+
+COMSOL_CACHE_VERSION = 3
+
 
 class ComsolMod(SimulatorMod):
     """This module takes extracellular potentials that were calculated in COMSOL and imposes them on a biophysically detailed network. 
@@ -16,7 +26,7 @@ class ComsolMod(SimulatorMod):
     """
 
     def __init__(self, comsol_files, waveforms=None, amplitudes=1, 
-                 cells=None, set_nrn_mechanisms=True, node_set=None):
+                 cells=None, set_nrn_mechanisms=True, node_set=None, cache=False):
         """
         Checks if a waveform argument was passed which determines what comsol_files and amplitudes should look like.
         
@@ -34,6 +44,10 @@ class ComsolMod(SimulatorMod):
         :param cells: defaults to None.
         :param set_nrn_mechanisms: defaults to True.
         :param node_set: defaults to None.
+        :param cache: (bool or str) Save a binary (hdf5) copy of each comsol.txt the first time it is used and load that
+            on subsequent runs, see ComsolData. If True the cache is saved as "/path/to/comsol.txt.h5", if a directory
+            the cache files are saved there instead (the directory is created if needed), if False always load the
+            comsol.txt. If the cache can't be written the comsol.txt is loaded instead. Defaults to False.
         """
         if waveforms is None:
             self._comsol_files = comsol_files 
@@ -54,122 +68,166 @@ class ComsolMod(SimulatorMod):
 
             self._data = [None]*self._nb_files
 
+        self._cache = cache
         self._set_nrn_mechanisms = set_nrn_mechanisms
         self._cells = cells
         self._local_gids = []
-        
+        self._fih = None
+        self._vext_ptrs = None
+        self._waveform_vals = None
+
 
     def initialize(self, sim):
         """Checks if a waveform argument was passed which determines how to comsol.txt and waveform.csv should be treated.
         
         Usage::
-        
+
+            Gathers the segments of all local cells, so potentials can be set with one PtrVector each step
+
             If no waveform is specified:
                 Loads COMSOL output
                 Sets up nearest neighbour interpolation object (for spatial interpolation)
-                Performs temporal interpolation so COMSOL and BMTK timings match.
-            
+                Performs temporal interpolation so COMSOL and BMTK timings match, only for the COMSOL nodes that are
+                closest to a local segment.
+
             If one or more waveforms are specified:
                 Iterates over COMSOL outputs:
                     Loads COMSOL output
-                    Iterates over cells:
-                        Retrieves potentials at each segment via spatial interpolation
-       
+                    Retrieves potentials at each segment via spatial interpolation
+                Calculates the waveforms at every time step of the simulation
+
         :param sim: Simulation object
-        """        
+        """
         if self._cells is None:
             # if specific gids not listed just get all biophysically detailed cells on this rank
             self._local_gids = sim.biophysical_gids
         else:
             # get subset of selected gids only on this rank
             self._local_gids = list(set(sim.local_gids) & set(self._all_gids))
-        
+
+        cells = []
+        for gid in self._local_gids:
+            cell = sim.net.get_cell_gid(gid)
+            cell.setup_xstim(self._set_nrn_mechanisms)
+            cells.append(cell)
+        self._vext_ptrs = VextPointers(cells)
+        self._fih = sim.h.FInitializeHandler(0, self._vext_ptrs.set_pointers)
+
+        # Position of the middle of every local segment, n_segments x 3
+        r05 = np.concatenate([cell.seg_coords.p05.T for cell in cells]) if cells else np.zeros((0, 3))
+
         if self._waveforms is None: # If time-dependent COMSOL study
-            self._data =  self.load_comsol(self._comsol_files)      # Load COMSOL file
-            # Set up interpolator that points every cell segment to the closest COMSOL node
-            self._NNip = NNip(self._data[['x','y','z']], np.arange(len(self._data['x'])))
-            self._NN = {}
-            
-            for gid in self._local_gids: # Iterate over cells
-                cell = sim.net.get_cell_gid(gid)
-                cell.setup_xstim(self._set_nrn_mechanisms)
-                
-                r05 = cell.seg_coords.p05               # Get position of segment centre
-                self._NN[gid] = self._NNip(r05.T)       # Create map that points each segment to the closest COMSOL node
-                
+            comsol_data = self.get_comsol_data(self._comsol_files)     # Load COMSOL file
+            # Point every cell segment to the closest COMSOL node
+            nn = comsol_data.nearest_nodes(r05) if len(r05) > 0 else np.zeros(0, dtype=int)
+            # Only the potentials of the COMSOL nodes that are nearest to a segment are needed
+            nodes, self._NN = np.unique(nn, return_inverse=True)
+
             # Temporal interpolation
-            timestamps_comsol = np.array(list(self._data)[3:], dtype=float)[:]                          # Retrieve array of timestamps in COMSOL
-            timestamps_bmtk = np.arange(timestamps_comsol[0], timestamps_comsol[-1]+sim.dt, sim.dt)     # Create array of timestamps in BMTK
-            self._data_temp = np.zeros((self._data.shape[0], len(timestamps_bmtk)))                     # Start with empty array
-            for i in range(self._data.shape[0]):                                 
-                self._data_temp[i,:] = np.interp(timestamps_bmtk, timestamps_comsol, self._data.iloc[i,3:]).flatten()                                                          
-            self._data = self._data_temp*self._amplitudes
-            comsol_duration = timestamps_bmtk[-1]-timestamps_bmtk[0]    
+            timestamps_comsol = comsol_data.timestamps                                          # COMSOL timestamps
+            timestamps_bmtk = np.arange(timestamps_comsol[0], timestamps_comsol[-1]+sim.dt, sim.dt)  # BMTK timestamps
+            potentials = comsol_data.get_potentials(nodes)
+            comsol_data.close()
+            # Stored as n_timestamps x n_nodes so the potentials at each time step are contiguous
+            self._data = np.ascontiguousarray(interp_rows(timestamps_bmtk, timestamps_comsol, potentials).T)
+            self._data *= self._amplitudes
+            comsol_duration = timestamps_bmtk[-1]-timestamps_bmtk[0]
             self._period = int(comsol_duration/sim.dt)
 
-        else: # Else stationary study    
-            self._Lip = [None]*self._nb_files
-            self._L = [None]*self._nb_files
+        else:  # Else stationary study
+            self._L = np.zeros((self._nb_files, len(r05)))   # potentials of each segment, for each COMSOL file
+
+            for i in range(self._nb_files):     # For each COMSOL file
+                comsol_data = self.get_comsol_data(self._comsol_files[i])           # Load COMSOL file
+                self._waveforms[i] = stimx_waveform_factory(self._waveforms[i])     # Load waveform
 
-            for i in range(self._nb_files):     # For each COMSOL file                                           
-                self._data[i] =  self.load_comsol(self._comsol_files[i])            # Load COMSOL file
-                self._waveforms[i] = stimx_waveform_factory(self._waveforms[i])     # Load waveform                                                  
+                if len(r05) > 0:
+                    self._L[i, :] = comsol_data.interpolate_linear(r05)     # Retrieve potentials with interpolate
+                comsol_data.close()
+            # Segments outside of any of the meshes get no extracellular potential at all
+            self._L[:, np.isnan(self._L).any(axis=0)] = 0
 
-                self._Lip[i] = Lip(self._data[i][['x','y','z']], self._data[i][0])  # Create interpolator
-                self._L[i] = {}                                                         
+            self._waveform_vals = np.array([self._calc_waveforms(sim, tstep) for tstep in range(sim.n_steps + 1)])
+
+    def _calc_waveforms(self, sim, tstep):
+        """Returns the value of every waveform, times its amplitude, at a given time step."""
+        vals = np.zeros(self._nb_files)
+        for i in range(self._nb_files):
+            waveform_times = self._waveforms[i].definition["time"]
+            waveform_duration = waveform_times.iloc[-1] - waveform_times.iloc[0]
+            period = waveform_duration/sim.dt+1     # Get duration of waveform.csv
+            simulation_time = (tstep % period) * sim.dt     # Repeat periodic stimulation
+            vals[i] = self._waveforms[i].calculate(simulation_time)*self._amplitudes[i]
+        return vals
 
-            for gid in self._local_gids:        # Iterate over cells                          
-                cell = sim.net.get_cell_gid(gid)
-                cell.setup_xstim(self._set_nrn_mechanisms)
 
-                r05 = cell.seg_coords.p05                       # Get position of middle of segment
-                for i in range(self._nb_files):                 # For every COMSOL file
-                    self._L[i][gid] = self._Lip[i](r05.T)       # Retrieve potentials with interpolate
-                    
-    
     def step(self, sim, tstep):
         """Checks if a waveform argument was passed which determines how potentials should be retrieved.
         
-        Iterates over all cells::
+        For all the local segments at once::
 
             If no waveform is specified:
-                Retrieves nearest neighbour with interpolator
-                Looks up potentials (for each segment of the cell) in comsol data at current time
+                Looks up potentials (of the nearest COMSOL node to each segment) in comsol data at current time
             If one or more waveforms are specified:
-                Initialises extracellular potential v_ext at 0
-                Iterates over COMSOL outputs (thus making a linear combination of several FEM solutions):
-                    Calls interpolated potentials
-                    Multiplies by corresponding waveform value at current time and by corresponding amplitude
-                    Adds to v_ext
-                    
+                Linear combination of the interpolated potentials of every COMSOL output (FEM solution), weighted by
+                the corresponding waveform value at current time and by corresponding amplitude
+
         :param sim: Simulation object
         :param tstep: (int) timestep
         """
-        
-        for gid in self._local_gids:        # Iterate over cells                                            
-            cell = sim.net.get_cell_gid(gid)                                    
+        v_ext = self._vext_ptrs.values
+        if self._waveforms is None:             # If time-dependent COMSOL study
+            tstep = tstep % self._period        # Repeat periodic stimulation
+            np.take(self._data[tstep], self._NN, out=v_ext)     # Look up extracellular potentials at current time
 
-            
-            if self._waveforms is None:             # If time-dependent COMSOL study                                        
-                NN = self._NN[gid]                  # Point each node of the cell to the nearest COMSOL node
-                tstep = tstep % self._period        # Repeat periodic stimulation
-                v_ext = self._data[NN, tstep]       # Look up extracellular potentials at current time
-             
-            else:       # Else stationary study          
-                v_ext = np.zeros(np.shape(self._L[0][gid]))     # Initialise v_ext as zero array               
-               
-                for i in range(self._nb_files):     # Iterate over COMSOL studies
-                    waveform_duration = self._waveforms[i].definition["time"].iloc[-1] - self._waveforms[i].definition["time"].iloc[0]                 
-                    period = waveform_duration/sim.dt+1     # Get duration of waveform.csv
-                    tstep = tstep % period                  # Repeat periodic stimulation
-                    simulation_time = tstep * sim.dt                      # Calculate current time in simulation run
-                    # Add potentials(x,y,z)*waveform(t)*amplitude of this iteration to v_ext
-                    v_ext += self._L[i][gid]*self._waveforms[i].calculate(simulation_time)*self._amplitudes[i]
-                v_ext[np.isnan(v_ext)] = 0
-            # if tstep == 10 and gid == 10:
-            #     print(v_ext)
-            cell.set_e_extracellular(h.Vector(v_ext))       # Set extracellular potentials to v_ext 
+        else:       # Else stationary study
+            waveform_vals = self._waveform_vals[tstep] if tstep < len(self._waveform_vals) \
+                else self._calc_waveforms(sim, tstep)
+            np.dot(waveform_vals, self._L, out=v_ext)
+
+        self._vext_ptrs.scatter()       # Set extracellular potentials to v_ext
+
+    def get_comsol_data(self, comsol_file):
+        """Loads a COMSOL export, using the binary cache when possible. If the cache doesn't exist yet (or comsol_file
+        has changed) the primary rank will create it while the other ranks wait. If the cache can't be created, eg. the
+        directory is read-only, all ranks fall back to loading comsol_file directly.
 
+        :param comsol_file: (str) "/path/to/comsol.txt"
+        :return: (ComsolData)
+        """
+        if not self._cache:
+            return ComsolData.from_dataframe(self.load_comsol(comsol_file))
+
+        if isinstance(self._cache, str):
+            cache_path = os.path.join(self._cache, os.path.basename(comsol_file) + '.h5')
+        else:
+            cache_path = comsol_file + '.h5'
+
+        comsol_data = None
+        cache_ok = 0
+        if MPI_RANK == 0:
+            cache_ok = 1
+            if not ComsolData.is_valid_cache(cache_path, comsol_file):
+                io.log_info('Creating binary cache of {} in {}'.format(comsol_file, cache_path))
+                comsol_data = ComsolData.from_dataframe(self.load_comsol(comsol_file))
+                try:
+                    cache_dir = os.path.dirname(cache_path)
+                    if cache_dir:
+                        os.makedirs(cache_dir, exist_ok=True)
+                    comsol_data.save(cache_path, comsol_file)
+                except Exception as e:
+                    io.log_warning('Unable to create cache {} ({}), loading {} instead.'.format(
+                        cache_path, e, comsol_file))
+                    cache_ok = 0
+
+        # Only rank 0 contributes, so every rank knows whether the cache was created. Also acts as a barrier.
+        cache_ok = pc.allreduce(cache_ok, 1)
+        if cache_ok:
+            return ComsolData.from_cache(cache_path)
+        elif comsol_data is not None:
+            return comsol_data
+        else:
+            return ComsolData.from_dataframe(self.load_comsol(comsol_file))
 
     def load_comsol(self, comsol_file):
         """Extracts data and headers from comsol.txt. Returns pandas DataFrame.
@@ -207,3 +265,403 @@ class ComsolMod(SimulatorMod):
         return data
 
 
+class ComsolData(object):
+    """Coordinates (n_nodes x 3), timestamps and potentials (n_nodes x n_timestamps) of the nodes of a COMSOL export.
+    For a stationary study there is a single timestamp of 0.
+
+    Loading a multi-gigabyte COMSOL text export is slow, so a binary copy can be saved to hdf5 (see save()). When loaded
+    from the hdf5 file (see from_cache()) the potentials stay on disk and only the rows of the nodes that are needed
+    are read.
+
+    For stationary studies the Delaunay triangulation of the nodes, used for linear interpolation, is saved in the same
+    file as plain arrays (the vertices and neighbours of each simplex). The simplex containing a point is then found by
+    walking through the neighbouring simplices, starting from one of the nodes closest to the point, so the
+    triangulation doesn't have to be recomputed. Nearest nodes are found with a KD-tree of only the nodes around the
+    points being looked up, rather than the whole mesh.
+    """
+
+    # Size of the margin, in units of the average distance between nodes, added around the points when selecting the
+    # nodes to build a local KD-tree from.
+    local_margin = 5.0
+
+    def __init__(self, coords, timestamps, potentials, simplices=None, neighbors=None, h5_handle=None):
+        self._coords = coords
+        self._timestamps = timestamps
+        self._potentials = potentials  # numpy array or hdf5 dataset
+        self._simplices = simplices  # n_simplices x 4 node indices, from the cache
+        self._neighbors = neighbors  # n_simplices x 4, simplex opposite of each vertex (-1 at the boundary)
+        self._vertex_simplex = None
+        self._node_simplices = None
+        self._hull_planes = None
+        self._kdtree = None
+        self._delaunay = None
+        self._h5_handle = h5_handle
+
+    @property
+    def coords(self):
+        return self._coords
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    @property
+    def n_nodes(self):
+        return self._coords.shape[0]
+
+    @property
+    def is_stationary(self):
+        return len(self._timestamps) == 1
+
+    @property
+    def kdtree(self):
+        if self._kdtree is None:
+            self._kdtree = cKDTree(self._coords)
+        return self._kdtree
+
+    @property
+    def delaunay(self):
+        if self._delaunay is None:
+            self._delaunay = Delaunay(self._coords)
+        return self._delaunay
+
+    def get_potentials(self, nodes=None):
+        """Returns the potentials of the given nodes, or all the nodes.
+
+        :param nodes: (array) sorted, unique node indices. Defaults to None.
+        :return: (2D array) len(nodes) x n_timestamps
+        """
+        if nodes is None:
+            return np.asarray(self._potentials[()])
+
+        nodes = np.asarray(nodes, dtype=int)
+        if isinstance(self._potentials, np.ndarray):
+            return self._potentials[nodes]
+        elif len(nodes) == 0:
+            return np.zeros((0, len(self._timestamps)))
+
+        # Reading the whole range of rows and filtering in memory is much faster than hdf5 point selection, unless
+        # the nodes are very sparse.
+        beg, end = nodes[0], nodes[-1] + 1
+        if end - beg <= 8*len(nodes):
+            return self._potentials[beg:end][nodes - beg]
+        else:
+            return self._potentials[nodes]
+
+    def nearest_nodes(self, points):
+        """Index of the nearest node to each point.
+
+        :param points: (2D array) n_points x 3
+        :return: (array) n_points node indices
+        """
+        points = np.asarray(points, dtype=float)
+        nodes = np.zeros(len(points), dtype=int)
+        if len(points) == 0:
+            return nodes
+
+        local_nodes, box_lo, box_hi = self._local_nodes(points)
+        unresolved = np.ones(len(points), dtype=bool)
+        if len(local_nodes) > 0:
+            dists, indices = cKDTree(self._coords[local_nodes]).query(points)
+            nodes[:] = local_nodes[indices]
+            # Only exact if no node outside of the box can be closer than the nearest node inside it
+            unresolved = np.minimum(points - box_lo, box_hi - points).min(axis=1) < dists
+
+        if np.any(unresolved):
+            _, nodes[unresolved] = self.kdtree.query(points[unresolved])
+        return nodes
+
+    def _local_nodes(self, points):
+        """Returns the nodes inside the bounding box of the points, plus a margin, and the corners of that box."""
+        extent = np.ptp(self._coords, axis=0)
+        extent = extent[extent > 0]
+        spacing = (np.prod(extent)/self.n_nodes)**(1.0/len(extent)) if len(extent) > 0 else 0.0
+        box_lo = points.min(axis=0) - self.local_margin*spacing
+        box_hi = points.max(axis=0) + self.local_margin*spacing
+        in_box = np.all((self._coords >= box_lo) & (self._coords <= box_hi), axis=1)
+        return np.flatnonzero(in_box), box_lo, box_hi
+
+    def find_simplices(self, points, max_steps=50, k_nodes=(8, 32)):
+        """Finds the simplex of the Delaunay triangulation containing each point.
+
+        When the triangulation was loaded from the cache each point is first located by walking through the
+        neighbouring simplices, starting from a simplex of the nearest node. Points that aren't found that way (eg.
+        the walk got stuck among flat simplices of a regular grid) are checked against all the simplices of the
+        nearest nodes and against the boundary of the mesh. Only if that also fails is the triangulation
+        recomputed.
+
+        :param points: (2D array) n_points x 3
+        :param max_steps: (int) maximum number of simplices to walk through. Defaults to 50.
+        :param k_nodes: (list) number of nearest nodes whose simplices are checked for points the walk didn't find,
+            increasing until the points are found. Defaults to (8, 32).
+        :return: (bool array) n_points, False for points outside of the mesh; (2D array) n_inside x 4 node indices of
+            each simplex; (2D array) n_inside x 4 barycentric coordinates of each point.
+        """
+        points = np.asarray(points, dtype=float)
+        if len(points) == 0:
+            return np.zeros(0, dtype=bool), np.zeros((0, 4), dtype=int), np.zeros((0, 4))
+        elif self._simplices is None:
+            return self._find_simplices_qhull(points)
+
+        simplex_ids = np.full(len(points), -1)
+        bary = np.zeros((len(points), 4))
+        outside = np.zeros(len(points), dtype=bool)
+
+        local_nodes, _, _ = self._local_nodes(points)
+        if len(local_nodes) == 0:
+            local_nodes = np.arange(self.n_nodes)
+        local_tree = cKDTree(self._coords[local_nodes])
+        _, indices = local_tree.query(points)
+        start = np.maximum(self.vertex_simplex[local_nodes[indices]], 0)
+        self._walk(points, start, max_steps, simplex_ids, bary, outside)
+
+        for k in k_nodes:
+            unresolved = np.flatnonzero((simplex_ids < 0) & ~outside)
+            if len(unresolved) > 0:
+                _, indices = local_tree.query(points[unresolved], k=min(k, len(local_nodes)))
+                self._search_nodes(points, unresolved, local_nodes[indices], simplex_ids, bary)
+
+        unresolved = np.flatnonzero(simplex_ids < 0)
+        if len(unresolved) > 0:
+            unresolved = unresolved[~self._outside_hull(points[unresolved])]
+
+        found = simplex_ids >= 0
+        vertices = np.zeros((len(points), 4), dtype=int)
+        vertices[found] = self._simplices[simplex_ids[found]]
+        if len(unresolved) > 0:
+            io.log_warning('Unable to locate {} points in the cached triangulation, recomputing.'.format(
+                len(unresolved)))
+            qhull_inside, qhull_vertices, qhull_bary = self._find_simplices_qhull(points[unresolved])
+            found[unresolved] = qhull_inside
+            vertices[unresolved[qhull_inside]] = qhull_vertices
+            bary[unresolved[qhull_inside]] = qhull_bary
+
+        return found, vertices[found], bary[found]
+
+    def _walk(self, points, current, max_steps, simplex_ids, bary, outside):
+        """Stochastic visibility walk; at each step move to a random neighbour across one of the faces the point is on
+        the other side of, which unlike always choosing the most negative coordinate can't get stuck in a loop. Found
+        simplices and barycentric coordinates, and points found to be outside the mesh, are saved in place.
+        """
+        eps = 100*np.finfo(float).eps
+        rng = np.random.RandomState(0)
+        active = np.arange(len(points))
+        for _ in range(max_steps):
+            if len(active) == 0:
+                break
+
+            coords, degenerate = self._barycentric(current, points[active])
+            neighbors = self._neighbors[current]
+            behind = coords < -eps
+            inside = ~degenerate & ~np.any(behind, axis=1)
+            simplex_ids[active[inside]] = current[inside]
+            bary[active[inside]] = coords[inside]
+
+            # the mesh is convex, so a point behind a boundary face is outside of it
+            is_outside = ~degenerate & np.any(behind & (neighbors < 0), axis=1)
+            outside[active[is_outside]] = True
+
+            candidates = behind & (neighbors >= 0)
+            # the coordinates in a flat simplex aren't reliable, walk to any of its neighbours if needed
+            stuck = degenerate & ~np.any(candidates, axis=1)
+            candidates[stuck] = neighbors[stuck] >= 0
+            next_face = np.argmax(rng.random_sample(candidates.shape)*candidates, axis=1)
+
+            moving = ~inside & ~is_outside & np.any(candidates, axis=1)
+            active, current = active[moving], neighbors[moving, next_face[moving]]
+
+    def _search_nodes(self, points, point_ids, nodes, simplex_ids, bary):
+        """Checks every simplex of the given nodes (n_points x k) for the ones containing each point."""
+        eps = 100*np.finfo(float).eps
+        node_simplices_ptr, node_simplices = self.node_simplices
+        nodes = nodes.reshape(len(point_ids), -1)
+        counts = node_simplices_ptr[nodes + 1] - node_simplices_ptr[nodes]
+        pair_points = np.repeat(np.repeat(point_ids, nodes.shape[1]), counts.ravel())
+        pair_simplices = node_simplices[_expand_ranges(node_simplices_ptr[nodes.ravel()],
+                                                       node_simplices_ptr[nodes.ravel() + 1])]
+
+        coords, degenerate = self._barycentric(pair_simplices, points[pair_points], approx_degenerate=False)
+        inside = np.flatnonzero(~degenerate & np.all(coords >= -eps, axis=1))
+        simplex_ids[pair_points[inside]] = pair_simplices[inside]
+        bary[pair_points[inside]] = coords[inside]
+
+    def _outside_hull(self, points):
+        """Whether each point is outside of the convex hull of the mesh."""
+        if self._hull_planes is None:
+            boundary = np.argwhere(self._neighbors < 0)  # (simplex, opposite vertex) of every boundary face
+            face_cols = (boundary[:, [1]] + np.arange(1, 4)) % 4
+            faces = self._coords[self._simplices[boundary[:, [0]], face_cols]]  # n_faces x 3 x 3
+            normals = np.cross(faces[:, 1] - faces[:, 0], faces[:, 2] - faces[:, 0])
+            lengths = np.linalg.norm(normals, axis=1)
+            valid = lengths > 1.0e-12*np.max(lengths)  # ignore faces of zero area
+            normals = normals[valid]/lengths[valid, np.newaxis]
+            origins = faces[valid, 0]
+            # point the normals away from the inside of the (convex) mesh
+            flip = np.einsum('ij,ij->i', normals, self._coords.mean(axis=0) - origins) > 0
+            normals[flip] *= -1.0
+            self._hull_planes = (normals, np.einsum('ij,ij->i', normals, origins))
+
+        normals, offsets = self._hull_planes
+        tol = 1.0e-9*np.max(np.ptp(self._coords, axis=0))
+        outside = np.zeros(len(points), dtype=bool)
+        for beg in range(0, len(points), 1000):
+            outside[beg:beg + 1000] = np.any(points[beg:beg + 1000].dot(normals.T) - offsets > tol, axis=1)
+        return outside
+
+    def _find_simplices_qhull(self, points):
+        tri = self.delaunay
+        simplices = tri.find_simplex(points)
+        inside = simplices >= 0
+        transforms = tri.transform[simplices[inside]]
+        bary = np.einsum('ijk,ik->ij', transforms[:, :3, :], points[inside] - transforms[:, 3, :])
+        bary = np.concatenate([bary, 1.0 - bary.sum(axis=1, keepdims=True)], axis=1)
+        return inside, tri.simplices[simplices[inside]], bary
+
+    def _barycentric(self, simplex_ids, points, approx_degenerate=True):
+        """Barycentric coordinates of each point in the corresponding simplex (n_points x 4), and whether each simplex
+        is degenerate (ie. flat). Coordinates in degenerate simplices are only approximate, or NaN if approx_degenerate
+        is False.
+        """
+        vertices = self._coords[self._simplices[simplex_ids]]  # n_points x 4 x 3
+        mat = np.transpose(vertices[:, :3, :] - vertices[:, 3:, :], (0, 2, 1))
+        rhs = (points - vertices[:, 3, :])[:, :, np.newaxis]
+        edge_len = np.abs(mat).max(axis=(1, 2))
+        degenerate = np.abs(np.linalg.det(mat)) <= 1.0e-10*edge_len**3
+
+        coords = np.full((len(points), 3), np.nan)
+        if np.any(~degenerate):
+            coords[~degenerate] = np.linalg.solve(mat[~degenerate], rhs[~degenerate])[:, :, 0]
+        if approx_degenerate and np.any(degenerate):
+            # least-squares solution, only used to choose which neighbour to walk to next
+            coords[degenerate] = np.matmul(np.linalg.pinv(mat[degenerate]), rhs[degenerate])[:, :, 0]
+        return np.concatenate([coords, 1.0 - coords.sum(axis=1, keepdims=True)], axis=1), degenerate
+
+    @property
+    def vertex_simplex(self):
+        """One of the simplices of each node, -1 for nodes that are not part of the triangulation."""
+        if self._vertex_simplex is None:
+            self._vertex_simplex = np.full(self.n_nodes, -1)
+            self._vertex_simplex[self._simplices.ravel()] = np.repeat(np.arange(len(self._simplices)), 4)
+        return self._vertex_simplex
+
+    @property
+    def node_simplices(self):
+        """All the simplices of each node, in compressed sparse row format (ptr, simplices); the simplices of node i
+        are simplices[ptr[i]:ptr[i + 1]].
+        """
+        if self._node_simplices is None:
+            flat_nodes = self._simplices.ravel()
+            order = np.argsort(flat_nodes, kind='stable')
+            ptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+            ptr[1:] = np.cumsum(np.bincount(flat_nodes, minlength=self.n_nodes))
+            self._node_simplices = (ptr, order // 4)
+        return self._node_simplices
+
+    def interpolate_linear(self, points, column=0):
+        """Linear interpolation of the potentials at the given points, same as scipy's LinearNDInterpolator but only the
+        potentials of the nodes of the simplices containing the points are loaded. Points outside of the mesh are NaN.
+
+        :param points: (2D array) n_points x 3
+        :param column: (int) which timestamp to interpolate. Defaults to 0.
+        :return: (array) n_points potentials
+        """
+        inside, vertices, bary = self.find_simplices(points)
+        nodes, node_indices = np.unique(vertices, return_inverse=True)
+        node_potentials = self.get_potentials(nodes)[:, column][node_indices.reshape(vertices.shape)]
+
+        values = np.full(len(points), np.nan)
+        values[inside] = np.sum(node_potentials*bary, axis=1)
+        return values
+
+    def _triangulation(self):
+        if self._simplices is not None:
+            return self._simplices, self._neighbors
+
+        tri = self.delaunay
+        index_dtype = np.int32 if len(tri.simplices) < np.iinfo(np.int32).max else np.int64
+        return tri.simplices.astype(index_dtype), tri.neighbors.astype(index_dtype)
+
+    def close(self):
+        if self._h5_handle is not None:
+            self._h5_handle.close()
+            self._h5_handle = None
+
+    def save(self, cache_path, comsol_file=None):
+        """Saves the coordinates, timestamps, potentials and (for stationary studies) Delaunay triangulation into a
+        hdf5 file.
+
+        :param cache_path: (str) "/path/to/cache.h5"
+        :param comsol_file: (str) the original COMSOL export, used to check if the cache is out of date.
+        """
+        # Write to a temporary file first so other processes never see a partially written cache
+        tmp_path = '{}.tmp{}'.format(cache_path, os.getpid())
+        try:
+            with h5py.File(tmp_path, 'w') as h5:
+                h5.attrs['version'] = COMSOL_CACHE_VERSION
+                if comsol_file is not None:
+                    h5.attrs['source_size'] = os.path.getsize(comsol_file)
+                    h5.attrs['source_mtime'] = os.path.getmtime(comsol_file)
+                h5.create_dataset('coords', data=self._coords)
+                h5.create_dataset('timestamps', data=self._timestamps)
+                h5.create_dataset('potentials', data=self.get_potentials())
+                if self.is_stationary:
+                    simplices, neighbors = self._triangulation()
+                    h5.create_dataset('simplices', data=simplices)
+                    h5.create_dataset('neighbors', data=neighbors)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def is_valid_cache(cls, cache_path, comsol_file):
+        """Checks that the cache file exists and was created from the current version of comsol_file."""
+        if not os.path.exists(cache_path):
+            return False
+
+        try:
+            with h5py.File(cache_path, 'r') as h5:
+                return h5.attrs.get('version', None) == COMSOL_CACHE_VERSION \
+                    and h5.attrs.get('source_size', None) == os.path.getsize(comsol_file) \
+                    and h5.attrs.get('source_mtime', None) == os.path.getmtime(comsol_file)
+        except (OSError, KeyError):
+            return False
+
+    @classmethod
+    def from_cache(cls, cache_path):
+        h5 = h5py.File(cache_path, 'r')
+        return cls(coords=h5['coords'][()], timestamps=h5['timestamps'][()], potentials=h5['potentials'],
+                   simplices=h5['simplices'][()] if 'simplices' in h5 else None,
+                   neighbors=h5['neighbors'][()] if 'neighbors' in h5 else None, h5_handle=h5)
+
+    @classmethod
+    def from_dataframe(cls, data):
+        """Converts the DataFrame returned by ComsolMod.load_comsol()."""
+        return cls(
+            coords=data[['x', 'y', 'z']].to_numpy(dtype=float),
+            timestamps=np.array(list(data.columns)[3:], dtype=float),
+            potentials=data.iloc[:, 3:].to_numpy(dtype=float)
+        )
+
+
+def interp_rows(x, xp, fp):
+    """Same as calling np.interp(x, xp, fp[i, :]) on every row of fp, but vectorized.
+
+    :param x: (array) the x-coordinates at which to evaluate the interpolated values
+    :param xp: (array) increasing x-coordinates of the data points
+    :param fp: (2D array) n_rows x len(xp) data points
+    :return: (2D array) n_rows x len(x)
+    """
+    if len(xp) == 1:
+        return np.repeat(fp, len(x), axis=1)
+
+    idx = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    weights = np.clip((x - xp[idx])/(xp[idx + 1] - xp[idx]), 0.0, 1.0)
+    return fp[:, idx]*(1.0 - weights) + fp[:, idx + 1]*weights
+
+
+def _expand_ranges(range_begs, range_ends):
+    """Converts arrays of [beg, end) ranges into one array of all the indices in each range."""
+    counts = np.maximum(range_ends - range_begs, 0)
+    offsets = np.repeat(range_begs - np.cumsum(counts) + counts, counts)
+    return np.arange(np.sum(counts), dtype=np.int64) + offsets
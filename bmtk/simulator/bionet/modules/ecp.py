@@ -38,10 +38,25 @@ pc = h.ParallelContext()
 MPI_RANK = int(pc.id())
 N_HOSTS = int(pc.nhost())
 
+# Maximum size (in bytes) of the in-memory buffer of membrane currents used when calculating the ecp in batches
+IM_BUFFER_BYTES = 2**28
+
 
 class EcpMod(SimulatorMod):
+    """Module for recording the extracellular potential (ecp/lfp) at a set of electrode sites.
+
+    By default the transfer-resistances of all the local cells are stacked into one (n_sites x n_segments) matrix, and
+    the membrane currents of every segment are gathered into an in-memory buffer each step so the ecp can be calculated
+    for many time steps with a single matrix multiplication. Set batched=False to calculate the ecp of each cell every
+    time step instead.
+
+    :param batched: calculate the ecp for a block of time steps at a time (default True).
+    :param dtype: float type used for the transfer-resistances and buffered membrane currents when batched, using
+        'float32' will use half the memory and is faster at the cost of some precision (default 'float64').
+    """
+
     def __init__(self, tmp_dir, file_name, electrode_positions, file_name_nwb=None, contributions_dir=None, cells=None, variable_name='v',
-                 electrode_channels=None, cell_bounds=None, minimum_distance=None):
+                 electrode_channels=None, cell_bounds=None, minimum_distance=None, batched=True, dtype='float64'):
         self._ecp_output = file_name if os.path.isabs(file_name) else os.path.join(tmp_dir, file_name)
         self._positions_file = electrode_positions
         self._tmp_outputdir = tmp_dir
@@ -77,9 +92,7 @@ class EcpMod(SimulatorMod):
         self._data_block = None
         self._cell_var_files = {}
 
-        self._tmp_ecp_file = self._get_tmp_fname(MPI_RANK)
-        self._tmp_ecp_handle = None
-        # self._tmp_ecp_dataset = None
+        self._ecp_handle = None  # output file, only opened on the primary rank
 
         self._nwb_path = None
         if file_name_nwb:
@@ -88,38 +101,41 @@ class EcpMod(SimulatorMod):
 
         self._local_gids = []
 
-    def _get_tmp_fname(self, rank):
-        return os.path.join(self._tmp_outputdir, 'tmp_{}_{}'.format(MPI_RANK, os.path.basename(self._ecp_output)))
+        # used when calculating the ecp in batches
+        self._batched = batched
+        self._dtype = np.dtype(dtype)
+        self._tr_matrix = None  # transfer-resistances of all local cells, n_sites x n_segments
+        self._seg_offsets = {}  # gid --> (beg, end) columns of tr_matrix
+        self._im_ptr = None
+        self._im_vec = None
+        self._im_buffer = None  # membrane currents, n_steps x n_segments
+        self._im_buffer_rows = 0
 
     def _create_ecp_file(self, sim):
         dt = sim.dt
         tstop = sim.tstop
         self._nsteps = int(round(tstop/dt))
 
-        # create file to temporary store ecp data on each rank
-        self._tmp_ecp_handle = h5py.File(self._tmp_ecp_file, 'a')
-        self._tmp_ecp_handle.create_dataset('/ecp/data', (self._nsteps, self._rel_nsites), maxshape=(None, self._rel_nsites),
-                                            dtype=np.float64,
-                                            chunks=True)
-
-        # only the primary node will need to save the final ecp
+        # only the primary node will need to save the final ecp, the ecp of all the ranks are summed together at the
+        # end of each block and written directly to the output file.
         if MPI_RANK == 0:
-            with h5py.File(self._ecp_output, 'w') as f5:
-                add_hdf5_magic(f5)
-                add_hdf5_version(f5)
-                f5.create_dataset('/ecp/data', (self._nsteps, self._rel_nsites), maxshape=(None, self._rel_nsites),
-                                  dtype=np.float64,
-                                  chunks=True)
-                f5['/ecp/data'].attrs['units'] = 'mV'
-                #f5.attrs['dt'] = dt
-                #f5.attrs['tstart'] = 0.0
-                #f5.attrs['tstop'] = tstop
-
-                f5.create_dataset('/ecp/time', (3,), data=(0.0, sim.tstop, sim.dt))
-                f5['/ecp/time'].attrs['units'] = 'ms'
-
-                # Save channels. Current we record from all channels, may want to be more selective in the future.
-                f5.create_dataset('/ecp/channel_id', data=np.arange(self._rel.nsites))
+            self._ecp_handle = h5py.File(self._ecp_output, 'w')
+            f5 = self._ecp_handle
+            add_hdf5_magic(f5)
+            add_hdf5_version(f5)
+            f5.create_dataset('/ecp/data', (self._nsteps, self._rel_nsites), maxshape=(None, self._rel_nsites),
+                              dtype=np.float64,
+                              chunks=True)
+            f5['/ecp/data'].attrs['units'] = 'mV'
+            # f5.attrs['dt'] = dt
+            # f5.attrs['tstart'] = 0.0
+            # f5.attrs['tstop'] = tstop
+
+            f5.create_dataset('/ecp/time', (3,), data=(0.0, sim.tstop, sim.dt))
+            f5['/ecp/time'].attrs['units'] = 'ms'
+
+            # Save channels. Current we record from all channels, may want to be more selective in the future.
+            f5.create_dataset('/ecp/channel_id', data=np.arange(self._rel.nsites))
 
         pc.barrier()
 
@@ -144,6 +160,10 @@ class EcpMod(SimulatorMod):
         self._rel_nsites = self._rel.nsites
         sim.h.cvode.use_fast_imem(1)  # make i_membrane_ a range variable
 
+        if self._batched:
+            self._setup_batched(sim)
+            return
+
         def set_pointers():
             for gid, cell in sim.net.get_local_cells().items():
             #for gid, cell in sim.net.local_cells.items():
@@ -151,28 +171,88 @@ class EcpMod(SimulatorMod):
                 cell.set_im_ptr()
         self._fih1 = sim.h.FInitializeHandler(0, set_pointers)
 
+    def _setup_batched(self, sim):
+        """Stacks the transfer-resistances of all the local cells into one matrix, and creates a single PtrVector for
+        gathering the i_membrane_ of every local segment, in the same order as the columns of the matrix.
+        """
+        n_segs = 0
+        for gid in self._local_gids:
+            nseg = self._rel.get_transfer_resistance(gid).shape[1]
+            self._seg_offsets[gid] = (n_segs, n_segs + nseg)
+            n_segs += nseg
+
+        self._tr_matrix = np.empty((self._rel_nsites, n_segs), dtype=self._dtype)
+        for gid, (beg, end) in self._seg_offsets.items():
+            self._tr_matrix[:, beg:end] = self._rel.get_transfer_resistance(gid)
+
+        # Limit the number of buffered time steps so that large networks don't run out of memory
+        row_bytes = max(n_segs, 1)*self._dtype.itemsize
+        n_rows = max(1, min(sim.nsteps_block, IM_BUFFER_BYTES // row_bytes))
+        self._im_buffer = np.zeros((n_rows, n_segs), dtype=self._dtype)
+        self._im_buffer_rows = 0
+
+        if n_segs == 0:
+            # PtrVector can't be empty, nothing to gather on this rank
+            return
+
+        self._im_ptr = h.PtrVector(n_segs)
+        self._im_vec = h.Vector(n_segs)
+        cells = [sim.net.get_cell_gid(gid) for gid in self._local_gids]
+
+        def set_pointers():
+            jseg = 0
+            for cell in cells:
+                for sec in cell.hobj.all:
+                    for seg in sec:
+                        self._im_ptr.pset(jseg, seg._ref_i_membrane_)
+                        jseg += 1
+
+        if hasattr(self._im_ptr, 'ptr_update_callback'):
+            # not needed (nor available) in newer versions of NEURON
+            self._im_ptr.ptr_update_callback(set_pointers)
+        self._fih1 = sim.h.FInitializeHandler(0, set_pointers)
+
+    def _calc_buffered_ecp(self):
+        """Calculates the ecp from the buffered membrane currents and adds it to the current data block."""
+        n_rows = self._im_buffer_rows
+        if n_rows == 0:
+            return
+
+        row_beg = self._block_step - n_rows
+        im_buffer = self._im_buffer[:n_rows, :]
+        self._data_block[row_beg:self._block_step, :] += np.dot(im_buffer, self._tr_matrix.T)
+        for gid, data in self._saved_gids.items():
+            beg, end = self._seg_offsets[gid]
+            data[row_beg:self._block_step, :] = np.dot(im_buffer[:, beg:end], self._tr_matrix[:, beg:end].T)
+
+        self._im_buffer_rows = 0
+
+    def _reduce_block(self, n_steps):
+        """Sums the ecp of the current block across all the ranks. Must be called by every rank at the same time."""
+        data_block = self._data_block[0:n_steps, :]
+        if N_HOSTS == 1:
+            return data_block
+
+        # a single collective MPI_Allreduce on a hoc Vector, rather than each rank adding its data to the output file
+        # one at a time
+        data_vec = h.Vector(data_block.ravel())
+        pc.allreduce(data_vec, 1)
+        # copy, as_numpy() doesn't keep data_vec alive
+        return np.array(data_vec.as_numpy()).reshape(data_block.shape)
+
     def _save_block(self, interval):
-        """Add """
+        """Add the ecp from all the ranks for the given time interval and save to the output file."""
         itstart, itend = interval
-        self._tmp_ecp_handle['/ecp/data'][itstart:itend, :] += self._data_block[0:(itend - itstart), :]
-        self._tmp_ecp_handle.flush()
+        data_block = self._reduce_block(itend - itstart)
+        if MPI_RANK == 0:
+            self._ecp_handle['/ecp/data'][itstart:itend, :] = data_block
+            self._ecp_handle.flush()
         self._data_block[:] = 0.0
 
-    def _save_ecp(self, sim):
-        """Save ECP from each rank to disk into a single file"""
-        block_size = sim.nsteps_block
-        nblocks, remain = divmod(self._nsteps, block_size)
-        ivals = [i*block_size for i in range(nblocks+1)]
-        if remain != 0:
-            ivals.append(self._nsteps)
-
-        for rank in range(N_HOSTS):  # iterate over the ranks
-            if rank == MPI_RANK:  # wait until finished with a particular rank
-                with h5py.File(self._ecp_output, 'a') as ecp_f5:
-                    for i in range(len(ivals)-1):
-                        ecp_f5['/ecp/data'][ivals[i]:ivals[i+1], :] += self._tmp_ecp_handle['/ecp/data'][ivals[i]:ivals[i+1], :]
-
-            pc.barrier()
+    def _close_ecp_file(self):
+        if self._ecp_handle is not None:
+            self._ecp_handle.close()
+            self._ecp_handle = None
 
     def _save_cell_vars(self, interval):
         itstart, itend = interval
@@ -183,11 +263,6 @@ class EcpMod(SimulatorMod):
             h5_file.flush()
             data[:] = 0.0
 
-    def _delete_tmp_files(self):
-        if os.path.exists(self._tmp_ecp_file):
-            self._tmp_ecp_handle.close()
-            os.remove(self._tmp_ecp_file)
-
     def initialize(self, sim):
         if self._contributions_dir and (not os.path.exists(self._contributions_dir)) and MPI_RANK == 0:
             os.makedirs(self._contributions_dir)
@@ -207,13 +282,24 @@ class EcpMod(SimulatorMod):
 
         # create list of all cells whose ecp values will be saved separetly
         self._saved_gids = {gid: np.empty((self._block_size, self._rel_nsites))
-                            for gid in self._local_gids}
+                            for gid in self._local_gids} if self._save_individ_cells else {}
         for gid in self._saved_gids.keys():
             self._create_cell_file(gid)
 
         pc.barrier()
 
     def step(self, sim, tstep):
+        if self._batched:
+            if self._im_buffer_rows >= self._im_buffer.shape[0]:
+                self._calc_buffered_ecp()
+
+            if self._im_ptr is not None:
+                self._im_ptr.gather(self._im_vec)
+                self._im_buffer[self._im_buffer_rows, :] = self._im_vec.as_numpy()
+            self._im_buffer_rows += 1
+            self._block_step += 1
+            return
+
         for gid in self._local_gids:  # compute ecp only from the biophysical cells
             cell = sim.net.get_cell_gid(gid)
             im = cell.get_im()
@@ -230,6 +316,8 @@ class EcpMod(SimulatorMod):
         self._block_step += 1
 
     def block(self, sim, block_interval):
+        if self._batched:
+            self._calc_buffered_ecp()
         self._save_block(block_interval)
         if self._save_individ_cells:
             self._save_cell_vars(block_interval)
@@ -242,8 +330,7 @@ class EcpMod(SimulatorMod):
             # just in case the simulation doesn't end on a block step
             self.block(sim, (sim.n_steps - self._block_step, sim.n_steps))
 
-        self._save_ecp(sim)
-        self._delete_tmp_files()
+        self._close_ecp_file()
         pc.barrier()
 
         if self._nwb_path:
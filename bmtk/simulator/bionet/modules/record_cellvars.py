@@ -78,6 +78,8 @@ class MembraneReport(SimulatorMod):
         :param sections:
         :param buffer_data: Set to true then data will be saved to memory until written to disk during each block, reqs.
         more memory but faster. Set to false and data will be written to disk on each step (default: True)
+        :param chunks: optional chunk layout of the report data, "time", "element" or [n_rows, n_cols]
+        :param compression: optional compression of the report data, "gzip" or "lzf"
         """
         self._all_variables = list(variable_name)
         self._variables = list(variable_name)
@@ -106,12 +108,23 @@ class MembraneReport(SimulatorMod):
         self._curr_step = 0
         self._gid_map = None
 
+        # For gathering the values of all the recorded segments at once, see _setup_ptr_recorders()
+        self._ptr_recorders = None  # list of (population, var_name, PtrVector, hoc Vector) or None
+        self._ptr_buffers = {}  # population --> (n_rows x n_segments) array of gathered values
+        self._ptr_buffer_beg = 0  # report time step of the first row in the buffers
+        self._ptr_buffer_rows = 0  # number of rows currently filled
+        self._ptr_buffer_size = 0  # max number of rows in the buffers
+
         # In the use-case that users passes in "dt", "start_time", or "stop_time" parameters manually. Otherwise
         # set to None and get values from corresponding simulation values in initialize() method
         self._dt = kwargs.get('dt', None)
         self._start_time = kwargs.get('start_time', None)
         self._end_time = kwargs.get('end_time', None)
 
+        # hdf5 storage options for the report /data tables
+        self._storage_opts = {k: kwargs[k] for k in ['chunks', 'compression', 'compression_opts', 'shuffle']
+                              if k in kwargs}
+
         self._dt_step = None
         self._start_step = None
         self._end_step = None
@@ -187,6 +200,49 @@ class MembraneReport(SimulatorMod):
     def _save_sim_data(self, sim):
         pass
 
+    def _get_segments(self, cell):
+        """List of segments of a cell that will be recorded, in the same order as the elements added to the report."""
+        segs = cell.morphology.segments
+        stypes = cell.morphology.seg_props.type
+        return [seg for seg, stype in zip(segs, stypes) if stype in self._section_types]
+
+    def _setup_ptr_recorders(self, sim):
+        """Sets up a NEURON PtrVector for every population and variable, so that during each step the values of all
+        the recorded segments can be gathered with one call rather than using getattr() on every segment. The values
+        are stored in an in-memory buffer and written to the report one block at a time.
+
+        Falls back to recording each cell in step() if there are transforms or PtrVector isn't available.
+        """
+        self._ptr_recorders = None
+        if self._transforms or not hasattr(h, 'PtrVector'):
+            return
+
+        pop_segments = {}
+        for gid in self._local_gids:
+            pop_id = self._gid_map.get_pool_id(gid)
+            cell = sim.net.get_cell_gid(gid)
+            pop_segments.setdefault(pop_id.population, []).extend(self._get_segments(cell))
+
+        self._ptr_recorders = []
+        self._ptr_buffer_size = int(np.ceil(max(sim.nsteps_block, 1)/float(self._dt_step))) + 1
+        for population, segments in pop_segments.items():
+            for var_name in self._variables:
+                ptr_vec = h.PtrVector(len(segments))
+                for i, seg in enumerate(segments):
+                    ptr_vec.pset(i, getattr(seg, '_ref_{}'.format(var_name)))
+                self._ptr_recorders.append((population, var_name, ptr_vec, h.Vector(len(segments))))
+            self._ptr_buffers[population] = np.zeros((self._ptr_buffer_size, len(segments)), dtype=float)
+
+    def _write_ptr_buffers(self):
+        if self._ptr_buffer_rows == 0:
+            return
+
+        for population, buffer in self._ptr_buffers.items():
+            self._var_recorder.record_block(buffer[:self._ptr_buffer_rows, :], beg_step=self._ptr_buffer_beg,
+                                            population=population)
+        self._ptr_buffer_beg += self._ptr_buffer_rows
+        self._ptr_buffer_rows = 0
+
     def initialize(self, sim):
         self._set_valid_steps(sim)
         self._var_recorder = MembraneRecorder(
@@ -196,7 +252,8 @@ class MembraneReport(SimulatorMod):
             buffer_size=sim.nsteps_block,
             tstart=self._start_time,
             tstop=self._end_time,
-            dt=self._dt
+            dt=self._dt,
+            **self._storage_opts
         )
         self._gid_map = sim.net.gid_pool
 
@@ -235,12 +292,24 @@ class MembraneReport(SimulatorMod):
             )
 
         self._var_recorder.initialize()
+        self._setup_ptr_recorders(sim)
 
     def step(self, sim, tstep):
         # save all necessary cells/variables at the current time-step into memory
         if not self._record_on_step(tstep):
             return
 
+        if self._ptr_recorders is not None:
+            if self._ptr_buffer_rows >= self._ptr_buffer_size:
+                self._write_ptr_buffers()
+
+            for population, var_name, ptr_vec, gather_vec in self._ptr_recorders:
+                ptr_vec.gather(gather_vec)
+                self._ptr_buffers[population][self._ptr_buffer_rows, :] = gather_vec.as_numpy()
+            self._ptr_buffer_rows += 1
+            self._curr_step += 1
+            return
+
         for gid in self._local_gids:
             pop_id = self._gid_map.get_pool_id(gid)
             cell = sim.net.get_cell_gid(gid)
@@ -269,10 +338,15 @@ class MembraneReport(SimulatorMod):
 
     def block(self, sim, block_interval):
         # write variables in memory to file
-        self._var_recorder.flush()
+        if self._ptr_recorders is not None:
+            self._write_ptr_buffers()
+        else:
+            self._var_recorder.flush()
 
     def finalize(self, sim):
         # TODO: Build in mpi signaling into var_recorder
+        if self._ptr_recorders is not None:
+            self._write_ptr_buffers()
         pc.barrier()
         self._var_recorder.close()
 
@@ -292,7 +366,8 @@ class SomaReport(MembraneReport):
             buffer_size=sim.nsteps_block,
             tstart=self._start_time,
             tstop=self._end_time,
-            dt=self._dt
+            dt=self._dt,
+            **self._storage_opts
         )
         self._gid_map = sim.net.gid_pool
         self._get_gids(sim)
@@ -304,8 +379,16 @@ class SomaReport(MembraneReport):
 
         # self._var_recorder.initialize(sim.n_steps, sim.nsteps_block)
         self._var_recorder.initialize()
+        self._setup_ptr_recorders(sim)
+
+    def _get_segments(self, cell):
+        return [cell.soma[0](0.5)]
 
     def step(self, sim, tstep, rel_time=0.0):
+        if self._ptr_recorders is not None:
+            super(SomaReport, self).step(sim, tstep)
+            return
+
         # save all necessary cells/variables at the current time-step into memory
         if not self._record_on_step(tstep):
             return
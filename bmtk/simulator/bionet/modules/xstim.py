@@ -2,7 +2,6 @@ import os
 import math
 import pandas as pd
 import numpy as np
-import six
 from neuron import h
 
 from bmtk.simulator.bionet.modules.sim_module import SimulatorMod
@@ -26,6 +25,9 @@ class XStimMod(SimulatorMod):
         self._local_gids = []
         self._fih = None
         self._resistance = resistance
+        self._vext_ptrs = None
+        self._vext_unit = None  # extracellular potential of each local segment for a unit waveform amplitude
+        self._waveform_vals = None
 
     # def __set_extracellular_mechanism(self):
     #     for gid in self._local_gids:
@@ -39,28 +41,75 @@ class XStimMod(SimulatorMod):
             self._local_gids = list(set(sim.local_gids) & set(self._all_gids))
 
         self._electrode = StimXElectrode(self._positions_file, self._waveform, self._mesh_files_dir, sim.dt)
+        cells = []
         for gid in self._local_gids:
             # cell = sim.net.get_local_cell(gid)
             cell = sim.net.get_cell_gid(gid)
             cell.setup_xstim(self._set_nrn_mechanisms)
             self._electrode.set_transfer_resistance(gid, cell.seg_coords, rho=self._resistance)
+            cells.append(cell)
 
-        def set_pointers():
-            for gid in self._local_gids:
-                cell = sim.net.get_cell_gid(gid)
-                # cell = sim.net.get_local_cell(gid)
-                cell.set_ptr2e_extracellular()
+        # The waveform is the same for every electrode, so v_ext of each segment is just the waveform amplitude
+        # times a fixed value that can be calculated beforehand.
+        self._vext_ptrs = VextPointers(cells)
+        self._vext_unit = np.zeros(self._vext_ptrs.nseg)
+        for gid, (beg, end) in zip(self._local_gids, self._vext_ptrs.offsets):
+            self._vext_unit[beg:end] = self._electrode.get_vext_unit(gid)
 
-        self._fih = sim.h.FInitializeHandler(0, set_pointers)
+        # Use tstep +1 to match isee-engine existing results. This will make it so that it begins a step earlier
+        # than if using just tstep.
+        self._waveform_vals = self._electrode.calculate_waveform_steps(1, sim.n_steps + 1)
+        self._fih = sim.h.FInitializeHandler(0, self._vext_ptrs.set_pointers)
 
     def step(self, sim, tstep):
-        for gid in self._local_gids:
-            cell = sim.net.get_cell_gid(gid)
-            # Use tstep +1 to match isee-engine existing results. This will make it so that it begins a step earlier
-            # than if using just tstep.
-            self._electrode.calculate_waveforms(tstep+1)
-            vext_vec = self._electrode.get_vext(gid)
-            cell.set_e_extracellular(vext_vec)
+        if tstep < len(self._waveform_vals):
+            amp = self._waveform_vals[tstep]
+        else:
+            amp = self._electrode.waveform.calculate(sim.dt*(tstep + 1))
+
+        np.multiply(self._vext_unit, amp, out=self._vext_ptrs.values)
+        self._vext_ptrs.scatter()
+
+
+class VextPointers(object):
+    """Pointers to the e_extracellular of every segment of a list of cells, used to set the extracellular potentials of
+    all the cells with a single PtrVector.scatter() call every time step, rather than creating a new h.Vector for each
+    cell. The segments are in the same order as the cells, and for each cell the same order as its seg_coords.
+
+    Values are set by updating the values array (shares memory with the hoc Vector) before calling scatter().
+    """
+    def __init__(self, cells):
+        self._cells = cells
+        self.offsets = []  # (beg, end) of each cell's segments
+        self.nseg = 0
+        for cell in cells:
+            nseg = cell.seg_coords.p05.shape[1]
+            self.offsets.append((self.nseg, self.nseg + nseg))
+            self.nseg += nseg
+
+        self._vext_vec = h.Vector(self.nseg)
+        self.values = self._vext_vec.as_numpy()
+        self._ptr_vec = None
+        if self.nseg > 0:
+            self._ptr_vec = h.PtrVector(self.nseg)
+            if hasattr(self._ptr_vec, 'ptr_update_callback'):
+                # not needed (nor available) in newer versions of NEURON
+                self._ptr_vec.ptr_update_callback(self.set_pointers)
+
+    def set_pointers(self):
+        if self._ptr_vec is None:
+            return
+
+        jseg = 0
+        for cell in self._cells:
+            for sec in cell.hobj.all:
+                for seg in sec:
+                    self._ptr_vec.pset(jseg, seg._ref_e_extracellular)
+                    jseg += 1
+
+    def scatter(self):
+        if self._ptr_vec is not None:
+            self._ptr_vec.scatter(self._vext_vec)
 
 
 class StimXElectrode(object):
@@ -141,21 +190,31 @@ class StimXElectrode(object):
     def set_transfer_resistance(self, gid, seg_coords, rho=300.0):
         r05 = seg_coords.p05
         nseg = r05.shape[1]
-        cell_map = np.zeros((self.elnsites, nseg))
-        for el in six.moves.range(self.elnsites):
-            mesh_size = self.el_mesh_size[el]
-            for k in range(mesh_size):
-                rel = np.expand_dims(self.el_mesh[el][:, k], axis=1)
-                rel_05 = rel - r05
-                r2 = np.einsum('ij,ij->j', rel_05, rel_05)
-                r = np.sqrt(r2)
-                if not all(i >= 10 for i in r):
-                    io.log_exception('External electrode is too close')
-                cell_map[el, :] += 1. / r
 
+        # distances between every mesh point (of all the electrodes) and every segment, calculated in chunks of mesh
+        # points to limit memory usage for large meshes.
+        mesh_pts = np.concatenate([self.el_mesh[el] for el in range(self.elnsites)], axis=1)
+        inv_r = np.empty((mesh_pts.shape[1], nseg))
+        chunk_size = max(1, 2**22 // max(nseg, 1))
+        for beg in range(0, mesh_pts.shape[1], chunk_size):
+            end = min(beg + chunk_size, mesh_pts.shape[1])
+            rel_05 = mesh_pts[:, beg:end, np.newaxis] - r05[:, np.newaxis, :]
+            r = np.sqrt(np.einsum('ijk,ijk->jk', rel_05, rel_05))
+            if np.any(r < 10):
+                io.log_exception('External electrode is too close')
+            inv_r[beg:end, :] = 1.0/r
+
+        # sum over the mesh points of each electrode
+        mesh_offsets = np.concatenate(([0], np.cumsum(self.el_mesh_size)[:-1])).astype(int)
+        cell_map = np.add.reduceat(inv_r, mesh_offsets, axis=0) if nseg > 0 else np.zeros((self.elnsites, 0))
         cell_map *= (rho / (4 * math.pi)) * 0.01
         self.trans_X[gid] = cell_map
 
+    def calculate_waveform_steps(self, tstep_beg, tstep_end):
+        """Waveform amplitude at every time step in the range [tstep_beg, tstep_end)."""
+        return np.array([self.waveform.calculate(self._dt*tstep) for tstep in range(tstep_beg, tstep_end)],
+                        dtype=float)
+
     def calculate_waveforms(self, tstep):
         simulation_time = self._dt * tstep
         # copies waveform elnsites times (homogeneous)
@@ -167,3 +226,7 @@ class StimXElectrode(object):
         vext_vec = h.Vector(v_extracellular)
 
         return vext_vec
+
+    def get_vext_unit(self, gid):
+        """The extracellular potential for each segment of a cell for a waveform amplitude of 1."""
+        return np.dot(1.0/np.array(self.el_mesh_size, dtype=float), self.trans_X[gid]) * 1E6
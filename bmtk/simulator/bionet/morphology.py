@@ -246,6 +246,7 @@ class Morphology(object):
         # Used by find_sections() and other methods when building edges/synapses. Should make it faster to look-up
         # cooresponding segments for a large number of syns that target the same area of a cell
         self._trg_segs_cache = {}
+        self._trg_cdf_cache = {}
 
     @property
     def soma(self):
@@ -418,6 +419,29 @@ class Morphology(object):
 
         return tar_seg_ix, tar_seg_prob
 
+    def find_sections_cdf(self, section_names, distance_range):
+        """Same as find_sections() but returns the cumulative probabilities of the target segments, so that the
+        locations of a large number of synapses can be sampled with a single searchsorted(). The cdf is calculated the
+        same way as numpy's RandomState.choice(), so cdf.searchsorted(prng.random_sample(n), side='right') selects the
+        same segments as prng.choice(tar_seg_ix, n, p=tar_seg_prob). Results are always cached.
+
+        :param section_names: A list of sections to target, 'soma', 'dend', 'apic', 'axon'
+        :param distance_range: [float, float]: distance range of sections from the soma, in um.
+        :return: [int], [float]: A list of all the target segment indices and their cumulative probabilities.
+        """
+        cache_key = (tuple(section_names), tuple(distance_range))
+        if cache_key not in self._trg_cdf_cache:
+            tar_seg_ix, tar_seg_prob = self.find_sections(section_names, distance_range, cache=True)
+            cdf = np.cumsum(np.asarray(tar_seg_prob, dtype=np.float64))
+            if len(cdf) > 0:
+                if not np.isfinite(cdf[-1]) or cdf[-1] <= 0.0:
+                    raise ValueError('Invalid target segment probabilities for sections {} in range {}'.format(
+                        section_names, distance_range))
+                cdf /= cdf[-1]
+            self._trg_cdf_cache[cache_key] = (tar_seg_ix, cdf)
+
+        return self._trg_cdf_cache[cache_key]
+
     def move_and_rotate(self, soma_coords=None, rotation_angles=None, inplace=False):
         old_seg_coords = self.seg_coords
         new_p0 = old_seg_coords.p0.copy()
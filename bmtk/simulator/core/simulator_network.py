@@ -25,6 +25,7 @@ class SimNetwork(object):
         self._edge_populations = []
 
         self._gap_juncs = {}
+        self._gap_juncs_index = {}  # network --> {(source_id, target_id): (src_gap_id, trg_gap_id)}
 
     @property
     def io(self):
@@ -190,6 +191,55 @@ class SimNetwork(object):
             with h5py.File(path, 'r') as f:
                 for key in ['source_ids', 'target_ids', 'src_gap_ids', 'trg_gap_ids']:
                     self._gap_juncs[network][key] = f[key][()]
+            self._gap_juncs_index.pop(network, None)
+
+    def index_gap_juncs(self, local_node_ids=None):
+        """Builds a (source_id, target_id) --> (src_gap_id, trg_gap_id) lookup table for the gap junctions of every
+        network, so that finding the ids of a junction doesn't require searching the entire table.
+
+        :param local_node_ids: optional dictionary of network --> node_ids on the current rank. If set only the gap
+            junctions that touch at least one of the nodes are indexed, and the loaded tables are freed.
+        """
+        for network in list(self._gap_juncs.keys()):
+            gap_ids = self._gap_juncs[network]
+            src_ids, trg_ids = gap_ids['source_ids'], gap_ids['target_ids']
+            if local_node_ids is not None and network in local_node_ids:
+                node_ids = np.fromiter(local_node_ids[network], dtype=np.int64)
+                mask = np.isin(src_ids, node_ids) | np.isin(trg_ids, node_ids)
+            else:
+                mask = np.ones(len(src_ids), dtype=bool)
+
+            gj_keys = zip(src_ids[mask].tolist(), trg_ids[mask].tolist())
+            gj_vals = zip(gap_ids['src_gap_ids'][mask].tolist(), gap_ids['trg_gap_ids'][mask].tolist())
+            gj_index = dict(zip(gj_keys, gj_vals))
+            if len(gj_index) < np.count_nonzero(mask):
+                raise Exception("The gap junction file has more than one gap junction with the same ids.")
+
+            self._gap_juncs_index[network] = gj_index
+            if local_node_ids is not None:
+                del self._gap_juncs[network]
+
+    def get_gj_id(self, network, src_nid, trg_nid, source_gap):
+        """Returns the gap junction id for the given nodes on a given network.
+
+        :param network: name of network the gap junction belongs to.
+        :param src_nid: node_id of the source node.
+        :param trg_nid: node_id of the target node.
+        :param source_gap: whether to return the id of the gap junction on the source node or the target node.
+        :return: [src_gap_id, trg_gap_id] if source_gap is True, otherwise [trg_gap_id, src_gap_id]
+        """
+        if src_nid == trg_nid:
+            raise Exception("Cells cannot have gap junctions with themselves.")
+
+        if network not in self._gap_juncs_index:
+            self.index_gap_juncs()
+
+        gj_ids = self._gap_juncs_index.get(network, {}).get((src_nid, trg_nid), None)
+        if gj_ids is None:
+            raise Exception("The gap junction file does not contain a gap junction with source id " +
+                            str(src_nid) + " and target id " + str(trg_nid) + " on network " + network)
+
+        return list(gj_ids) if source_gap else [gj_ids[1], gj_ids[0]]
 
     def build(self):
         self.build_nodes()
@@ -230,6 +280,7 @@ class SimNetwork(object):
         # TODO: These are simulator specific
         network.spike_threshold = config.spike_threshold
         network.dL = config.dL
+        network.load_balance = config.run.get('load_balance', None)
 
         # load components
         for name, value in config.components.items():
@@ -36,6 +36,13 @@ class SonataNodes(NodesReader):
     def n_nodes(self):
         return len(self._node_pop)
 
+    @property
+    def node_ids(self):
+        return self._node_pop.node_ids
+
+    def get_values(self, property_name):
+        return self._node_pop.get_values(property_name)
+
     def nodes_df(self, **params):
         return self._node_pop.to_dataframe(**params)
 
@@ -180,6 +187,22 @@ class SonataEdges(EdgesReader):
         for edge in self._edge_pop.get_target(node_id):
             yield self._edge_adaptors[edge.group_id].get_edge(edge)
 
+    def get_targets(self, node_ids, batch_size=1000):
+        """Iterates through all the edges targeting the list of node_ids. Unlike calling get_target() for each node,
+        the edges of batch_size target nodes are read from the file at once.
+        """
+        node_ids = list(node_ids)
+        for beg in range(0, len(node_ids), batch_size):
+            edge_columns = self._edge_pop.get_target_columns(node_ids[beg:beg + batch_size])
+            for edge in self._edge_pop.edges_from_columns(edge_columns):
+                yield self._edge_adaptors[edge.group_id].get_edge(edge)
+
+    def get_target_columns(self, node_ids, columns=None):
+        return self._edge_pop.get_target_columns(node_ids, columns=columns)
+
+    def target_counts(self, node_ids):
+        return self._edge_pop.target_counts(node_ids)
+
     def get_source(self, node_id):
         for edge in self._edge_pop.get_source(node_id):
             yield self._edge_adaptors[edge.group_id].get_edge(edge)
@@ -1,10 +1,15 @@
 import h5py
 import numpy as np
+import pandas as pd
 
 from .core import CompartmentReaderABC
 from bmtk.utils.hdf5_helper import get_attribute_h5
 
 
+# Max size, in bytes, of each block of data loaded into memory when streaming through a report
+STREAM_BLOCK_BYTES = 2**26
+
+
 class _CompartmentPopulationReaderVer01(CompartmentReaderABC):
     sonata_columns = ['element_ids', 'element_pos', 'index_pointer', 'node_ids', 'time']
 
@@ -18,10 +23,12 @@ class _CompartmentPopulationReaderVer01(CompartmentReaderABC):
         if self._mapping is None:
             raise Exception('could not find /mapping group')
 
-        gids_ds = self._mapping[self.node_ids_ds]  # ['node_ids']
-        index_pointer_ds = self._mapping['index_pointer']
-        for indx, gid in enumerate(gids_ds):
-            self._gid2data_table[gid] = slice(index_pointer_ds[indx], index_pointer_ds[indx+1])
+        gids = self._mapping[self.node_ids_ds][()]  # ['node_ids']
+        index_pointer = self._mapping['index_pointer'][()]
+        self._gid2row = {}  # node_id --> row of the node in /mapping/node_ids
+        for indx, gid in enumerate(gids.tolist()):
+            self._gid2data_table[gid] = slice(int(index_pointer[indx]), int(index_pointer[indx+1]))
+            self._gid2row[gid] = indx
 
         time_ds = self._mapping['time']
         self._t_start = float(time_ds[0])
@@ -118,23 +125,203 @@ class _CompartmentPopulationReaderVer01(CompartmentReaderABC):
                 gid_slice = node_range #slice(node_beg, node_end)
             else:
                 # return all compartments with corresponding element id
-                compartment_list = list(sections) if np.isscalar(sections) else sections
-                gid_slice = [i for i in self._get_index(node_id) if self._mapping['element_ids'] in compartment_list]
+                compartment_list = [sections] if np.isscalar(sections) else sections
+                element_ids = self._mapping['element_ids'][node_range]
+                gid_slice = int(node_range.start) + np.flatnonzero(np.isin(element_ids, compartment_list))
         else:
             gid_slice = slice(0, self._data_grp.shape[1])
 
+        time_slice = self._get_time_slice(time_window)
+        filtered_data = _read_chunk_aligned(self._data_grp, time_slice, gid_slice)
+        return filtered_data if multi_compartments else filtered_data[:]
+
+    def _get_time_slice(self, time_window):
         if time_window is None:
-            time_slice = slice(0, self._n_steps)
+            return slice(0, self._n_steps)
+
+        if len(time_window) != 2:
+            raise Exception('Invalid time_window, expecting tuple [being, end].')
+
+        window_beg = max(int((time_window[0] - self.tstart()) / self.dt()), 0)
+        window_end = min(int((time_window[1] - self.tstart()) / self.dt()), self._n_steps)
+        return slice(window_beg, window_end)
+
+    def get_columns(self, node_ids=None, sections='all'):
+        """Find the columns of the /data table for the given nodes and sections, using the index_pointer and
+        element_ids.
+
+        :param node_ids: list of node_ids, or None for all the nodes in the report.
+        :param sections: 'origin' for the first element of each node, 'all', or a list of element_ids.
+        :return: (columns, node_ids, element_ids) where columns is either a slice (when selecting the entire table) or
+            a sorted array of column indices, and node_ids/element_ids are arrays with the values for each column.
+        """
+        all_node_ids = self.node_ids()
+        index_pointer = self.index_pointer().astype(np.int64)
+        all_element_ids = self.element_ids()
+        n_cols = self._data_grp.shape[1]
+
+        if node_ids is None:
+            node_indices = np.arange(len(all_node_ids))
         else:
-            if len(time_window) != 2:
-                raise Exception('Invalid time_window, expecting tuple [being, end].')
-
-            window_beg = max(int((time_window[0] - self.tstart()) / self.dt()), 0)
-            window_end = min(int((time_window[1] - self.tstart()) / self.dt()), self._n_steps)
-            time_slice = slice(window_beg, window_end)
+            node_ids = [node_ids] if np.isscalar(node_ids) else node_ids
+            for nid in node_ids:
+                self._get_index(nid)  # raises error if node not in report
+            node_indices = np.unique(np.array([self._gid2row[nid] for nid in node_ids], dtype=np.int64))
+
+        if node_ids is None and sections == 'all':
+            col_node_ids = np.repeat(all_node_ids, np.diff(index_pointer))
+            return slice(0, n_cols), col_node_ids, all_element_ids
+
+        begs, ends = index_pointer[node_indices], index_pointer[node_indices + 1]
+        if sections == 'origin':
+            ends = np.minimum(begs + 1, ends)
+        counts = ends - begs
+        columns = np.repeat(ends - np.cumsum(counts), counts) + np.arange(np.sum(counts))
+        col_node_ids = np.repeat(all_node_ids[node_indices], counts)
+        if sections not in ['all', 'origin']:
+            sections = [sections] if np.isscalar(sections) else sections
+            mask = np.isin(all_element_ids[columns], sections)
+            columns, col_node_ids = columns[mask], col_node_ids[mask]
+
+        return columns, col_node_ids, all_element_ids[columns]
+
+    def iter_blocks(self, node_ids=None, time_window=None, sections='all', block_size=None):
+        """Iterates through the report data one block of time steps at a time, so that reports that don't fit in memory
+        can still be processed::
+
+            for times, block in report.iter_blocks(node_ids=[0, 1, 2], sections='origin'):
+                ...
+
+        :param node_ids: list of node_ids, or None for all the nodes in the report.
+        :param time_window: (start, stop) time in ms, or None for the entire report.
+        :param sections: 'origin', 'all', or list of element_ids.
+        :param block_size: number of time steps in each block. By default will use blocks of ~64MB, aligned to the
+            chunks of the dataset.
+        :return: yields (times, data) for each block, where data has shape (n_block_steps, n_columns) with the columns
+            in the same order as returned by get_columns()
+        """
+        columns, _, _ = self.get_columns(node_ids=node_ids, sections=sections)
+        return self._iter_blocks(columns, self._get_time_slice(time_window), block_size)
+
+    def _iter_blocks(self, columns, time_slice, block_size=None, multiple_of=1):
+        n_cols = columns.stop - columns.start if isinstance(columns, slice) else len(columns)
+        time_beg, time_end, _ = time_slice.indices(min(self._n_steps, self._data_grp.shape[0]))
+        if block_size is None:
+            block_size = max(STREAM_BLOCK_BYTES//(max(n_cols, 1)*self._data_grp.dtype.itemsize), 1)
+            chunk_rows = self._data_grp.chunks[0] if self._data_grp.chunks is not None else 1
+            if block_size > chunk_rows:
+                block_size -= block_size % chunk_rows
+        if block_size > multiple_of:
+            # let the caller (eg. downsample) keep windows from crossing block boundaries
+            block_size -= block_size % multiple_of
+        block_size = max(int(block_size), multiple_of)
+
+        time_trace = self.time_trace()
+        for blk_beg in range(time_beg, time_end, block_size):
+            blk_end = min(blk_beg + block_size, time_end)
+            yield time_trace[blk_beg:blk_end], _read_chunk_aligned(self._data_grp, slice(blk_beg, blk_end), columns)
+
+    def node_stats(self, node_ids=None, time_window=None, sections='all', block_size=None):
+        """Finds the mean, min and max value of each node, across all the selected time steps and elements, reading
+        only one block of the report into memory at a time.
+
+        :param node_ids: list of node_ids, or None for all the nodes in the report.
+        :param time_window: (start, stop) time in ms, or None for the entire report.
+        :param sections: 'origin', 'all', or list of element_ids.
+        :param block_size: number of time steps to read at a time.
+        :return: DataFrame indexed by node_id with columns mean, min and max.
+        """
+        columns, col_node_ids, _ = self.get_columns(node_ids=node_ids, sections=sections)
+        n_cols = len(col_node_ids)
+        col_sums = np.zeros(n_cols, dtype=np.float64)
+        col_mins = np.full(n_cols, np.inf)
+        col_maxs = np.full(n_cols, -np.inf)
+        n_rows = 0
+        for _, block in self._iter_blocks(columns, self._get_time_slice(time_window), block_size):
+            col_sums += block.sum(axis=0)
+            np.minimum(col_mins, block.min(axis=0, initial=np.inf), out=col_mins)
+            np.maximum(col_maxs, block.max(axis=0, initial=-np.inf), out=col_maxs)
+            n_rows += block.shape[0]
+
+        # columns of the same node are always next to each other
+        node_starts = np.flatnonzero(np.r_[True, col_node_ids[1:] != col_node_ids[:-1]]) if n_cols > 0 else []
+        node_counts = np.diff(np.r_[node_starts, n_cols])
+        stats_df = pd.DataFrame({
+            'node_id': col_node_ids[node_starts],
+            'mean': np.add.reduceat(col_sums, node_starts)/(node_counts*n_rows) if n_rows > 0 else np.nan,
+            'min': np.minimum.reduceat(col_mins, node_starts) if n_cols > 0 else [],
+            'max': np.maximum.reduceat(col_maxs, node_starts) if n_cols > 0 else []
+        })
+        return stats_df.set_index('node_id')
+
+    def downsample(self, factor, node_ids=None, time_window=None, sections='all', block_size=None):
+        """Reduces the time resolution of the report by averaging every "factor" time steps, reading only one block of
+        the report into memory at a time.
+
+        :param factor: number of consecutive time steps to average together.
+        :param node_ids: list of node_ids, or None for all the nodes in the report.
+        :param time_window: (start, stop) time in ms, or None for the entire report.
+        :param sections: 'origin', 'all', or list of element_ids.
+        :param block_size: number of time steps to read at a time, will be rounded to a multiple of factor.
+        :return: (times, data), the start time of each averaged window and a (n_windows x n_columns) array, with the
+            columns in the same order as returned by get_columns().
+        """
+        factor = int(factor)
+        if factor < 1:
+            raise ValueError('downsample factor must be a positive integer.')
+
+        columns, _, _ = self.get_columns(node_ids=node_ids, sections=sections)
+        times, data = [], []
+        for blk_times, block in self._iter_blocks(columns, self._get_time_slice(time_window), block_size,
+                                                  multiple_of=factor):
+            win_starts = np.arange(0, block.shape[0], factor)
+            win_sizes = np.diff(np.r_[win_starts, block.shape[0]])
+            times.append(blk_times[win_starts])
+            data.append(np.add.reduceat(block, win_starts, axis=0)/win_sizes[:, np.newaxis] if block.shape[1] > 0
+                        else block[win_starts])
+
+        if len(data) == 0:
+            return np.array([]), np.zeros((0, len(self.get_columns(node_ids, sections)[1])))
+        return np.concatenate(times), np.concatenate(data, axis=0)
+
+    def spatial_sum(self, node_ids=None, time_window=None, sections='all', group_by='node', block_size=None):
+        """Sums the values across the elements of each node (or of each section of each node) at every time step,
+        reading only one block of the report into memory at a time.
+
+        :param node_ids: list of node_ids, or None for all the nodes in the report.
+        :param time_window: (start, stop) time in ms, or None for the entire report.
+        :param sections: 'origin', 'all', or list of element_ids to include in the sums.
+        :param group_by: 'node' to sum all the elements of each node, or 'section' to sum the elements of each
+            node + element_id pair.
+        :param block_size: number of time steps to read at a time.
+        :return: (groups, data). A DataFrame of the node_id (and element_id) of each group, and a (n_steps x n_groups)
+            array of the sums.
+        """
+        if group_by not in ['node', 'section']:
+            raise ValueError('Unknown group_by value {}, expected "node" or "section".'.format(group_by))
+
+        columns, col_node_ids, col_element_ids = self.get_columns(node_ids=node_ids, sections=sections)
+        groups = pd.DataFrame({'node_id': col_node_ids})
+        if group_by == 'section':
+            groups['element_id'] = col_element_ids
+
+        group_keys = list(groups.columns)
+        group_ids = groups.groupby(group_keys, sort=False).ngroup().values
+        groups = groups.drop_duplicates().reset_index(drop=True)
+
+        # Order the columns so that elements of the same group are next to each other
+        col_order = np.argsort(group_ids, kind='stable')
+        group_starts = np.flatnonzero(np.r_[True, np.diff(group_ids[col_order]) != 0]) if len(col_order) > 0 else []
+
+        sums = []
+        for _, block in self._iter_blocks(columns, self._get_time_slice(time_window), block_size):
+            if len(group_starts) == 0:
+                sums.append(np.zeros((block.shape[0], 0)))
+            else:
+                sums.append(np.add.reduceat(block[:, col_order], group_starts, axis=1))
 
-        filtered_data = np.array(self._data_grp[time_slice, gid_slice])
-        return filtered_data if multi_compartments else filtered_data[:]
+        data = np.concatenate(sums, axis=0) if len(sums) > 0 else np.zeros((0, len(groups)))
+        return groups, data
 
     def custom_columns(self, population=None):
         return {k: v[()] for k,v in self._custom_cols.items()}
@@ -171,6 +358,65 @@ class _CompartmentPopulationReaderVer00(_CompartmentPopulationReaderVer01):
             return self._mapping['element_id'][self._get_index(node_id)]  # [indx_beg:indx_end]
 
 
+def _read_chunk_aligned(data_ds, time_slice, columns):
+    """Reads data_ds[time_slice, columns] one chunk-aligned block at a time, so that every chunk of the dataset that
+    overlaps the selection is read (and decompressed) only once, and chunks outside the selection are never touched.
+
+    :param data_ds: a 2D (n_steps x n_elements) h5py dataset
+    :param time_slice: slice of rows (time steps) to read.
+    :param columns: either a slice of columns, or a sorted array of column indices.
+    :return: a numpy array of shape (n_rows, n_columns)
+    """
+    row_beg, row_end, _ = time_slice.indices(data_ds.shape[0])
+    row_end = max(row_beg, row_end)
+    if isinstance(columns, slice):
+        col_beg, col_end, _ = columns.indices(data_ds.shape[1])
+        col_end = max(col_beg, col_end)
+        col_indices = None
+        n_cols = col_end - col_beg
+    else:
+        col_indices = np.asarray(columns, dtype=np.int64)
+        n_cols = len(col_indices)
+
+    if row_end == row_beg or n_cols == 0:
+        return np.zeros((row_end - row_beg, n_cols), dtype=data_ds.dtype)
+
+    elif data_ds.chunks is None:
+        # contiguous datasets can be read directly
+        col_selection = slice(col_beg, col_end) if col_indices is None else col_indices
+        return np.array(data_ds[row_beg:row_end, col_selection])
+
+    chunk_rows, chunk_cols = data_ds.chunks
+    if col_indices is None:
+        # split the columns into (col_beg, col_end, output_offset) chunk-aligned blocks
+        col_edges = np.arange((col_beg//chunk_cols + 1)*chunk_cols, col_end, chunk_cols)
+        col_edges = np.concatenate(([col_beg], col_edges, [col_end]))
+        col_blocks = [(b, e, None, b - col_beg) for b, e in zip(col_edges[:-1], col_edges[1:])]
+    else:
+        # group the requested columns by the chunk they belong to and read only the range spanned in each chunk
+        col_blocks = []
+        chunk_ids = col_indices//chunk_cols
+        for chunk_id in np.unique(chunk_ids):
+            out_indices = np.flatnonzero(chunk_ids == chunk_id)
+            chunk_cols_idx = col_indices[out_indices]
+            b, e = chunk_cols_idx.min(), chunk_cols_idx.max() + 1
+            col_blocks.append((b, e, (chunk_cols_idx - b, out_indices), None))
+
+    data = np.empty((row_end - row_beg, n_cols), dtype=data_ds.dtype)
+    row_edges = np.arange((row_beg//chunk_rows + 1)*chunk_rows, row_end, chunk_rows)
+    row_edges = np.concatenate(([row_beg], row_edges, [row_end]))
+    for r_beg, r_end in zip(row_edges[:-1], row_edges[1:]):
+        out_rows = slice(r_beg - row_beg, r_end - row_beg)
+        for c_beg, c_end, selection, out_offset in col_blocks:
+            block = data_ds[r_beg:r_end, c_beg:c_end]
+            if selection is None:
+                data[out_rows, out_offset:(out_offset + c_end - c_beg)] = block
+            else:
+                data[out_rows, selection[1]] = block[:, selection[0]]
+
+    return data
+
+
 class CompartmentReaderVer01(CompartmentReaderABC):
     def __init__(self, filename, mode='r', **params):
         self._h5_handle = h5py.File(filename, mode)
@@ -257,6 +503,27 @@ class CompartmentReaderVer01(CompartmentReaderABC):
         population = population or self.default_population
         return self[population].data(node_id=node_id, time_window=time_window, sections=sections, **opt_attrs)
 
+    def iter_blocks(self, node_ids=None, population=None, time_window=None, sections='all', block_size=None):
+        population = population or self.default_population
+        return self[population].iter_blocks(node_ids=node_ids, time_window=time_window, sections=sections,
+                                            block_size=block_size)
+
+    def node_stats(self, node_ids=None, population=None, time_window=None, sections='all', block_size=None):
+        population = population or self.default_population
+        return self[population].node_stats(node_ids=node_ids, time_window=time_window, sections=sections,
+                                           block_size=block_size)
+
+    def downsample(self, factor, node_ids=None, population=None, time_window=None, sections='all', block_size=None):
+        population = population or self.default_population
+        return self[population].downsample(factor, node_ids=node_ids, time_window=time_window, sections=sections,
+                                           block_size=block_size)
+
+    def spatial_sum(self, node_ids=None, population=None, time_window=None, sections='all', group_by='node',
+                    block_size=None):
+        population = population or self.default_population
+        return self[population].spatial_sum(node_ids=node_ids, time_window=time_window, sections=sections,
+                                            group_by=group_by, block_size=block_size)
+
     def custom_columns(self, population=None):
         population = population or self.default_population
         return self[population].custom_columns(population)
@@ -14,10 +14,51 @@ try:
     barrier = comm.Barrier
 
 except Exception as exc:
+    comm = None
     rank = 0
     nhosts = 1
     barrier = lambda: None
 
+# Whether all ranks can write to the same file using parallel hdf5
+has_mpio = comm is not None and h5py.get_config().mpi
+
+# Approx. size of each /data chunk, in bytes, when using the "time" or "element" chunk layouts. Each chunk is read (and
+# decompressed) as a whole so they should be big enough to keep the number of chunks down but small enough to fit in
+# the default hdf5 chunk cache (1 MB)
+DATA_CHUNK_BYTES = 2**19
+
+
+def data_chunks(chunks, n_steps, n_elements, itemsize=8):
+    """Gets the chunk shape for a (n_steps x n_elements) /data table.
+
+    :param chunks: Either a tuple (n_rows, n_cols) of the chunk shape; "time" for chunks that span (most of) the
+        elements for a small window of time steps, best for reading time windows across all the cells; "element" for
+        chunks that span all the time steps of a few elements, best for reading the traces of individual cells; True or
+        "auto" to let h5py guess; or None/False for a contiguous (non-chunked) layout.
+    :param n_steps: number of time steps (rows)
+    :param n_elements: number of elements/segments (columns)
+    :param itemsize: size of each value in bytes.
+    :return: a chunk shape, True or None, that can be passed to h5py create_dataset().
+    """
+    if chunks is None or chunks is False:
+        return None
+    elif chunks is True or chunks == 'auto' or n_steps == 0 or n_elements == 0:
+        return True
+    elif chunks == 'time':
+        n_cols = max(min(n_elements, DATA_CHUNK_BYTES//itemsize), 1)
+        n_rows = max(min(n_steps, DATA_CHUNK_BYTES//(itemsize*n_cols)), 1)
+    elif chunks == 'element':
+        n_rows = max(min(n_steps, DATA_CHUNK_BYTES//itemsize), 1)
+        n_cols = max(min(n_elements, DATA_CHUNK_BYTES//(itemsize*n_rows)), 1)
+    elif isinstance(chunks, (list, tuple)) and len(chunks) == 2:
+        n_rows = max(min(n_steps, int(chunks[0])), 1)
+        n_cols = max(min(n_elements, int(chunks[1])), 1)
+    else:
+        raise ValueError('Unknown compartment report chunks option {}, expected "time", "element", "auto" or '
+                         '(n_rows, n_cols).'.format(chunks))
+
+    return n_rows, n_cols
+
 
 class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
     """Used to save cell membrane variables (V, Ca2+, etc) to the described hdf5 format.
@@ -38,7 +79,7 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
             self.block_window = (0.0, 10e20)
 
     def __init__(self, parent, population, variable=None, units=None, tstart=0.0, tstop=1.0, dt=0.01, n_steps=None,
-                 buffer_size=0, **kwargs):
+                 buffer_size=0, chunks=True, compression=None, compression_opts=None, shuffle=False, **kwargs):
         self._h5_base = None
         self._parent = parent
 
@@ -71,6 +112,12 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
         self._buffer_block_size = 0
         self._total_steps = 0
 
+        # storage options for the /data table
+        self._chunks = chunks
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._shuffle = shuffle
+
         # Keep track of gids across the different ranks
         self._n_gids_all = 0
         self._n_gids_local = 0
@@ -93,13 +140,22 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
         return self._h5_base
 
     def _calc_offset(self):
-        self._n_segments_all = self._n_segments_local
-        self._seg_offset_beg = 0
-        self._seg_offset_end = self._n_segments_local
+        if self._parent.use_mpio:
+            # Every rank writes to its own slice of the shared file, ordered by rank
+            rank_counts = comm.allgather((self._n_gids_local, self._n_segments_local))
+            mpi_rank = self._parent.mpi_rank
+            self._n_gids_all = sum(c[0] for c in rank_counts)
+            self._gids_beg = sum(c[0] for c in rank_counts[:mpi_rank])
+            self._n_segments_all = sum(c[1] for c in rank_counts)
+            self._seg_offset_beg = sum(c[1] for c in rank_counts[:mpi_rank])
+        else:
+            self._n_gids_all = self._n_gids_local
+            self._gids_beg = 0
+            self._n_segments_all = self._n_segments_local
+            self._seg_offset_beg = 0
 
-        self._n_gids_all = self._n_gids_local
-        self._gids_beg = 0
-        self._gids_end = self._n_gids_local
+        self._gids_end = self._gids_beg + self._n_gids_local
+        self._seg_offset_end = self._seg_offset_beg + self._n_segments_local
 
     def set_units(self, val, population=None):
         self._units = val
@@ -178,15 +234,22 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
         var_grp.create_dataset('element_pos', shape=(self._n_segments_all,), dtype=float)
         var_grp.create_dataset('index_pointer', shape=(self._n_gids_all+1,), dtype=np.uint64)
         var_grp.create_dataset('time', data=[self.tstart(), self.tstop(), self.dt()])
-        for k, v in self._element_data.items():
-            var_grp.create_dataset(k, shape=(self._n_segments_all,), dtype=type(v[0]))
-
-        var_grp['node_ids'][self._gids_beg:self._gids_end] = self._mapping_gids
-        var_grp['element_ids'][self._seg_offset_beg:self._seg_offset_end] = self._mapping_element_ids
-        var_grp['element_pos'][self._seg_offset_beg:self._seg_offset_end] = self._mapping_element_pos
-        var_grp['index_pointer'][self._gids_beg:(self._gids_end+1)] = self._mapping_index
-        for k, v in self._element_data.items():
-            var_grp[k][self._seg_offset_beg:self._seg_offset_end] = v
+        element_dtypes = {k: np.dtype(type(v[0])) for k, v in self._element_data.items()}
+        if self._parent.use_mpio:
+            # datasets must be created by all ranks, including ranks without any cells
+            for rank_dtypes in comm.allgather(element_dtypes):
+                element_dtypes.update({k: v for k, v in rank_dtypes.items() if k not in element_dtypes})
+        for k in sorted(element_dtypes.keys()):
+            var_grp.create_dataset(k, shape=(self._n_segments_all,), dtype=element_dtypes[k])
+
+        if self._n_gids_local > 0:
+            var_grp['node_ids'][self._gids_beg:self._gids_end] = self._mapping_gids
+            var_grp['element_ids'][self._seg_offset_beg:self._seg_offset_end] = self._mapping_element_ids
+            var_grp['element_pos'][self._seg_offset_beg:self._seg_offset_end] = self._mapping_element_pos
+            for k, v in self._element_data.items():
+                var_grp[k][self._seg_offset_beg:self._seg_offset_end] = v
+        var_grp['index_pointer'][self._gids_beg:(self._gids_end+1)] = \
+            np.array(self._mapping_index, dtype=np.uint64) + self._seg_offset_beg
 
         self._total_steps = n_steps
         self._buffer_size = np.min((self._total_steps, self._buffer_size))
@@ -202,8 +265,7 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
             # Set up in-memory block to buffer recorded variables before writing to the dataset
             self._data_block.buffer_block = np.zeros((self._buffer_size, self._n_segments_local), dtype=float)
 
-            self._data_block.data_block = base_grp.create_dataset('data', shape=(self.n_steps(), self._n_segments_all),
-                                                                  dtype=float, chunks=True)
+            self._data_block.data_block = self._create_data_ds(base_grp)
             if self._variable is not None:
                 self._data_block.data_block.attrs['variable'] = self._variable
 
@@ -214,12 +276,7 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
 
         else:
             # Since we are not buffering data, we just write directly to the on-disk dataset
-            self._data_block.buffer_block = base_grp.create_dataset(
-                'data',
-                shape=(self.n_steps(), self._n_segments_all),
-                dtype=float,
-                chunks=True
-            )
+            self._data_block.buffer_block = self._create_data_ds(base_grp)
             if self._variable is not None:
                 self._data_block.buffer_block.attrs['variable'] = self._variable
 
@@ -228,6 +285,14 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
 
         self._is_initialized = True
 
+    def _create_data_ds(self, base_grp):
+        shape = (self.n_steps(), self._n_segments_all)
+        return base_grp.create_dataset('data', shape=shape, dtype=float,
+                                       chunks=data_chunks(self._chunks, *shape),
+                                       compression=self._compression,
+                                       compression_opts=self._compression_opts,
+                                       shuffle=self._shuffle)
+
     def _reset_buffer_window(self, tstep):
         blk_beg = int(tstep/self._buffer_size)*self._buffer_size
         blk_end = blk_beg + self._buffer_size
@@ -274,6 +339,22 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
         else:
             buffer_block[:, gid_beg:gid_end] = vals
 
+    def record_block(self, vals, beg_step):
+        """Save the values of all the (local) elements for a block of consecutive time steps at once, written directly
+        to the dataset. Should not be mixed with record_cell(), since flush() will overwrite the same time steps.
+
+        :param vals: A (n_steps x n_elements) matrix, with columns in the same order the cells were added.
+        :param beg_step: time step of the first row of vals
+        """
+        self.initialize()
+        vals = np.asarray(vals)
+        end_step = min(beg_step + vals.shape[0], self._total_steps)
+        if end_step <= beg_step or self._n_segments_local == 0:
+            return
+
+        data_ds = self._data_block.data_block if self._buffer_data else self._data_block.buffer_block
+        data_ds[beg_step:end_step, self._seg_offset_beg:self._seg_offset_end] = vals[:(end_step - beg_step), :]
+
     def flush(self):
         """Move data from memory to dataset"""
         if self._buffer_data:
@@ -286,7 +367,9 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
                 blk_end = blk_beg + self._total_steps - blk_beg
 
             block_size = blk_end - blk_beg
-            self._data_block.data_block[blk_beg:blk_end, :] = self._data_block.buffer_block[:block_size, :]
+            if self._n_segments_local > 0:
+                self._data_block.data_block[blk_beg:blk_end, self._seg_offset_beg:self._seg_offset_end] = \
+                    self._data_block.buffer_block[:block_size, :]
             self._reset_buffer_window(blk_end+1)
 
     def close(self):
@@ -300,7 +383,15 @@ class PopulationWriterv01(CompartmentWriterABC, CompartmentReader):
 
 class CompartmentWriterv01(CompartmentWriterABC):
     def __init__(self, file_path, mode='w', default_population=None, cache_dir=None, variable=None, units=None,
-                 buffer_size=0, tstart=0.0, tstop=0.0, dt=0.0, n_steps=None, **kwargs):
+                 buffer_size=0, tstart=0.0, tstop=0.0, dt=0.0, n_steps=None, chunks=True, compression=None,
+                 compression_opts=None, shuffle=False, **kwargs):
+        """
+        :param chunks: chunk layout of the /data tables, "time", "element", "auto" or a (n_rows, n_cols) tuple. See
+            data_chunks() for details.
+        :param compression: optional compression filter for the /data tables, "gzip" or "lzf".
+        :param compression_opts: compression level when using gzip (0-9).
+        :param shuffle: use the hdf5 shuffle filter, usually improves compression.
+        """
         self._mode = mode
         self._variable = variable
         self._units = units
@@ -313,6 +404,8 @@ class CompartmentWriterv01(CompartmentWriterABC):
         self._dt = dt
         self._n_steps = n_steps
         self._kwargs = kwargs
+        self._ds_opts = {'chunks': chunks, 'compression': compression, 'compression_opts': compression_opts,
+                         'shuffle': shuffle}
 
         self._h5_handle = None
         self._h5report_grp = None
@@ -320,23 +413,42 @@ class CompartmentWriterv01(CompartmentWriterABC):
         self._mpi_rank = kwargs.get('mpi_rank', rank)
         self._mpi_size = kwargs.get('mpi_size', nhosts)
 
+        # When h5py is built with parallel hdf5 all the ranks write directly to the final file, otherwise each rank
+        # writes to a temp file which are merged at the end. Filters (compression) can't be used with independent
+        # parallel writes.
+        self._use_mpio = kwargs.get('use_mpio', True) and has_mpio and 1 < self._mpi_size == nhosts \
+            and compression is None and not shuffle
+
         self._final_fpath = file_path  # name of file being writen too.
         self._cache_dir = cache_dir or os.path.dirname(os.path.abspath(file_path))  # used for mulitple ranks
         self._base_name = os.path.basename(file_path)  # make sure file names don't clash if there are multiple reports
         self._interm_fpath = self._get_iterm_fpath()  # In certain cases (parallelized simulation) split the final file by rank.
 
+    @property
+    def use_mpio(self):
+        return self._use_mpio
+
+    @property
+    def mpi_rank(self):
+        return self._mpi_rank
+
     def _get_iterm_fpath(self):
-        if self._mpi_size > 1:
+        if self._mpi_size > 1 and not self._use_mpio:
             return self.temp_files[self._mpi_rank]
         else:
             return self._final_fpath
 
     def _create_h5file(self):
         fdir = os.path.dirname(os.path.abspath(self._interm_fpath))
-        if not os.path.exists(fdir):
-            os.mkdir(fdir)
-
-        self._h5_handle = h5py.File(self._interm_fpath, self._mode)
+        if self._use_mpio:
+            if self._mpi_rank == 0 and not os.path.exists(fdir):
+                os.mkdir(fdir)
+            barrier()
+            self._h5_handle = h5py.File(self._interm_fpath, self._mode, driver='mpio', comm=comm)
+        else:
+            if not os.path.exists(fdir):
+                os.mkdir(fdir)
+            self._h5_handle = h5py.File(self._interm_fpath, self._mode)
         add_hdf5_version(self._h5_handle)
         add_hdf5_magic(self._h5_handle)
 
@@ -382,8 +494,17 @@ class CompartmentWriterv01(CompartmentWriterABC):
         pop_grp.add_cell(node_id=node_id, element_ids=element_ids, element_pos=element_pos, **element_data)
 
     def initialize(self):
-        for pop_grp in self._pop_tables.values():
-            pop_grp.initialize()
+        if self._use_mpio:
+            # creating groups and datasets is a collective operation, every rank has to initialize the same
+            # populations in the same order, even if the rank has no cells in a population.
+            populations = set(self._pop_tables.keys())
+            for rank_pops in comm.allgather(list(populations)):
+                populations.update(rank_pops)
+            for population in sorted(populations):
+                self._build_or_fetch_pop(population).initialize()
+        else:
+            for pop_grp in self._pop_tables.values():
+                pop_grp.initialize()
 
     def record_cell(self, node_id, vals, tstep, population=None):
         pop_str = population or self._default_pop
@@ -393,6 +514,9 @@ class CompartmentWriterv01(CompartmentWriterABC):
     def record_cell_block(self, node_id, vals, beg_step, end_step, population=None):
         self[population].record_cell_block(node_id=node_id, vals=vals, beg_step=beg_step, end_step=end_step)
 
+    def record_block(self, vals, beg_step, population=None):
+        self[population].record_block(vals=vals, beg_step=beg_step)
+
     def flush(self):
         for pop_grp in self._pop_tables.values():
             pop_grp.flush()
@@ -404,7 +528,7 @@ class CompartmentWriterv01(CompartmentWriterABC):
         if self._h5_handle is not None:
             self._h5_handle.close()
 
-        if self._mpi_size > 1:
+        if self._mpi_size > 1 and not self._use_mpio:
             self.merge()
 
     def merge(self):
@@ -499,7 +623,11 @@ class CompartmentWriterv01(CompartmentWriterABC):
                 # combine the /var/data datasets
                 data_name = '/report/{}/data'.format(pop)
                 # data_name = '/{}/data'.format(var_name)
-                var_data = h5final.create_dataset(data_name, shape=(n_steps, total_seg_count), dtype=float)
+                var_data = h5final.create_dataset(data_name, shape=(n_steps, total_seg_count), dtype=float,
+                                                  chunks=data_chunks(self._ds_opts['chunks'], n_steps, total_seg_count),
+                                                  compression=self._ds_opts['compression'],
+                                                  compression_opts=self._ds_opts['compression_opts'],
+                                                  shuffle=self._ds_opts['shuffle'])
                 # var_data.attrs['variable_name'] = var_name
                 i = 0
                 for rpt in tmp_reports:
@@ -530,7 +658,7 @@ class CompartmentWriterv01(CompartmentWriterABC):
         else:
             pop_grp = PopulationWriterv01(self, population, variable=self._variable, units=self._units,
                                           tstart=self._tstart, tstop=self._tstop, dt=self._dt,
-                                          buffer_size=self._buffer_size, n_steps=self._n_steps)
+                                          buffer_size=self._buffer_size, n_steps=self._n_steps, **self._ds_opts)
             self._pop_tables[population] = pop_grp
         return pop_grp
 
@@ -81,6 +81,19 @@ class CompartmentReaderABC(object):
     def data(self, node_id=None, population=None, time_window=None, sections='all', **opt_attrs):
         raise NotImplementedError()
 
+    def iter_blocks(self, node_ids=None, population=None, time_window=None, sections='all', block_size=None):
+        raise NotImplementedError()
+
+    def node_stats(self, node_ids=None, population=None, time_window=None, sections='all', block_size=None):
+        raise NotImplementedError()
+
+    def downsample(self, factor, node_ids=None, population=None, time_window=None, sections='all', block_size=None):
+        raise NotImplementedError()
+
+    def spatial_sum(self, node_ids=None, population=None, time_window=None, sections='all', group_by='node',
+                    block_size=None):
+        raise NotImplementedError()
+
     def custom_columns(self, population=None):
         raise NotImplementedError()
 
@@ -134,6 +147,9 @@ class CompartmentWriterABC(object):
     def record_cell_block(self, node_id, values, tbegin, tend, population=None):
         raise NotImplementedError()
 
+    def record_block(self, values, beg_step, population=None):
+        raise NotImplementedError()
+
     def close(self):
         raise NotImplementedError()
 
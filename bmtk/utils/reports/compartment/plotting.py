@@ -211,38 +211,38 @@ def plot_traces_averaged(report, population=None, sections='origin', node_groups
     node_groups, selected_ids = __get_node_groups(report=cr, node_groups=node_groups, population=pop)
 
     nodes_array = cr.node_ids(population=pop)
-    trace_times = cr.time_trace(population=pop)
-    traces_data = cr.data(sections=sections, population=pop)
+    selected_ids = nodes_array[np.isin(nodes_array, selected_ids)]
+    _, col_node_ids, _ = cr[pop].get_columns(node_ids=selected_ids, sections=sections)
+    grp_cols = [np.flatnonzero(np.isin(col_node_ids, grp['node_ids'])) for grp in node_groups]
+
+    # Stream through the report so only the group averages (and optionally the background traces) are kept in memory
+    trace_times, grp_means, background_data = [], [[] for _ in node_groups], []
+    for blk_times, block in cr.iter_blocks(node_ids=selected_ids, population=pop, sections=sections, time_window=times):
+        trace_times.append(blk_times)
+        for grp_indx, cols in enumerate(grp_cols):
+            grp_means[grp_indx].append(block[:, cols].mean(axis=1) if len(cols) > 0 else None)
+        if show_background:
+            background_data.append(block)
+    trace_times = np.concatenate(trace_times) if len(trace_times) > 0 else np.array([])
 
     if times is not None:
         min_ts, max_ts = times[0], times[1]
-        times_indx = np.argwhere((trace_times >= min_ts) & (trace_times <= max_ts))
-        times_indx = times_indx.flatten()
-        traces_data = traces_data[times_indx, :]
-        trace_times = trace_times[times_indx]
     else:
         min_ts, max_ts = trace_times[0], trace_times[-1]
 
     fig, axes = plt.subplots()
     has_labels = False
 
-    if show_background:
-        nodes_indx = np.argwhere(np.isin(nodes_array, selected_ids))
-        nodes_indx = nodes_indx.flatten()
-        background_data = traces_data[:, nodes_indx]
-        axes.plot(trace_times, background_data, c='lightgray')
+    if show_background and len(background_data) > 0:
+        axes.plot(trace_times, np.concatenate(background_data, axis=0), c='lightgray')
 
-    for node_grp in node_groups:
-        grp_ids = node_grp.pop('node_ids')
+    for grp_indx, node_grp in enumerate(node_groups):
+        node_grp.pop('node_ids')
         has_labels = has_labels or 'label' in node_grp
-
-        nodes_indx = np.argwhere(np.isin(nodes_array, grp_ids))
-        nodes_indx = nodes_indx.flatten()
-        if len(nodes_indx) == 0:
+        if len(grp_cols[grp_indx]) == 0:
             continue
 
-        grp_data = traces_data[:, nodes_indx]
-        grp_mean = grp_data.mean(axis=1)
+        grp_mean = np.concatenate(grp_means[grp_indx])
         axes.plot(trace_times, grp_mean, **node_grp)
 
     axes.set_xlim(min_ts, max_ts)
@@ -21,6 +21,8 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 from enum import Enum
+import numpy as np
+import six
 
 from bmtk.utils.io import bmtk_world_comm
 
@@ -59,6 +61,36 @@ csv_headers = [col_timestamps, col_population, col_node_ids]
 pop_na = '<sonata:none>'
 
 
+def spikes_block(timestamps, populations, node_ids):
+    """Creates a block of spikes, as returned by spikes_blocks(), a dictionary of equal length numpy arrays.
+
+    :param timestamps: array of spike times
+    :param populations: array of population names, or a single population name for all the spikes
+    :param node_ids: array of node ids
+    """
+    timestamps = np.asarray(timestamps)
+    if isinstance(populations, six.string_types):
+        populations = np.full(len(timestamps), populations, dtype=object)
+
+    return {col_timestamps: timestamps, col_population: np.asarray(populations, dtype=object),
+            col_node_ids: np.asarray(node_ids)}
+
+
+def filter_spikes_block(block, node_ids=None, time_window=None):
+    """Filters a block of spikes by node_ids and/or time window (inclusive), returns None if all spikes are removed."""
+    if node_ids is not None or time_window is not None:
+        mask = np.ones(len(block[col_timestamps]), dtype=bool)
+        if node_ids is not None:
+            mask &= np.isin(block[col_node_ids], [node_ids] if np.isscalar(node_ids) else node_ids)
+        if time_window is not None:
+            mask &= (time_window[0] <= block[col_timestamps]) & (block[col_timestamps] <= time_window[1])
+
+        if not np.all(mask):
+            block = {k: v[mask] for k, v in block.items()}
+
+    return block if len(block[col_timestamps]) > 0 else None
+
+
 def find_conversion(units_old, units_new):
     if units_new is None or units_old is None:
         return 1.0
@@ -20,7 +20,9 @@
 # WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import os
 import csv
+import heapq
 import pandas as pd
 import numpy as np
 import h5py
@@ -30,6 +32,7 @@ import warnings
 
 from .spike_trains_api import SpikeTrainsReadOnlyAPI
 from .core import SortOrder, csv_headers, col_population, col_timestamps, col_node_ids, pop_na
+from .core import spikes_block, filter_spikes_block
 
 
 GRP_spikes_root = 'spikes'
@@ -90,8 +93,69 @@ def to_list(v):
         return v
 
 
+def _read_indices(dataset, indices):
+    """Reads the values of a dataset for a slice or a sorted array of indices."""
+    if isinstance(indices, slice):
+        return dataset[indices]
+    elif len(indices) == 0:
+        return np.array([], dtype=dataset.dtype)
+
+    beg, end = indices[0], indices[-1] + 1
+    if end - beg <= 8*len(indices):
+        # Faster to read the entire range and filter in memory than to do point selection in hdf5
+        return dataset[beg:end][indices - beg]
+    else:
+        return dataset[indices]
+
+
+def _merge_time_sorted(chunk_itrs):
+    """k-way merge of multiple streams of time sorted spikes, using a heap of the next timestamp of each stream.
+
+    :param chunk_itrs: list of iterators, each one yielding (timestamps, node_ids) chunks in time order.
+    :return: yields (stream_index, timestamps, node_ids) runs of spikes, where the concatenation of all the runs is
+        sorted by time. When two streams have the same timestamp the spikes of the earlier stream come first.
+    """
+    buffers = [None]*len(chunk_itrs)  # stream_index --> [timestamps, node_ids, position]
+    heap = []
+
+    def next_chunk(i):
+        for timestamps, node_ids in chunk_itrs[i]:
+            if len(timestamps) > 0:
+                buffers[i] = [timestamps, node_ids, 0]
+                heapq.heappush(heap, (timestamps[0], i))
+                return
+
+    for i in range(len(chunk_itrs)):
+        next_chunk(i)
+
+    while heap:
+        _, i = heapq.heappop(heap)
+        timestamps, node_ids, pos = buffers[i]
+        if heap:
+            # take all the buffered spikes up to the next timestamp of any of the other streams
+            next_ts, next_i = heap[0]
+            end = pos + np.searchsorted(timestamps[pos:], next_ts, side='right' if i < next_i else 'left')
+            end = max(end, pos + 1)
+        else:
+            end = len(timestamps)
+
+        yield i, timestamps[pos:end], node_ids[pos:end]
+
+        if end < len(timestamps):
+            buffers[i][2] = end
+            heapq.heappush(heap, (timestamps[end], i))
+        else:
+            next_chunk(i)
+
+
 class SonataSTReader(SpikeTrainsReadOnlyAPI):
     def __init__(self, path, **kwargs):
+        """
+        :param path: path to SONATA spikes file.
+        :param index_cache: Set to True (or to a file path) to save the node_ids index of each population to disk the
+            first time it is built, so that next time the file is opened it can be loaded instead of rebuilt. When True
+            the index is saved in <path>.index.h5, default False.
+        """
         self._path = path
         self._h5_handle = h5py.File(self._path, 'r')
         self._DATASET_node_ids = 'node_ids'
@@ -100,8 +164,13 @@ class SonataSTReader(SpikeTrainsReadOnlyAPI):
         self._default_pop = None
         # self._node_list = None
 
-        self._indexed = False
+        # The node_ids index of each population are only built when needed, see _get_node_index()
         self._index_nids = {}
+        index_cache = kwargs.get('index_cache', False)
+        if index_cache is True:
+            self._index_cache_path = '{}.index.h5'.format(path)
+        else:
+            self._index_cache_path = index_cache or None
 
         if GRP_spikes_root not in self._h5_handle:
             raise Exception('Could not find /{} root'.format(GRP_spikes_root))
@@ -154,8 +223,6 @@ class SonataSTReader(SpikeTrainsReadOnlyAPI):
 
             self._population_sorting_map[pop_name] = sort_order
 
-        # TODO: Add option to skip building indices
-        self._build_node_index()
 
         # units are not instrinsic to a csv file, but allow users to pass it in if they know
         self._units_maps = {}
@@ -169,32 +236,89 @@ class SonataSTReader(SpikeTrainsReadOnlyAPI):
 
             self._units_maps[pop_name] = pop_units
 
-    def _build_node_index(self):
-        self._indexed = False
-        for pop_name, pop_grp in self._population_map.items():
-            sort_order = self._population_sorting_map[pop_name]
-            nodes_indices = {}
-            # loop on h5 is slow, so convert it to np before the loop.
-            node_ids_ds = np.array(pop_grp[self._DATASET_node_ids])
-            if sort_order == SortOrder.by_id:
-                indx_beg = 0
-                last_id = node_ids_ds[0]
-                for indx, cur_id in enumerate(node_ids_ds):
-                    if cur_id != last_id:
-                        # nodes_indices[last_id] = np.arange(indx_beg, indx)
-                        nodes_indices[last_id] = slice(indx_beg, indx)
-                        last_id = cur_id
-                        indx_beg = indx
-                # nodes_indices[last_id] = np.arange(indx_beg, indx + 1)
-                nodes_indices[last_id] = slice(indx_beg, indx + 1)  # capture the last node_id
-            else:
-                nodes_indices = {int(node_id): [] for node_id in np.unique(node_ids_ds)}
-                for indx, node_id in enumerate(node_ids_ds):
-                    nodes_indices[node_id].append(indx)
+    def _get_node_index(self, population):
+        """Returns the index used to find the spikes of each node in a population, as a tuple (unique_ids, offsets,
+        order) of arrays. The spikes of node unique_ids[i] are at order[offsets[i]:offsets[i+1]] in the datasets, or
+        directly at offsets[i]:offsets[i+1] when order is None (the spikes are already sorted by node_id).
+        """
+        if population not in self._index_nids:
+            node_index = self._load_cached_index(population)
+            if node_index is None:
+                node_index = self._build_node_index(population)
+                self._save_cached_index(population, node_index)
+            self._index_nids[population] = node_index
+
+        return self._index_nids[population]
+
+    def _build_node_index(self, population):
+        node_ids = self._population_map[population][self._DATASET_node_ids][()]
+        if self._population_sorting_map[population] == SortOrder.by_id and np.all(node_ids[1:] >= node_ids[:-1]):
+            order = None
+            sorted_ids = node_ids
+        else:
+            # stable sort, so that the spikes of each node are kept in the same order as they are in the file
+            order = np.argsort(node_ids, kind='stable')
+            sorted_ids = node_ids[order]
+
+        unique_ids, offsets = np.unique(sorted_ids, return_index=True)
+        offsets = np.append(offsets, len(sorted_ids))
+        return unique_ids, offsets, order
 
-            self._index_nids[pop_name] = nodes_indices
+    def _index_cache_key(self, population):
+        stat = os.stat(self._path)
+        return '{}-{}-{}'.format(os.path.abspath(self._path), stat.st_size, stat.st_mtime_ns), population
 
-        self._indexed = True
+    def _load_cached_index(self, population):
+        if self._index_cache_path is None or not os.path.exists(self._index_cache_path):
+            return None
+
+        try:
+            file_key, pop_key = self._index_cache_key(population)
+            with h5py.File(self._index_cache_path, 'r') as h5:
+                if h5.attrs.get('source', None) != file_key or pop_key not in h5:
+                    return None
+                pop_grp = h5[pop_key]
+                order = pop_grp['order'][()] if 'order' in pop_grp else None
+                return pop_grp['node_ids'][()], pop_grp['offsets'][()], order
+        except Exception as e:
+            warnings.warn('Unable to read spikes index cache {}: {}'.format(self._index_cache_path, e))
+            return None
+
+    def _save_cached_index(self, population, node_index):
+        if self._index_cache_path is None:
+            return
+
+        try:
+            file_key, pop_key = self._index_cache_key(population)
+            with h5py.File(self._index_cache_path, 'a') as h5:
+                if h5.attrs.get('source', None) != file_key:
+                    # index was built for another (or an older version of the) spikes file
+                    for grp_name in list(h5.keys()):
+                        del h5[grp_name]
+                    h5.attrs['source'] = file_key
+                if pop_key in h5:
+                    del h5[pop_key]
+
+                pop_grp = h5.create_group(pop_key)
+                unique_ids, offsets, order = node_index
+                pop_grp.create_dataset('node_ids', data=unique_ids)
+                pop_grp.create_dataset('offsets', data=offsets)
+                if order is not None:
+                    pop_grp.create_dataset('order', data=order)
+        except Exception as e:
+            warnings.warn('Unable to save spikes index cache {}: {}'.format(self._index_cache_path, e))
+
+    def _get_spike_indices(self, population, node_id):
+        """Returns a slice or sorted array of indices for the spikes of node_id, or None if the node has no spikes."""
+        unique_ids, offsets, order = self._get_node_index(population)
+        i = np.searchsorted(unique_ids, node_id)
+        if i >= len(unique_ids) or unique_ids[i] != node_id:
+            return None
+
+        if order is None:
+            return slice(int(offsets[i]), int(offsets[i+1]))
+        else:
+            return order[offsets[i]:offsets[i+1]]
 
     @property
     def populations(self):
@@ -281,10 +405,10 @@ class SonataSTReader(SpikeTrainsReadOnlyAPI):
         elif population not in self._population_map:
             return []
 
-        spikes_index = self._index_nids[population].get(node_id, None)
+        spikes_index = self._get_spike_indices(population, node_id)
         if spikes_index is None:
             return []
-        spike_times = self._population_map[population][DATASET_timestamps][spikes_index]
+        spike_times = _read_indices(self._population_map[population][DATASET_timestamps], spikes_index)
 
         if time_window is not None:
             spike_times = spike_times[(time_window[0] <= spike_times) & (spike_times <= time_window[1])]
@@ -292,69 +416,97 @@ class SonataSTReader(SpikeTrainsReadOnlyAPI):
         return spike_times
 
     def spikes(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none, **kwargs):
+        for block in self.spikes_blocks(node_ids=node_ids, populations=populations, time_window=time_window,
+                                        sort_order=sort_order, **kwargs):
+            for spike in zip(block[col_timestamps], block[col_population], block[col_node_ids]):
+                yield spike
+
+    def spikes_blocks(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none,
+                      block_size=100000, **kwargs):
+        # buffer_size is the name spikes() originally used for the size of the time-sorted blocks
+        block_size = kwargs.pop('buffer_size', block_size)
         populations = populations or self.populations
         if np.isscalar(populations):
             populations = [populations]
+        pop_names = [p for p in populations if p in self.populations]
 
-        if sort_order == SortOrder.by_id:
-            for pop_name in populations:
-                if pop_name not in self.populations:
-                    continue
-
-                timestamps_ds = self._population_map[pop_name][DATASET_timestamps]
-                index_map = self._index_nids[pop_name]
-                node_ids = list(index_map.keys())
-                node_ids.sort()
-                for node_id in node_ids:
-                    st_indices = index_map[node_id]
-                    for st in timestamps_ds[st_indices]:  # st_indices:
-                        yield st, pop_name, node_id
-
-        elif sort_order == SortOrder.by_time:
-            # TODO: Reimplement using a heap
-            index_ranges = []
-            for pop_name in populations:
-                if pop_name not in self.populations:
-                    continue
-
-                pop_grp = self._population_map[pop_name]
-                if self._population_sorting_map[pop_name] == SortOrder.by_time:
-                    ts_ds = pop_grp[DATASET_timestamps]
-                    index_ranges.append([pop_name, 0, len(ts_ds), np.arange(len(ts_ds)), pop_grp, ts_ds[0]])
-                else:
-                    ts_ds = pop_grp[DATASET_timestamps]
-                    ts_indices = np.argsort(ts_ds[()])
-                    index_ranges.append([pop_name, 0, len(ts_ds), ts_indices, pop_grp, ts_ds[ts_indices[0]]])
-
-            while index_ranges:
-                selected_r = index_ranges[0]
-                for i, r in enumerate(index_ranges[1:]):
-                    if r[5] < selected_r[5]:
-                        selected_r = r
-
-                ds_index = selected_r[1]
-                timestamp = selected_r[5]  # pop_grp[DATASET_timestamps][ds_index]
-                node_id = selected_r[4][self._DATASET_node_ids][ds_index]
-                pop_name = selected_r[0]
-                ds_index += 1
-                if ds_index >= selected_r[2]:
-                    index_ranges.remove(selected_r)
-                else:
-                    selected_r[1] = ds_index
-                    ts_index = selected_r[3][ds_index]
-                    next_ts = self._population_map[pop_name][DATASET_timestamps][selected_r[3][ds_index]]
-                    selected_r[5] = next_ts  # pop_grp[DATASET_timestamps][selected_r[3][ds_index]]
-
-                yield timestamp, pop_name, node_id
+        if sort_order == SortOrder.by_time:
+            # merge all the populations into one time-sorted stream of spikes, combining runs into blocks
+            chunk_itrs = [self._time_sorted_chunks(p, block_size) for p in pop_names]
+            runs, n_buffered = [], 0
+            for pop_indx, timestamps, run_node_ids in _merge_time_sorted(chunk_itrs):
+                runs.append((pop_indx, timestamps, run_node_ids))
+                n_buffered += len(timestamps)
+                if n_buffered >= block_size:
+                    timestamps, populations, run_node_ids = self._concat_runs(runs, pop_names)
+                    n_full = n_buffered - n_buffered % block_size
+                    for beg in range(0, n_full, block_size):
+                        end = beg + block_size
+                        block = spikes_block(timestamps[beg:end], populations[beg:end], run_node_ids[beg:end])
+                        block = filter_spikes_block(block, node_ids=node_ids, time_window=time_window)
+                        if block is not None:
+                            yield block
+
+                    # keep the left-over spikes for the next block
+                    runs, n_buffered = [], n_buffered - n_full
+                    if n_buffered > 0:
+                        runs.append((populations[n_full:], timestamps[n_full:], run_node_ids[n_full:]))
+
+            if runs:
+                block = spikes_block(*self._concat_runs(runs, pop_names))
+                block = filter_spikes_block(block, node_ids=node_ids, time_window=time_window)
+                if block is not None:
+                    yield block
 
         else:
-            for pop_name in populations:
-                if pop_name not in self.populations:
-                    continue
-
+            for pop_name in pop_names:
                 pop_grp = self._population_map[pop_name]
-                for i in range(len(pop_grp[DATASET_timestamps])):
-                    yield pop_grp[DATASET_timestamps][i], pop_name, pop_grp[self._DATASET_node_ids][i]
+                timestamps_ds = pop_grp[DATASET_timestamps]
+                node_ids_ds = pop_grp[self._DATASET_node_ids]
+                order = None
+                if sort_order == SortOrder.by_id:
+                    _, _, order = self._get_node_index(pop_name)
+
+                n_spikes = len(timestamps_ds)
+                if order is not None:
+                    timestamps_ds = timestamps_ds[()][order]
+                    node_ids_ds = node_ids_ds[()][order]
+
+                for beg in range(0, n_spikes, block_size):
+                    end = min(beg + block_size, n_spikes)
+                    block = spikes_block(timestamps_ds[beg:end], pop_name, node_ids_ds[beg:end])
+                    block = filter_spikes_block(block, node_ids=node_ids, time_window=time_window)
+                    if block is not None:
+                        yield block
+
+    @staticmethod
+    def _concat_runs(runs, pop_names):
+        """Combines a list of (population index or array of population names, timestamps, node_ids) runs into single
+        timestamps, populations and node_ids arrays."""
+        timestamps = np.concatenate([r[1] for r in runs])
+        populations = np.concatenate([
+            np.full(len(r[1]), pop_names[r[0]], dtype=object) if np.isscalar(r[0]) else r[0] for r in runs
+        ])
+        node_ids = np.concatenate([r[2] for r in runs])
+        return timestamps, populations, node_ids
+
+    def _time_sorted_chunks(self, population, block_size):
+        """Iterates through the (timestamps, node_ids) of a population in time order, block_size spikes at a time."""
+        pop_grp = self._population_map[population]
+        timestamps_ds = pop_grp[DATASET_timestamps]
+        node_ids_ds = pop_grp[self._DATASET_node_ids]
+        n_spikes = len(timestamps_ds)
+        if self._population_sorting_map[population] == SortOrder.by_time:
+            for beg in range(0, n_spikes, block_size):
+                end = min(beg + block_size, n_spikes)
+                yield timestamps_ds[beg:end], node_ids_ds[beg:end]
+        else:
+            timestamps = timestamps_ds[()]
+            order = np.argsort(timestamps, kind='stable')
+            node_ids = node_ids_ds[()]
+            for beg in range(0, n_spikes, block_size):
+                indices = order[beg:(beg + block_size)]
+                yield timestamps[indices], node_ids[indices]
 
     def __len__(self):
         if self._n_spikes is None:
@@ -390,6 +542,12 @@ class SonataOldReader(SonataSTReader):
         return super(SonataOldReader, self).spikes(node_ids=node_ids, populations=None,
                                                    time_window=time_window, sort_order=sort_order, **kwargs)
 
+    def spikes_blocks(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none,
+                      block_size=100000, **kwargs):
+        return super(SonataOldReader, self).spikes_blocks(node_ids=node_ids, populations=None,
+                                                          time_window=time_window, sort_order=sort_order,
+                                                          block_size=block_size, **kwargs)
+
 
 class EmptySonataReader(SpikeTrainsReadOnlyAPI):
     """A Hack that is needed for when a simulation produces a file with no spikes, since there won't/can't be
@@ -513,7 +671,7 @@ class CSVSTReader(SpikeTrainsReadOnlyAPI):
     #
     #     return selected[col_timestamps].agg([np.min, np.max]).values
 
-    def spikes(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none, **kwargs):
+    def _select(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none):
         selected = self._spikes_df.copy()
 
         mask = True
@@ -538,10 +696,24 @@ class CSVSTReader(SpikeTrainsReadOnlyAPI):
         elif sort_order == SortOrder.by_id:
             selected.sort_values(by=col_node_ids, inplace=True)
 
+        return selected
+
+    def spikes(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none, **kwargs):
+        selected = self._select(node_ids=node_ids, populations=populations, time_window=time_window,
+                                sort_order=sort_order)
         indicies = selected.index.values
         for indx in indicies:
             yield tuple(self._spikes_df.iloc[indx])
 
+    def spikes_blocks(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none,
+                      block_size=100000, **kwargs):
+        selected = self._select(node_ids=node_ids, populations=populations, time_window=time_window,
+                                sort_order=sort_order)
+        for beg in range(0, len(selected), block_size):
+            block_df = selected.iloc[beg:(beg + block_size)]
+            yield spikes_block(block_df[col_timestamps].values, block_df[col_population].values,
+                               block_df[col_node_ids].values)
+
     def __len__(self):
         if self._n_spikes is None:
             self._n_spikes = len(self._spikes_df)
@@ -23,7 +23,7 @@
 import numpy as np
 import warnings
 
-from .core import SortOrder
+from .core import SortOrder, spikes_block, filter_spikes_block
 from .spikes_file_writers import write_csv, write_sonata, write_nwb
 
 
@@ -144,6 +144,46 @@ class SpikeTrainsAPI(object):
         """
         raise NotImplementedError()
 
+    def spikes_blocks(self, node_ids=None, populations=None, time_window=None, sort_order=SortOrder.none,
+                      block_size=100000, **kwargs):
+        """Iterate over the saved spikes one block at a time, where each block is a dictionary of numpy arrays with
+        keys 'timestamps', 'population' and 'node_ids'. Returns the same spikes in the same order as spikes(), but
+        without the overhead of handling each spike in python::
+
+            for block in spike_trains.spikes_blocks(populations='v1', time_window=(0.0, 500.0)):
+                block['timestamps'], block['node_ids'] ...
+
+        :param node_ids: int or list of ints, only return spikes of the given nodes. By default all nodes are returned.
+        :param populations: string or list of strings, used to select specific node_populations. By default all
+            populations with spikes data is iterated over
+        :param time_window: (min-time, max-time) used to limit the spikes returned. By default returns all spikes.
+        :param sort_order: 'by_time', 'by_id', 'none'
+        :param block_size: maximum number of spikes in each block
+        :param kwargs: optional arguments
+        :return: A generator of dictionaries with 'timestamps', 'population' and 'node_ids' arrays.
+        """
+        # Default implementation, gather spikes() into blocks. Subclasses should override if they can read blocks of
+        # spikes directly
+        buffer = []
+        for spk in self.spikes(populations=populations, time_window=time_window, sort_order=sort_order, **kwargs):
+            buffer.append(spk)
+            if len(buffer) >= block_size:
+                block = self._spikes_list_to_block(buffer, node_ids, time_window)
+                buffer = []
+                if block is not None:
+                    yield block
+
+        if buffer:
+            block = self._spikes_list_to_block(buffer, node_ids, time_window)
+            if block is not None:
+                yield block
+
+    @staticmethod
+    def _spikes_list_to_block(spikes, node_ids, time_window):
+        timestamps, populations, spk_node_ids = zip(*spikes)
+        return filter_spikes_block(spikes_block(timestamps, populations, spk_node_ids), node_ids=node_ids,
+                                   time_window=time_window)
+
     def to_sonata(self, path, mode='w', sort_order=SortOrder.none, compression='gzip', **kwargs):
         """Write current spike-trains to a sonata hdf5 file
 
@@ -27,7 +27,7 @@ import numpy as np
 from datetime import datetime
 
 import bmtk
-from .core import SortOrder, csv_headers, col_population, find_conversion
+from .core import SortOrder, csv_headers, col_population, col_timestamps, col_node_ids, find_conversion
 from .core import MPI_rank, comm_barrier
 from bmtk.utils.sonata.utils import add_hdf5_magic, add_hdf5_version
 
@@ -104,10 +104,13 @@ def write_sonata_itr(path, spiketrain_reader, mode='w', sort_order=SortOrder.non
             timestamps_ds.attrs['units'] = units
             node_ids_ds = spikes_grp.create_dataset('node_ids', shape=(n_spikes,), dtype=np.uint64, compression=compression)
 
-        for i, spk in enumerate(spiketrain_reader.spikes(populations=pop_name, sort_order=sort_order)):
+        beg = 0
+        for block in spiketrain_reader.spikes_blocks(populations=pop_name, sort_order=sort_order):
+            end = beg + len(block[col_timestamps])
             if MPI_rank == 0:
-                timestamps_ds[i] = spk[0]*conv_factor
-                node_ids_ds[i] = spk[2]
+                timestamps_ds[beg:end] = block[col_timestamps]*conv_factor
+                node_ids_ds[beg:end] = block[col_node_ids]
+            beg = end
 
     comm_barrier()
 
@@ -140,11 +143,13 @@ def write_csv_itr(path, spiketrain_reader, mode='w', sort_order=SortOrder.none,
         if include_header:
             csv_writer.writerow(cols_to_print)
 
-    for spk in spiketrain_reader.spikes(sort_order=sort_order):
+    for block in spiketrain_reader.spikes_blocks(sort_order=sort_order):
         if MPI_rank == 0:
-            ts = spk[0]*conv_factor
-            c_data = [ts, spk[1], spk[2]] if include_population else [ts, spk[2]]
-            csv_writer.writerow(c_data)
+            timestamps = block[col_timestamps]*conv_factor
+            if include_population:
+                csv_writer.writerows(zip(timestamps, block[col_population], block[col_node_ids]))
+            else:
+                csv_writer.writerows(zip(timestamps, block[col_node_ids]))
 
     comm_barrier()
 
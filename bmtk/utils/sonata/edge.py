@@ -21,21 +21,37 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 class EdgeSet(object):
+    """A selection of edges from a population, stored as an array of (sorted) row indicies. Edge objects are only
+    created when iterating over the set.
+    """
     def __init__(self, edge_ids, population):
         self._edge_ids = edge_ids
         self._population = population
         self._n_edges = len(self._edge_ids)
         self.__itr = 0
 
+    @property
+    def edge_ids(self):
+        return self._edge_ids
+
+    def to_dataframe(self):
+        return self._population.rows_to_dataframe(self._edge_ids)
+
+    def __len__(self):
+        return self._n_edges
+
     def __iter__(self):
         self.__itr = 0
         return self
 
     def next(self):
+        return self.__next__()
+
+    def __next__(self):
         if self.__itr >= self._n_edges:
             raise StopIteration
 
-        next_edge = self._population.iloc(self._edge_ids[self.__itr])
+        next_edge = self._population.get_row(self._edge_ids[self.__itr])
         self.__itr += 1
         return next_edge
 
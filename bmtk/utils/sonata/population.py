@@ -20,6 +20,7 @@
 # WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import numbers
 import pandas as pd
 import h5py
 import numpy as np
@@ -30,6 +31,11 @@ from .edge import Edge, EdgeSet
 from .group import NodeGroup, EdgeGroup
 
 
+# columns returned by EdgePopulation.get_target_columns() that are not edge properties
+_edge_index_columns = ['edge_id', 'source_node_id', 'target_node_id', 'edge_type_id', 'edge_group_id',
+                       'edge_group_index']
+
+
 class Population(object):
     def __init__(self, pop_name, pop_group, types_table):
         self._pop_name = pop_name
@@ -290,6 +296,33 @@ class NodePopulation(Population):
         # self._node_type_id_ds
         return self._type_id_ds[list(row_indicies)]
 
+    def get_values(self, property_name):
+        """Returns the value of a node group or node-type property for every node, in the same order as the rows of the
+        population. Nodes that don't have the property will have value None.
+
+        :param property_name: name of node or node-type property
+        :return: numpy (object) array with one value for each node
+        """
+        values = np.full(self._nrows, None, dtype=object)
+        missing = np.ones(self._nrows, dtype=bool)
+        grp_ids = self._group_id_ds[()]
+        grp_indicies = self._group_index_ds[()]
+        for grp_id in self.group_ids:
+            grp = self.get_group(grp_id)
+            grp_rows = np.flatnonzero(grp_ids == grp_id)
+            if property_name in grp and len(grp_rows) > 0:
+                prop_ds = grp.get_dataset(property_name)
+                values[grp_rows] = list(_read_column(prop_ds, 0, len(prop_ds))[grp_indicies[grp_rows]])
+                missing[grp_rows] = False
+
+        if np.any(missing) and property_name in self.types_table.columns:
+            missing_rows = np.flatnonzero(missing)
+            type_ids, type_lu = np.unique(self._type_id_ds[()][missing_rows], return_inverse=True)
+            type_vals = _to_array([self.types_table[int(nt_id)].get(property_name, None) for nt_id in type_ids])
+            values[missing_rows] = type_vals[type_lu]
+
+        return values
+
     def get_node_id(self, node_id):
         row_indx = self._index_nid2row.loc[node_id]
         return self.get_row(row_indx)
@@ -340,8 +373,8 @@ class NodePopulation(Population):
         elif isinstance(item, int):
             return self.get_row(item)
 
-        elif isinstance(item, list):
-            return NodeSet(item)
+        elif isinstance(item, (list, np.ndarray)):
+            return NodeSet(item, self)
         else:
             print('Unable to get item using {}.'.format(type(item)))
 
@@ -512,75 +545,143 @@ class EdgePopulation(Population):
                     group_props=edge_group_props, edge_types_props=edge_types_props)
 
     def filter(self, **filter_props):
-        selected_edge_types = set(self.edge_types_table.edge_type_ids)
-        types_filter = False  # Do we need to filter results by edge_type_id
-        if 'edge_type_id' in filter_props:
-            # TODO: Make sure the edge_type_id is valid
-            selected_edge_types = set([filter_props['edge_type_id']])
-            del filter_props['edge_type_id']
-            types_filter = True
+        """Iterates through all the edges that match the given property values, eg. filter(edge_type_id=100).
+        Properties can be either edge-types properties or edge group properties, and the value may be a list.
+        """
+        for row_indicies in self._itr_filter_indicies(filter_props):
+            for indx in row_indicies:
+                yield self.get_row(indx)
 
-        if 'group_id' in filter_props:
-            grp_id = filter_props['group_id']
-            grp_id = [grp_id] if np.isscalar(grp_id) else grp_id
-            selected_groups = set(grp_id)
-            del filter_props['group_id']
-        else:
-            selected_groups = set(self._group_map.keys())  # list of grp_id's that will be used
+    def filter_indicies(self, chunk_size=1000000, **filter_props):
+        """Returns a sorted array of all the rows (edge ids) that match the given property values. The population
+        datasets are read and compared in chunks of chunk_size rows, without creating an Edge object for every row.
+
+        :param chunk_size: number of rows to read from the hdf5 at a time
+        :param filter_props: property_name=value (or list of values) pairs to filter by
+        :return: numpy array of row indicies
+        """
+        row_indicies = list(self._itr_filter_indicies(filter_props, chunk_size))
+        return np.concatenate(row_indicies) if row_indicies else np.array([], dtype=np.uint64)
 
-        group_prop_filter = {}  # list of actual query statements
+    def select(self, chunk_size=1000000, **filter_props):
+        """Like filter() but returns an EdgeSet of all matching edges. Edge objects are only created when iterating
+        over the EdgeSet, and the selection can be converted to a DataFrame with EdgeSet.to_dataframe().
+        """
+        return self.get_rows(self.filter_indicies(chunk_size=chunk_size, **filter_props))
+
+    def get_rows(self, row_indicies):
+        """Returns an EdgeSet of the given (sorted) row indicies."""
+        return EdgeSet(row_indicies, self)
+
+    def _itr_filter_indicies(self, filter_props, chunk_size=1000000):
+        filter_props = dict(filter_props)
+        selected_edge_types = None  # None if we don't need to filter by edge_type_id
+        if 'edge_type_id' in filter_props:
+            edge_type_ids = filter_props.pop('edge_type_id')
+            selected_edge_types = set([edge_type_ids] if np.isscalar(edge_type_ids) else edge_type_ids)
+
+        selected_groups = set(self._group_map.keys())  # list of grp_id's that will be used
         group_filter = False  # do we need to filter results by group_id
+        if 'group_id' in filter_props:
+            grp_id = filter_props.pop('group_id')
+            selected_groups &= set([grp_id] if np.isscalar(grp_id) else grp_id)
+            group_filter = True
 
-        # Go through filter key==value pairs, create filters for groups and edge_types
+        group_prop_filter = {}  # group property --> value(s)
         for filter_key, filter_val in filter_props.items():
-            # Find out what groups, if any, the column should search in.
-            group_query = False  # If it's querying a group property don't look in edge_types
-            types_query = False
-            for grp_id, grp_h5 in self._group_map.items():
-                if filter_key in grp_h5:
-                    # TODO: Need to check the dtype's match
-                    selected_groups &= set([grp_id])
-                    group_prop_filter[filter_key] = filter_val
-                    group_query = True
-                    group_filter = True
-
-            if (not group_query) and filter_key in self.edge_types_table.columns:
+            prop_groups = set(grp_id for grp_id, grp_h5 in self._group_map.items() if filter_key in grp_h5)
+            if prop_groups:
+                # only edges in groups containing the property can match
+                selected_groups &= prop_groups
+                group_prop_filter[filter_key] = filter_val
+                group_filter = True
+
+            elif filter_key in self.edge_types_table.columns:
                 # Presearch the edge types and get only those edge_type_ids which match key==val
-                selected_edge_types &= set(self.edge_types_table.find(filter_key, filter_val))
-                types_filter = True
-                types_query = True
+                matching_types = set(self.edge_types_table.find(filter_key, filter_val))
+                selected_edge_types = matching_types if selected_edge_types is None \
+                    else selected_edge_types & matching_types
 
-            if not (group_query or types_query):
+            else:
                 # Property key neither exists in a group or the edge_types_table
                 raise Exception('Could not find property {}'.format(filter_key))
 
-        # Iterate through all nodes, only returning those that match the filter
-        for indx in range_itr(self._nrows):
-            # Filter by edge_type_id
-            if types_filter:
-                # TODO: Invert the selected_edge_types, it will be faster to fail immeditely than search the entire list
-                if self._type_id_ds[indx] not in selected_edge_types:
-                    continue
-
-            # Filter by group properties
-            if group_filter:
-                # TODO: Invert group search
-                grp_id = self._group_id_ds[indx]
-                if grp_id not in selected_groups:
-                    continue
+        if (selected_edge_types is not None and len(selected_edge_types) == 0) or len(selected_groups) == 0:
+            return
 
-                grp_index = self._group_index_ds[indx]
-                search_failed = True
-                for prop_key, prop_val in group_prop_filter.items():
-                    if prop_val != self._group_map[grp_id][prop_key][grp_index]:
-                        break
-                else:
-                    search_failed = False
+        selected_edge_types = None if selected_edge_types is None else np.array(list(selected_edge_types))
+        selected_groups = np.array(list(selected_groups))
+        for beg in range_itr(0, self._nrows, chunk_size):
+            end = min(beg + chunk_size, self._nrows)
+            mask = np.ones(end - beg, dtype=bool)
+            if selected_edge_types is not None:
+                mask &= np.isin(self._type_id_ds[beg:end], selected_edge_types)
 
-                if search_failed:
+            if group_filter:
+                grp_ids = self._group_id_ds[beg:end]
+                mask &= np.isin(grp_ids, selected_groups)
+
+                if group_prop_filter:
+                    grp_indicies = self._group_index_ds[beg:end]
+                    for grp_id in selected_groups:
+                        grp_rows = np.flatnonzero(mask & (grp_ids == grp_id))
+                        if len(grp_rows) == 0:
+                            continue
+
+                        # read the (contiguous) block of the group datasets used by this chunk
+                        grp_idx = grp_indicies[grp_rows]
+                        idx_beg, idx_end = np.min(grp_idx), np.max(grp_idx) + 1
+                        matches = np.ones(len(grp_rows), dtype=bool)
+                        for prop_key, prop_val in group_prop_filter.items():
+                            prop_vals = _read_column(self._group_map[grp_id][prop_key], idx_beg, idx_end)
+                            matches &= _match_values(prop_vals[grp_idx - idx_beg], prop_val)
+                        mask[grp_rows[~matches]] = False
+
+            yield np.flatnonzero(mask).astype(np.uint64) + beg
+
+    def rows_to_dataframe(self, row_indicies, chunk_size=1000000):
+        """Returns a DataFrame of the edges in the given sorted row indicies, including the edge group and edge-types
+        properties. Properties that only exist in some of the groups will be NaN for the other edges.
+        """
+        row_indicies = np.asarray(row_indicies, dtype=np.int64)
+        edges_df = pd.DataFrame({
+            'edge_type_id': _read_rows(self._type_id_ds, row_indicies, chunk_size),
+            'source_node_id': _read_rows(self._source_node_id_ds, row_indicies, chunk_size),
+            'target_node_id': _read_rows(self._target_node_id_ds, row_indicies, chunk_size),
+            'edge_group_id': _read_rows(self._group_id_ds, row_indicies, chunk_size),
+            'edge_group_index': _read_rows(self._group_index_ds, row_indicies, chunk_size)
+        }, index=pd.Index(row_indicies, name='edge_id'))
+
+        group_cols = set()
+        for grp_id, grp_h5 in self._group_map.items():
+            grp_rows = np.flatnonzero(edges_df['edge_group_id'].values == grp_id)
+            if len(grp_rows) == 0:
+                continue
+
+            grp_idx = edges_df['edge_group_index'].values[grp_rows]
+            for col_name, col_ds in grp_h5.items():
+                if not isinstance(col_ds, h5py.Dataset) or len(col_ds.shape) != 1:
                     continue
 
-            yield self.get_row(indx)
+                if col_name not in edges_df.columns:
+                    edges_df[col_name] = np.nan if col_ds.dtype.kind in 'iuf' else None
+                col_vals = _read_indicies(col_ds, grp_idx)
+                edges_df.iloc[grp_rows, edges_df.columns.get_loc(col_name)] = col_vals
+                group_cols.add(col_name)
+
+        # Add edge-types properties, for properties in both use the edge-type values only for edges whose group
+        # doesn't have the property.
+        edge_types_df = self.edge_types_table.to_dataframe()
+        edge_types_df = edge_types_df[[c.name for c in self.edge_types_table.columns]]
+        edges_df = edges_df.reset_index().merge(edge_types_df, how='left', left_on='edge_type_id', right_index=True,
+                                                suffixes=('', '__edge_types'))
+        for col_name in group_cols:
+            types_col = col_name + '__edge_types'
+            if types_col in edges_df.columns:
+                edges_df[col_name] = edges_df[col_name].fillna(edges_df[types_col])
+                edges_df = edges_df.drop(types_col, axis=1)
+
+        return edges_df.set_index('edge_id')
 
     def get_target(self, target_node_id):
         # TODO: Raise an exception, or call find() and log a warning that the index is not available
@@ -596,6 +697,159 @@ class EdgePopulation(Population):
             for edge in self._get_index(trg_index, trg_id):
                 yield edge
 
+    def get_target_columns(self, target_node_ids, columns=None):
+        """Returns all the edges targeting the given node ids as a dictionary of numpy arrays, one value per edge. The
+        edges are found using the target_to_source index and each dataset is read in a few contiguous blocks, rather
+        than one row at a time like get_target(). Edges are ordered the same way as get_targets(target_node_ids).
+
+        Along with the edge_id, source_node_id, target_node_id, edge_type_id, edge_group_id and edge_group_index
+        columns the dictionary will contain the edge group properties (syn_weight, sec_id, sec_x, etc). For properties
+        missing in some of the groups the edge-types value is used, otherwise the value is NaN/None.
+
+        :param target_node_ids: list of target node ids
+        :param columns: list of properties to include, may contain edge-types properties. By default uses all the
+            group properties.
+        :return: dictionary of column_name --> numpy array
+        """
+        assert(self._has_target_index)
+        return self._get_index_columns(self._targets_index, target_node_ids, columns)
+
+    def get_source_columns(self, source_node_ids, columns=None):
+        """Same as get_target_columns() but for all the edges from the given source node ids."""
+        assert(self._has_source_index)
+        return self._get_index_columns(self._sources_index, source_node_ids, columns)
+
+    def edges_from_columns(self, edge_columns):
+        """Iterates through the edges in a dictionary returned by get_target_columns()/get_source_columns(), creating
+        an Edge object for each one without having to go back to the hdf5 file.
+        """
+        col_values = {col_name: col_vals.tolist() for col_name, col_vals in edge_columns.items()}
+        group_columns = {}
+        for grp_id, grp_h5 in self._group_map.items():
+            group_columns[grp_id] = [c for c in edge_columns.keys() if c not in _edge_index_columns
+                                     and isinstance(grp_h5.get(c, None), h5py.Dataset)]
+
+        edge_types_table = self.edge_types_table
+        for i in range_itr(len(col_values['edge_id'])):
+            grp_id = col_values['edge_group_id'][i]
+            yield Edge(trg_node_id=col_values['target_node_id'][i], src_node_id=col_values['source_node_id'][i],
+                       source_pop=self.source_population, target_pop=self.target_population, group_id=grp_id,
+                       group_props={c: col_values[c][i] for c in group_columns[grp_id]},
+                       edge_types_props=edge_types_table[col_values['edge_type_id'][i]])
+
+    def _get_index_columns(self, index_struct, lookup_ids, columns=None):
+        row_indicies = self._get_index_rows(index_struct, lookup_ids)
+        edge_columns = {
+            'edge_id': row_indicies,
+            'source_node_id': _read_indicies(self._source_node_id_ds, row_indicies),
+            'target_node_id': _read_indicies(self._target_node_id_ds, row_indicies),
+            'edge_type_id': _read_indicies(self._type_id_ds, row_indicies),
+            'edge_group_id': _read_indicies(self._group_id_ds, row_indicies),
+            'edge_group_index': _read_indicies(self._group_index_ds, row_indicies)
+        }
+
+        if columns is None:
+            columns = []
+            for grp_h5 in self._group_map.values():
+                columns += [c for c, ds in grp_h5.items() if isinstance(ds, h5py.Dataset) and len(ds.shape) == 1
+                            and c not in columns]
+
+        n_edges = len(row_indicies)
+        grp_ids = edge_columns['edge_group_id']
+        grp_indicies = edge_columns['edge_group_index']
+        for col_name in columns:
+            if col_name in edge_columns:
+                continue
+
+            in_edge_types = col_name in self.edge_types_table.columns
+            col_groups = [grp_id for grp_id, grp_h5 in self._group_map.items()
+                          if isinstance(grp_h5.get(col_name, None), h5py.Dataset)]
+            if not col_groups and not in_edge_types:
+                raise Exception('Could not find property {}'.format(col_name))
+
+            # list of (rows, values) for each group that has the property
+            col_parts = []
+            missing = np.ones(n_edges, dtype=bool)
+            for grp_id in col_groups:
+                grp_rows = np.flatnonzero(grp_ids == grp_id)
+                if len(grp_rows) > 0:
+                    col_ds = self._group_map[grp_id][col_name]
+                    col_parts.append((grp_rows, _read_indicies(col_ds, grp_indicies[grp_rows])))
+                    missing[grp_rows] = False
+
+            col_dtypes = [self._group_map[grp_id][col_name].dtype for grp_id in col_groups]
+            if in_edge_types and np.any(missing):
+                missing_rows = np.flatnonzero(missing)
+                type_ids, type_lu = np.unique(edge_columns['edge_type_id'][missing_rows], return_inverse=True)
+                type_vals = _to_array([self.edge_types_table[int(et_id)].get(col_name, None) for et_id in type_ids])
+                has_val = np.array([v is not None for v in type_vals], dtype=bool)[type_lu]
+                col_parts.append((missing_rows[has_val], type_vals[type_lu][has_val]))
+                col_dtypes.append(type_vals.dtype)
+                missing[missing_rows[has_val]] = False
+
+            if col_dtypes and all(dt.kind in 'biuf' for dt in col_dtypes):
+                if np.any(missing):
+                    col_vals = np.full(n_edges, np.nan, dtype=np.result_type(np.float64, *col_dtypes))
+                else:
+                    col_vals = np.empty(n_edges, dtype=np.result_type(*col_dtypes))
+            else:
+                col_vals = np.full(n_edges, None, dtype=object)
+
+            for rows, vals in col_parts:
+                col_vals[rows] = vals
+            edge_columns[col_name] = col_vals
+
+        return edge_columns
+
+    def _get_index_rows(self, index_struct, lookup_ids):
+        """Uses a source/target index to find the row indicies of all edges for the given list of node ids."""
+        lookup_ids = np.asarray(lookup_ids, dtype=np.int64).ravel()
+        lookup_ids = lookup_ids[(lookup_ids >= 0) & (lookup_ids < len(index_struct.lookup_table))]
+        if len(lookup_ids) == 0:
+            return np.array([], dtype=np.uint64)
+
+        # node_id_to_range --> rows of range_to_edge_id --> edge ranges
+        lookup_ranges = _read_indicies(index_struct.lookup_table, lookup_ids).astype(np.int64)
+        range_indicies = _expand_ranges(lookup_ranges[:, 0], lookup_ranges[:, 1])
+        edge_ranges = _read_indicies(index_struct.edge_table, range_indicies).astype(np.int64)
+        return _expand_ranges(edge_ranges[:, 0], edge_ranges[:, 1]).astype(np.uint64)
+
+    def target_counts(self, target_node_ids, chunk_size=1000000):
+        """Returns the number of edges targeting each of the given node ids. Uses the target_to_source index if it
+        exists, otherwise the target_node_id dataset is read in chunks of chunk_size rows.
+
+        :param target_node_ids: list of node ids
+        :param chunk_size: number of rows to read at a time when the population has no target index
+        :return: array of edge counts, one for each target node id
+        """
+        target_node_ids = np.asarray(target_node_ids, dtype=np.int64).ravel()
+        counts = np.zeros(len(target_node_ids), dtype=np.int64)
+        if len(target_node_ids) == 0:
+            return counts
+
+        if not self._has_target_index:
+            max_id = int(np.max(target_node_ids))
+            id_counts = np.zeros(max_id + 1, dtype=np.int64)
+            for beg in range_itr(0, self._nrows, chunk_size):
+                trg_ids = self._target_node_id_ds[beg:min(beg + chunk_size, self._nrows)].astype(np.int64)
+                id_counts += np.bincount(trg_ids[trg_ids <= max_id], minlength=max_id + 1)
+            valid = target_node_ids >= 0
+            counts[valid] = id_counts[target_node_ids[valid]]
+            return counts
+
+        index_struct = self._targets_index
+        valid = np.flatnonzero((target_node_ids >= 0) & (target_node_ids < len(index_struct.lookup_table)))
+        if len(valid) == 0:
+            return counts
+
+        lookup_ranges = _read_indicies(index_struct.lookup_table, target_node_ids[valid]).astype(np.int64)
+        n_ranges = np.maximum(lookup_ranges[:, 1] - lookup_ranges[:, 0], 0)
+        edge_ranges = _read_indicies(index_struct.edge_table, _expand_ranges(lookup_ranges[:, 0], lookup_ranges[:, 1]))
+        range_sizes = np.maximum(edge_ranges[:, 1].astype(np.int64) - edge_ranges[:, 0].astype(np.int64), 0)
+        range_owners = np.repeat(np.arange(len(valid)), n_ranges)
+        counts[valid] = np.bincount(range_owners, weights=range_sizes, minlength=len(valid)).astype(np.int64)
+        return counts
+
     def get_source(self, source_node_id):
         assert(self._has_source_index)
         return self._get_index(self._sources_index, source_node_id)
@@ -634,3 +888,65 @@ class EdgePopulation(Population):
 
     def next(self):
         return self.__next__()
+
+
+def _read_column(dataset, beg, end):
+    """Reads a range of a hdf5 dataset, strings are returned as str rather than bytes."""
+    if h5py.check_string_dtype(dataset.dtype) is not None:
+        return np.array(dataset.asstr()[beg:end], dtype=object)
+    return dataset[beg:end]
+
+
+def _read_rows(dataset, row_indicies, chunk_size, max_gap=100000):
+    """Reads the values of dataset for a sorted array of row indicies, chunk_size rows at a time. Within each chunk rows
+    that are close together are read as one contiguous block (see _read_indicies()), so sparse selections don't read
+    the whole range between the first and last row.
+    """
+    values = np.empty(len(row_indicies), dtype=dataset.dtype)
+    for i in range_itr(0, len(row_indicies), chunk_size):
+        values[i:i + chunk_size] = _read_indicies(dataset, row_indicies[i:i + chunk_size], max_gap=max_gap)
+    return values
+
+
+def _read_indicies(dataset, indicies, max_gap=100000):
+    """Reads the values of dataset for an unsorted (and possibly repeating) array of indicies. Indicies that are close
+    together are read in the same contiguous block, rather than doing a separate read for each value.
+    """
+    indicies = np.asarray(indicies, dtype=np.int64)
+    is_str = h5py.check_string_dtype(dataset.dtype) is not None
+    values = np.empty((len(indicies), ) + dataset.shape[1:], dtype=object if is_str else dataset.dtype)
+    if len(indicies) == 0:
+        return values
+
+    order = np.argsort(indicies, kind='stable')
+    sorted_indicies = indicies[order]
+    block_begs = np.concatenate(([0], np.flatnonzero(np.diff(sorted_indicies) > max_gap) + 1))
+    block_ends = np.append(block_begs[1:], len(sorted_indicies))
+    for beg, end in zip(block_begs, block_ends):
+        idx_beg, idx_end = sorted_indicies[beg], sorted_indicies[end - 1] + 1
+        values[order[beg:end]] = _read_column(dataset, idx_beg, idx_end)[sorted_indicies[beg:end] - idx_beg]
+    return values
+
+
+def _expand_ranges(range_begs, range_ends):
+    """Converts arrays of [beg, end) ranges into one array of all the indicies in each range."""
+    counts = np.maximum(range_ends - range_begs, 0)
+    offsets = np.repeat(range_begs - np.cumsum(counts) + counts, counts)
+    return np.arange(np.sum(counts), dtype=np.int64) + offsets
+
+
+def _to_array(values):
+    """Converts a list of (edge-types) values to a numeric array if possible, otherwise to a 1D object array."""
+    if all(isinstance(v, numbers.Number) and not isinstance(v, bool) for v in values):
+        return np.array(values)
+
+    obj_array = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        obj_array[i] = v
+    return obj_array
+
+
+def _match_values(values, filter_val):
+    if isinstance(filter_val, (list, tuple, set, np.ndarray)):
+        return np.isin(values, list(filter_val))
+    return np.asarray(values == filter_val, dtype=bool)
@@ -1,7 +1,10 @@
 import pytest
 import numpy as np
+import pandas as pd
 
-from bmtk.builder.auxi.edge_connectors import distance_connector, connect_random
+from bmtk.builder import NetworkBuilder
+from bmtk.builder.auxi.edge_connectors import distance_connector, connect_random, distance_connector_kdtree, \
+    pairs_within_distance
 
 
 class MockNode(object):
@@ -43,6 +46,65 @@ def test_connect_random():
     assert (10 >= nsyns >= 5)
 
 
+def test_pairs_within_distance():
+    np.random.seed(1)
+    src_pos = np.random.uniform(0.0, 100.0, size=(100, 3))
+    trg_pos = np.random.uniform(0.0, 100.0, size=(150, 3))
+    src_idxs, trg_idxs, dists = pairs_within_distance(src_pos, trg_pos, d_max=20.0)
+
+    dist_mat = np.linalg.norm(src_pos[:, np.newaxis, :] - trg_pos[np.newaxis, :, :], axis=2)
+    expected_src, expected_trg = np.nonzero(dist_mat <= 20.0)
+    assert(np.all(src_idxs == expected_src))
+    assert(np.all(trg_idxs == expected_trg))
+    assert(np.allclose(dists, dist_mat[expected_src, expected_trg]))
+
+    src_idxs, trg_idxs, dists = pairs_within_distance(src_pos, np.zeros((0, 3)), d_max=20.0)
+    assert(len(src_idxs) == len(trg_idxs) == len(dists) == 0)
+
+
+def test_distance_connector_kdtree():
+    np.random.seed(1)
+    positions = np.random.uniform(0.0, 100.0, size=(100, 3))
+    nodes = pd.DataFrame({'node_id': np.arange(100), 'positions': list(positions)})
+
+    # weights of 1.0 means every pair within d_max (except self-connections) is connected
+    src_idxs, trg_idxs, nsyns = distance_connector_kdtree(nodes, nodes, d_weight_min=1.0, d_weight_max=1.0,
+                                                          d_max=25.0, nsyn_min=2, nsyn_max=4)
+    dist_mat = np.linalg.norm(positions[:, np.newaxis, :] - positions[np.newaxis, :, :], axis=2)
+    np.fill_diagonal(dist_mat, np.inf)
+    expected_src, expected_trg = np.nonzero(dist_mat <= 25.0)
+    assert(np.all(src_idxs == expected_src))
+    assert(np.all(trg_idxs == expected_trg))
+    assert(np.all((nsyns >= 2) & (nsyns <= 4)))
+
+    src_idxs, trg_idxs, nsyns = distance_connector_kdtree(nodes, nodes, d_weight_min=0.0, d_weight_max=0.0,
+                                                          d_max=25.0, nsyn_min=2, nsyn_max=4)
+    assert(len(src_idxs) == 0)
+
+
+def test_distance_connector_kdtree_network():
+    np.random.seed(1)
+    net = NetworkBuilder('NET1')
+    net.add_nodes(N=50, positions=np.random.uniform(0.0, 100.0, size=(50, 3)), ei='e')
+    net.add_edges(source={'ei': 'e'}, target={'ei': 'e'},
+                  connection_rule=distance_connector_kdtree,
+                  connection_params={'d_weight_min': 1.0, 'd_weight_max': 1.0, 'd_max': 30.0, 'nsyn_min': 1,
+                                     'nsyn_max': 1},
+                  iterator='all_to_all')
+    net.build()
+
+    positions = {n.node_id: np.array(n['positions']) for n in net.nodes()}
+    edges = list(net.edges())
+    assert(len(edges) > 0)
+    for e in edges:
+        assert(e.source_node_id != e.target_node_id)
+        assert(np.linalg.norm(positions[e.source_node_id] - positions[e.target_node_id]) <= 30.0)
+
+    n_expected = sum(1 for s in positions for t in positions
+                     if s != t and np.linalg.norm(positions[s] - positions[t]) <= 30.0)
+    assert(len(edges) == n_expected)
+
+
 if __name__ == '__main__':
     # test_distance_connector()
     test_connect_random()
\ No newline at end of file
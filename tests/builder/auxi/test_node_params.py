@@ -1,8 +1,10 @@
 import os
 import pytest
 import numpy as np
+from scipy.spatial import cKDTree
 
-from bmtk.builder.auxi.node_params import positions_columinar, positions_cuboid, positions_list, positions_rect_prism, positions_ellipsoid, positions_density_matrix, positions_nrrd
+from bmtk.builder.auxi.node_params import positions_columinar, positions_cuboid, positions_list, positions_rect_prism, \
+    positions_ellipsoid, positions_density_matrix, positions_nrrd, positions_dmin_grid
 
 
 def test_positions_columinar():
@@ -74,6 +76,55 @@ def test_positions_density_matrix():
     assert(np.max(abs(points[:,0]))<25*3)
     assert(np.max(abs(points[:,1]))<25*3)
     assert(np.max(abs(points[:,2]))<25*3)
+
+
+def test_positions_density_matrix_grid():
+    np.random.seed(1)
+    mat = 100000*np.array([[[0, 1, 1], [0, 1, 0], [0, 0, 0]],
+                           [[0, 1, 1], [0, 1, 0], [0, 0, 0]],
+                           [[0, 1, 1], [0, 1, 0], [0, 0, 1]]])
+    position_scale = np.array([[25.0, 0, 0], [0, 25.0, 0], [0, 0, 25.0]])
+
+    points = positions_density_matrix(mat, position_scale, dmin=5.0, method='grid')
+    assert(points.shape == (15, 3))
+    assert(np.min(points) >= 0.0)
+    assert(np.max(points) < 25*3)
+    dists, _ = cKDTree(points).query(points, k=2)
+    assert(np.min(dists[:, 1]) >= 5.0)
+
+
+@pytest.mark.parametrize('n_blocks,n_workers', [
+    (1, 1),
+    (4, 1),
+    (4, 2)
+])
+def test_positions_dmin_grid(n_blocks, n_workers):
+    def sampling_func(n):
+        return np.random.uniform(0.0, 100.0, size=(n, 3))
+
+    np.random.seed(1)
+    existing = np.random.uniform(0.0, 100.0, size=(50, 3))
+    points = positions_dmin_grid(N=2000, vol_tot=0.001, sampling_func=sampling_func, dmin=5.0,
+                                 existing_positions=existing, n_blocks=n_blocks, n_workers=n_workers)
+    assert(points.shape == (2000, 3))
+    assert(np.min(points) >= 0.0 and np.max(points) <= 100.0)
+    dists, _ = cKDTree(points).query(points, k=2)
+    assert(np.min(dists[:, 1]) >= 5.0)
+    dists, _ = cKDTree(existing).query(points, k=1)
+    assert(np.min(dists) >= 5.0)
+
+    # number of workers shouldn't change the results
+    np.random.seed(1)
+    existing = np.random.uniform(0.0, 100.0, size=(50, 3))
+    points_serial = positions_dmin_grid(N=2000, vol_tot=0.001, sampling_func=sampling_func, dmin=5.0,
+                                        existing_positions=existing, n_blocks=n_blocks, n_workers=1)
+    assert(np.allclose(points, points_serial))
+
+
+def test_positions_dmin_grid_density():
+    with pytest.raises(ValueError):
+        positions_dmin_grid(N=10000, vol_tot=0.001, sampling_func=lambda n: np.zeros((n, 3)), dmin=10.0)
+
     
 def test_positions_nrrd():
     np.random.seed(1)
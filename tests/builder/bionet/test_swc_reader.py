@@ -1,10 +1,16 @@
+import os
 import pytest
 import tempfile
 import numpy as np
 
-nrn = pytest.importorskip('neuron')  # skip tests if neuron isn't installed on env.
+try:
+    from bmtk.builder.bionet import swc_reader as swc_reader_mod
+    from bmtk.builder.bionet.swc_reader import SWCReader, SWCCache, get_swc
+    nrn_installed = True
+except ImportError:
+    nrn_installed = False  # skip tests if neuron isn't installed on env.
 
-from bmtk.builder.bionet.swc_reader import SWCReader
+pytestmark = pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
 
 
 nr5a1_morphology = """##n,type,x,y,z,radius,parent
@@ -49,5 +55,51 @@ def test_swc_reader():
     assert(swc_reader.get_type(sec_ids) == [3])
 
 
+@pytest.fixture
+def swc_file(tmp_path):
+    swc_path = str(tmp_path / 'nr5a1.swc')
+    with open(swc_path, 'w') as f:
+        f.write(nr5a1_morphology)
+    return swc_path
+
+
+def test_swc_cache(swc_file, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    swc_cache = SWCCache(cache_dir)
+    swc_parsed = SWCReader(swc_file)
+    swc_parsed.set_segment_dl(2.0)
+    swc_parsed.fix_axon()
+
+    for _ in range(2):
+        swc_cached = SWCCache(cache_dir).get(swc_file, dL=2.0, fix_axon=True)
+        assert(swc_cached._hobj is None)  # Shouldn't need to load the morphology into NEURON
+        assert(swc_cached.nseg == swc_parsed.nseg)
+        for parsed_vals, cached_vals in zip(swc_parsed.seg_props, swc_cached.seg_props):
+            assert(np.allclose(parsed_vals, cached_vals))
+        for parsed_vals, cached_vals in zip(swc_parsed.seg_coords, swc_cached.seg_coords):
+            assert(np.allclose(parsed_vals, cached_vals))
+        assert(swc_cached.get_swc_id(1, 0.5) == swc_parsed.get_swc_id(1, 0.5))
+    assert(len(os.listdir(cache_dir)) == 1)
+
+    # different segmentation should not use the same cached tables
+    assert(swc_cache.cache_key(swc_file, dL=2.0, fix_axon=True) != swc_cache.cache_key(swc_file, dL=5.0, fix_axon=True))
+    assert(swc_cache.cache_key(swc_file, dL=2.0, fix_axon=True) != swc_cache.cache_key(swc_file, dL=2.0))
+    swc_cache.get(swc_file, dL=5.0, fix_axon=True)
+    assert(len(os.listdir(cache_dir)) == 2)
+
+
+def test_get_swc_cache(swc_file, tmp_path):
+    swc_reader_mod.swc_cache.clear()
+    cell = {'node_id': 0, 'morphology': swc_file, 'x': 10.0, 'y': -5.0, 'z': 1.0, 'rotation_angle_yaxis': 0.3,
+            'rotation_angle_zaxis': -1.2, 'model_processing': 'aibs_perisomatic'}
+    swc_parsed = get_swc(cell, dL=2.0)
+    swc_cached = get_swc(cell, dL=2.0, use_cache=True, cache_dir=str(tmp_path))
+    assert(np.allclose(swc_cached.soma_position, [10.0, -5.0, 1.0]))
+    for parsed_vals, cached_vals in zip(swc_parsed.seg_coords, swc_cached.seg_coords):
+        assert(np.allclose(parsed_vals, cached_vals))
+    assert(get_swc(cell, dL=2.0, use_cache=True, cache_dir=str(tmp_path)) is swc_cached)
+    swc_reader_mod.swc_cache.clear()
+
+
 if __name__ == '__main__':
     test_swc_reader()
@@ -106,6 +106,36 @@ def test_add_edges_basic():
     assert(len(net.edges()) == 100)
 
 
+@pytest.mark.parametrize('rule_format', ['dense', 'sparse', 'coo'])
+def test_add_edges_all_to_all(rule_format):
+    from scipy.sparse import coo_matrix
+
+    def vectorized_rule(sources, targets):
+        nsyns = np.outer(sources['attr1'].values, np.ones(len(targets), dtype=np.uint32))
+        if rule_format == 'dense':
+            return nsyns
+        elif rule_format == 'sparse':
+            return coo_matrix(nsyns)
+        else:
+            src_idxs, trg_idxs = np.nonzero(nsyns)
+            return src_idxs, trg_idxs, nsyns[src_idxs, trg_idxs]
+
+    net = DenseNetwork(name='test')
+    net.add_nodes(N=10, attr1=np.arange(0, 10), prop1='A')
+    net.add_nodes(N=5, prop1='B')
+    net.add_edges(
+        source={'prop1': 'A'},
+        target={'prop1': 'B'},
+        connection_rule=vectorized_rule,
+        iterator='all_to_all'
+    )
+    net.build()
+    edges = net.edges()
+    assert(len(edges) == 9*5)
+    for e in edges:
+        assert(e['nsyns'] == e.source_node_id)
+        assert(e.target_node_id >= 10)
+
 def test_bad_add_nodes():
     # net = DenseNetwork(name='test')
     # net.add_nodes(N=100, prop1=np.arange(101))
@@ -454,6 +484,71 @@ def test_save_weights():
     assert(edges_h5['/edges/NET1_to_NET1/1/nsyns'][0] == 2)
 
 
+def test_save_weights_all_to_all():
+    def weights_rule(sources, targets):
+        assert(len(sources) == len(targets) == 20*10*3)
+        return sources['node_id'].values*1000.0 + targets['node_id'].values
+
+    def location_rule(sources, targets):
+        return np.full(len(sources), 7, dtype=np.int64), targets['tags'].values
+
+    net = DenseNetwork('NET1')
+    net.add_nodes(N=10, cell_type='Scnna1', ei='e')
+    net.add_nodes(N=10, tags=np.linspace(0, 100, 10), cell_type='PV1', ei='i')
+    net.add_nodes(N=10, tags=np.linspace(0, 100, 10), cell_type='PV2', ei='i')
+    cm = net.add_edges(source={'ei': 'e'}, target={'ei': 'i'}, connection_rule=lambda s, t: 3)
+    cm.add_properties('syn_weight', rule=weights_rule, dtypes=float, iterator='all_to_all')
+    cm.add_properties(['segment', 'tag'], rule=location_rule, dtypes=[int, float], iterator='all_to_all')
+    net.build()
+
+    edges = net.edges()
+    assert(len(edges) == 600)
+    for e in edges:
+        assert(e['syn_weight'] == e.source_node_id*1000.0 + e.target_node_id)
+        assert(e['segment'] == 7)
+        assert(e['tag'] == np.linspace(0, 100, 10)[(e.target_node_id - 10) % 10])
+
+    with pytest.raises(ValueError):
+        cm.add_properties('delay', rule=lambda s, t: 1.0, iterator='all_to_one')
+
+
+@pytest.mark.parametrize('n_workers', [2, 3])
+def test_build_n_workers(n_workers):
+    def build_net(n_workers):
+        net = DenseNetwork('NET1')
+        net.add_nodes(N=20, x=np.arange(20), ei='e')
+        net.add_nodes(N=10, x=np.arange(10), ei='i')
+        net.add_edges(source={'ei': 'e'}, target={'ei': 'i'}, connection_rule=lambda s, t: s['x'] % 3, p1='e2i')
+        cm = net.add_edges(source={'ei': 'i'}, target={'ei': 'e'}, connection_rule=2, p1='i2e')
+        cm.add_properties('syn_weight', rule=lambda s, t: s['x']*100.0 + t['x'], dtypes=float)
+        cm = net.add_edges(source={'ei': 'i'}, target={'ei': 'i'}, connection_rule=lambda s, t: 0, p1='i2i')
+        cm.add_properties('syn_weight', rule=lambda s, t: 1.0, dtypes=float)
+        net.add_edges(source={'ei': 'e'}, target={'ei': 'e'}, connection_rule=lambda s, t: s.node_id == t.node_id,
+                      p1='e2e')
+        net.build(n_workers=n_workers)
+        return net
+
+    net_serial = build_net(n_workers=1)
+    net_parallel = build_net(n_workers=n_workers)
+    assert(net_parallel.nedges == net_serial.nedges)
+
+    serial_edges = net_serial.edges()
+    parallel_edges = net_parallel.edges()
+    assert(len(parallel_edges) == len(serial_edges) == 13*10 + 10*20*2 + 20)
+    for e_serial, e_parallel in zip(serial_edges, parallel_edges):
+        assert(e_serial.source_node_id == e_parallel.source_node_id)
+        assert(e_serial.target_node_id == e_parallel.target_node_id)
+        assert(e_serial.edge_type_id == e_parallel.edge_type_id)
+        assert(e_serial['nsyns'] == e_parallel['nsyns'])
+        assert(e_serial['syn_weight'] == e_parallel['syn_weight'])
+
+    net_dir = tempfile.mkdtemp()
+    net_parallel.save(output_dir=net_dir)
+    with h5py.File(os.path.join(net_dir, 'NET1_NET1_edges.h5'), 'r') as edges_h5:
+        assert(len(edges_h5['/edges/NET1_to_NET1/source_node_id']) == 13*10 + 10*20*2 + 20)
+        assert(len(edges_h5['/edges/NET1_to_NET1/1/syn_weight']) == 10*20*2)
+    assert(not any(f.startswith('.edge_types_table.worker') for f in os.listdir('.')))
+
 def test_save_multinetwork():
     net1 = DenseNetwork('NET1')
     net1.add_nodes(N=100, position=[(0.0, 1.0, -1.0)] * 100, cell_type='Scnna1', ei='e')
@@ -0,0 +1,42 @@
+import numpy as np
+
+from bmtk.builder.network_adaptors import DenseNetwork
+from bmtk.builder.network_adaptors.edge_props_table import NSynsTableSparse, EdgeTypesTableMemory
+
+
+def test_nsyns_table_sparse():
+    table = NSynsTableSparse(n_sources=1000000, n_targets=1000000)
+    table.set(5, 2, 3)
+    table.set(0, 9, 1)
+    table.set_coo([999999, 5, 7], [999999, 1, 0], [2, 4, 0])
+    table.set(5, 2, 6)  # overwrite
+    table.set(0, 9, 0)  # remove
+
+    assert(table.nnz == 3)
+    assert(table.sum() == 12)
+    assert(np.all(table.src_idxs == [5, 5, 999999]))
+    assert(np.all(table.trg_idxs == [1, 2, 999999]))
+    assert(np.all(table.nsyns == [4, 6, 2]))
+
+
+def test_edge_type_node_ids():
+    net = DenseNetwork(name='test')
+    net.add_nodes(N=10)
+    cm = net.add_edges(source=net.nodes(), target=net.nodes(), connection_rule=lambda s, t: 2 if s.node_id == 3 else 0)
+    table = EdgeTypesTableMemory(cm, network_name='test')
+    for src_id in range(10):
+        for trg_id in range(10):
+            if src_id == 3:
+                table.set_nsyns(source_id=src_id, target_id=trg_id, nsyns=2)
+
+    assert(table.n_edges == 10)
+    assert(table.n_syns == 20)
+    assert(np.all(table.edge_type_node_ids == np.column_stack(([3]*10, range(10)))))
+
+    table.create_property('syn_weight', prop_type=float)
+    assert(table.n_edges == 20)
+    chunks = list(table.itr_edge_type_node_ids(chunk_size=4))
+    assert(len(chunks) == 5)
+    node_ids = np.concatenate(chunks)
+    assert(np.all(node_ids == np.column_stack(([3]*20, np.repeat(range(10), 2)))))
+    assert(np.all(table.edge_type_node_ids == node_ids))
@@ -1,5 +1,6 @@
 import pytest
 import itertools
+import numpy as np
 
 from bmtk.builder import connector, iterator
 from bmtk.builder import NetworkBuilder
@@ -124,3 +125,35 @@ def test_all2one_list(net):
     for v in itr(net.nodes(ei='i'), net.nodes(ei='e'), conr):
         src_id, trg_id, val = v
         assert(src_id == val)
+
+
+def test_all2all_fnc(net):
+    def connector_fnc(sources, targets):
+        assert(len(sources) == 100)
+        assert(len(targets) == 50)
+        assert(all(sources['ei'] == 'i'))
+        assert(all(targets['y'] == 'y'))
+        return np.outer(sources['x'].values % 2, np.ones(len(targets), dtype=np.uint32))
+
+    conr = connector.create(connector_fnc)
+    itr = iterator.create('all_to_all', conr)
+    count = 0
+    for v in itr(net.nodes(ei='i'), net.nodes(ei='e'), conr):
+        src_id, trg_id, val = v
+        assert(src_id % 2 == 1)
+        assert(trg_id >= 100)
+        assert(val == 1)
+        count += 1
+    assert(count == 50*50)
+
+
+def test_all2all_coo(net):
+    conr = connector.create(lambda sources, targets: ([0, 1, 2], [4, 5, 6], [1, 0, 3]))
+    src_idxs, trg_idxs, nsyns = iterator.all_to_all_coo(net.nodes(ei='i'), net.nodes(ei='e'), conr)
+    assert(np.all(src_idxs == [0, 2]))
+    assert(np.all(trg_idxs == [4, 6]))
+    assert(np.all(nsyns == [1, 3]))
+
+    conr = connector.create(lambda sources, targets: np.ones((10, 10)))
+    with pytest.raises(ValueError):
+        iterator.all_to_all_coo(net.nodes(ei='i'), net.nodes(ei='e'), conr)
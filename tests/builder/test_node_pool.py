@@ -78,5 +78,75 @@ def test_failed_search():
     assert(len(node_pool) == 0)
 
 
+def test_set_operators():
+    net = NetworkBuilder('NET1')
+    net.add_nodes(N=10, ei='e', loc='L4', val=range(10))
+    net.add_nodes(N=10, ei='i', loc='L4', val=range(10, 20))
+    net.add_nodes(N=10, ei='e', loc='L2/3')
+
+    node_pool = net.nodes(ei='e', loc='L4') | net.nodes(ei='i')
+    assert([n.node_id for n in node_pool] == list(range(20)))
+    assert(node_pool.filter_str == "(ei=='e'&loc=='L4')|(ei=='i')")
+
+    node_pool = net.nodes(ei='e') & net.nodes(loc='L4')
+    assert(list(node_pool.node_ids) == list(range(10)))
+
+    node_pool = net.nodes(ei='e') - net.nodes(loc='L4')
+    assert(list(node_pool.node_ids) == list(range(20, 30)))
+
+    node_pool = ~net.nodes(ei='e')
+    assert(list(node_pool.node_ids) == list(range(10, 20)))
+    assert(node_pool.filter_str == "~(ei=='e')")
+
+    node_pool = ~(net.nodes(ei='i') | net.nodes(loc='L2/3'))
+    assert(len(node_pool) == 10)
+    assert(all(n['ei'] == 'e' and n['loc'] == 'L4' for n in node_pool))
+
+    net2 = NetworkBuilder('NET2')
+    net2.add_nodes(N=10, ei='e')
+    with pytest.raises(ValueError):
+        net.nodes() | net2.nodes()
+
+
+def test_property_operators():
+    net = NetworkBuilder('NET1')
+    net.add_nodes(N=10, ei='e', val=range(10))
+    net.add_nodes(N=10, ei='i', val=range(10, 20))
+    net.add_nodes(N=10, ei='e', tag=['a', 'b']*5)
+
+    node_pool = net.nodes('val') > 15
+    assert(list(node_pool.node_ids) == [16, 17, 18, 19])
+    assert(node_pool.filter_str == 'val>15')
+
+    node_pool = net.nodes('val', ei='e') >= 8
+    assert(list(node_pool.node_ids) == [8, 9])
+    assert(node_pool.filter_str == "ei=='e'&val>=8")
+
+    node_pool = (net.nodes('val') >= 5) & (net.nodes('val') < 12)
+    assert(list(node_pool.node_ids) == list(range(5, 12)))
+
+    assert(list((net.nodes('val') != 0).node_ids) == list(range(1, 20)))
+    assert(list((net.nodes('tag') == 'a').node_ids) == list(range(20, 30, 2)))
+    assert(list(net.nodes(ei='i').prop('val') <= 10) == list(net.nodes(val=10)))
+    assert(len(net.nodes('tag') > 5) == 0)
+
+    assert(5 in net.nodes('val'))
+    assert(100 not in net.nodes('val'))
+    assert(next(iter(net.nodes(val=5))) in net.nodes(ei='e'))
+    assert(25 not in net.nodes(ei='i'))
+
+    with pytest.raises(ValueError):
+        net.nodes(ei='e') > 10
+
+
+def test_cached_operations():
+    net = NetworkBuilder('NET1')
+    net.add_nodes(N=10, ei='e', val=range(10))
+    node_pool = (net.nodes('val') > 4) | net.nodes(ei='i')
+    assert(len(node_pool) == 5)
+    assert(node_pool._get_selection() is node_pool._get_selection())
+    assert(list(node_pool.node_ids) == [5, 6, 7, 8, 9])
+
+
 if __name__ == '__main__':
-    test_multi_search()
\ No newline at end of file
+    test_multi_search()
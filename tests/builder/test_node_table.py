@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+
+from bmtk.builder import NetworkBuilder
+from bmtk.builder.node_table import NodeTable
+
+
+@pytest.fixture
+def net():
+    net = NetworkBuilder('NET1')
+    net.add_nodes(N=10, ei='e', model='biophys', x=np.arange(10), positions=[(i, 0.0, 1.0) for i in range(10)])
+    net.add_nodes(N=10, ei='i', model='biophys', x=np.arange(10, 20), tag=['a', None]*5)
+    net.add_nodes(N=5, ei='i', model='point', mixed=[1, 'b', 2.0, 'c', 5])
+    net.build()
+    return net
+
+
+def test_columns(net):
+    table = net.adaptor.nodes_table()
+    assert(isinstance(table, NodeTable))
+    assert(len(table) == 25)
+    assert(set(table.columns) >= {'node_id', 'node_type_id', 'ei', 'model', 'x', 'positions', 'tag', 'mixed'})
+    assert(table.get_column('node_id').dtype.kind in 'iu')
+    assert(table.get_column('ei').dtype.kind == 'U')
+    assert(np.all(table.has_column('x') == [True]*20 + [False]*5))
+    assert(table.get_column('positions')[3] == (3, 0.0, 1.0))
+
+    df = table.to_dataframe(np.arange(10))
+    assert(len(df) == 10)
+    assert('tag' not in df.columns)
+    assert(df['x'].dtype.kind in 'iu')
+
+
+@pytest.mark.parametrize('filters,expected_ids', [
+    ({}, list(range(25))),
+    ({'ei': 'i'}, list(range(10, 25))),
+    ({'ei': 'i', 'model': 'biophys'}, list(range(10, 20))),
+    ({'x': 5}, [5]),
+    ({'x': [1, 12, 100]}, [1, 12]),
+    ({'x': lambda x: x >= 18}, [18, 19]),
+    ({'tag': 'a'}, [10, 12, 14, 16, 18]),
+    ({'mixed': [1, 'c']}, [20, 23]),
+    ({'mixed': 'b'}, [21]),
+    ({'positions': (2, 0.0, 1.0)}, [2]),
+    ({'not_a_property': 1}, []),
+    ({'x': 'a'}, []),
+])
+def test_select(net, filters, expected_ids):
+    table = net.adaptor.nodes_table()
+    rows = table.select(filters)
+    assert(list(table.get_column('node_id', rows)) == expected_ids)
+
+    # Should be the same as the node-by-node search
+    assert([n.node_id for n in net.nodes(**filters)] == expected_ids)
+    assert(len(net.nodes(**filters)) == len(expected_ids))
+
+
+def test_cached_selection(net):
+    table = net.adaptor.nodes_table()
+    rows1 = table.select({'ei': 'i', 'x': [10, 11]})
+    rows2 = table.select({'x': [10, 11], 'ei': 'i'})
+    assert(rows1 is rows2)
+
+    node_pool = net.nodes(ei='e')
+    assert(len(node_pool) == 10)
+    net.add_nodes(N=5, ei='e')
+    net.build(force=True)
+    assert(net.adaptor.nodes_table() is not table)
+    assert(len(node_pool) == len(list(node_pool)))
@@ -1,4 +1,6 @@
 import os
+import numpy as np
+from collections import namedtuple
 
 try:
     import bmtk.simulator.bionet as bionet
@@ -29,3 +31,132 @@ if nrn_installed:
 
     except AttributeError:
         has_mechanism = False
+
+
+# Light-weight stand-ins for the BioNet network, cells and simulation. Cells have a soma and a single dendrite (with a
+# different number of segments for each gid) laid out along the y-axis, offset by gid*50 um along the x-axis.
+SegProps = namedtuple('SegProps', ['sec_id', 'x0', 'x', 'x1', 'type'])
+SegCoords = namedtuple('SegCoords', ['p0', 'p05', 'p1', 'd'])
+
+
+class MockHObj(object):
+    def __init__(self, sections):
+        self.all = sections
+
+
+class MockMorphology(object):
+    def __init__(self, sections, sec_types):
+        self.segments = [seg for sec in sections for seg in sec]
+        sec_ids = [i for i, sec in enumerate(sections) for _ in sec]
+        xs = np.array([seg.x for seg in self.segments])
+        self.seg_props = SegProps(sec_id=np.array(sec_ids), x0=xs, x=xs, x1=xs,
+                                  type=np.array([sec_types[i] for i in sec_ids]))
+
+    def get_swc_id(self, sec_id, x):
+        return sec_id, x
+
+
+class MockCell(object):
+    def __init__(self, gid):
+        self.gid = gid
+        self.soma = [h.Section(name='soma_{}'.format(gid))]
+        self.soma[0].L = self.soma[0].diam = 20.0
+        self.soma[0].insert('hh')
+        dend = h.Section(name='dend_{}'.format(gid))
+        dend.L = 200.0
+        dend.diam = 1.0
+        dend.nseg = 3 + gid
+        dend.insert('pas')
+        dend.connect(self.soma[0])
+        self.sections = self.soma + [dend]
+        self.hobj = MockHObj(self.sections)
+        self.morphology = MockMorphology(self.sections, sec_types=[1, 3])
+        self.iclamp = h.IClamp(self.soma[0](0.5))
+        self.iclamp.delay = 1.0
+        self.iclamp.dur = 5.0
+        self.iclamp.amp = 0.1*(gid + 1)
+
+        p0, p1 = [], []
+        for sec, y0 in zip(self.sections, [-10.0, 10.0]):
+            seg_len = sec.L/sec.nseg
+            for i in range(sec.nseg):
+                p0.append([gid*50.0, y0 + i*seg_len, 0.0])
+                p1.append([gid*50.0, y0 + (i + 1)*seg_len, 0.0])
+        p0, p1 = np.array(p0).T, np.array(p1).T
+        self.seg_coords = SegCoords(p0=p0, p05=(p0 + p1)/2.0, p1=p1, d=np.ones(p0.shape[1]))
+        self.nseg = p0.shape[1]
+
+    def setup_ecp(self):
+        self.im_ptr = h.PtrVector(self.nseg)
+        if hasattr(self.im_ptr, 'ptr_update_callback'):
+            self.im_ptr.ptr_update_callback(self.set_im_ptr)
+        self.imVec = h.Vector(self.nseg)
+
+    def set_im_ptr(self):
+        jseg = 0
+        for sec in self.sections:
+            for seg in sec:
+                self.im_ptr.pset(jseg, seg._ref_i_membrane_)
+                jseg += 1
+
+    def get_im(self):
+        self.im_ptr.gather(self.imVec)
+        return self.imVec.as_numpy()
+
+    def setup_xstim(self, set_nrn_mechanism=True):
+        for sec in self.sections:
+            sec.insert('extracellular')
+
+    def get_e_extracellular(self):
+        return np.array([seg.e_extracellular for sec in self.sections for seg in sec])
+
+
+class MockNodeSet(object):
+    def __init__(self, gids):
+        self._gids = gids
+
+    def gids(self):
+        return self._gids
+
+
+class MockNetwork(object):
+    def __init__(self, n_cells):
+        self.gid_pool = GidPool()
+        self.gid_pool.add_pool('cells', n_cells)
+        self.cells = {gid: MockCell(gid) for gid in range(n_cells)}
+
+    def get_cell_gid(self, gid):
+        return self.cells[gid]
+
+    def get_local_cells(self):
+        return self.cells
+
+    def get_node_set(self, node_set):
+        return MockNodeSet(list(self.cells.keys()))
+
+
+class MockSim(object):
+    def __init__(self, net, tstop=10.0):
+        self.net = net
+        self.h = h
+        self.dt = h.dt = 0.025
+        self.tstart = 0.0
+        self.tstop = tstop
+        self.n_steps = int(round(self.tstop/self.dt))
+        self.nsteps_block = 70
+        self.biophysical_gids = list(net.cells.keys())
+
+
+def run_extracellular_mod(mod, sim):
+    """Runs an extracellular stimulation module (xstim, comsol) and returns the e_extracellular of every segment at
+    each time step.
+    """
+    mod.initialize(sim)
+    h.finitialize(-65.0)
+    vext = []
+    for tstep in range(sim.n_steps):
+        mod.step(sim, tstep)
+        vext.append({gid: cell.get_e_extracellular() for gid, cell in sim.net.cells.items()})
+        h.fadvance()
+    mod._fih = None
+    return vext
@@ -0,0 +1,110 @@
+import pytest
+import os
+import numpy as np
+
+from .conftest import *
+
+try:
+    from bmtk.simulator.bionet.biocell import BioCell
+    from bmtk.simulator.bionet.morphology import Morphology
+except ImportError:
+    nrn_installed = False
+
+
+RORB_SWC_PATH = os.path.join(MORPH_DIR, 'rorb_480169178_morphology.swc')
+
+
+class MockEdge(object):
+    def __init__(self, edge_type_id, nsyns, target_sections=None, target_distance=None, afferent_section_id=None):
+        self.edge_type_id = edge_type_id
+        self.nsyns = nsyns
+        self.target_sections = target_sections
+        self.target_distance = target_distance
+        self.is_gap_junction = False
+        self.preselected_targets = afferent_section_id is not None
+        self.afferent_section_id = afferent_section_id
+        self.afferent_section_pos = 0.5
+        self._props = {'delay': 2.0, 'model_template': 'exp2syn',
+                       'dynamics_params': {'erev': 0.0, 'tau1': 1.0, 'tau2': 3.0}}
+
+    def __getitem__(self, item):
+        return self._props[item]
+
+    def syn_weight(self, src_node, trg_node):
+        return 0.001*self.edge_type_id
+
+    def load_synapses(self, section_x, section_id):
+        return h.Exp2Syn(section_x, sec=section_id)
+
+
+class MockSrcNode(object):
+    def __init__(self, node_id):
+        self.node_id = node_id
+
+
+class MockStim(object):
+    def __init__(self):
+        self.hobj = h.NetStim()
+
+
+def _create_cell(hobj, morph):
+    # Only set up what is needed for adding synapses
+    cell = BioCell.__new__(BioCell)
+    cell._node = None
+    cell._morphology = morph
+    cell._secs_by_id = list(hobj.all)
+    cell._secs = np.array([sec for sec in hobj.all for _ in sec])
+    cell._save_conn = False
+    cell._edge_props = []
+    cell._src_gids = []
+    cell._synapses = []
+    cell._netcons = []
+    cell._edge_type_ids = []
+    cell._connections = []
+    cell.prng = np.random.RandomState(100)
+    return cell
+
+
+def _syn_locations(cell):
+    locs = []
+    for syn in cell._synapses:
+        seg = syn.get_segment()
+        locs.append((seg.sec.name(), seg.x))
+    return locs
+
+
+@pytest.mark.skipif(not has_mechanism, reason='Mechanisms has not been compiled, run nrnivmodl mechanisms.')
+@pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
+def test_set_syn_connections():
+    hobj = h.Biophys1(RORB_SWC_PATH)
+    morph = Morphology(hobj)
+    morph.set_segment_dl(20.0)
+    stim = MockStim()
+
+    edges = []
+    for i in range(60):
+        if i % 10 == 3:
+            edge = MockEdge(edge_type_id=4, nsyns=1, afferent_section_id=i % 5)
+        elif i % 10 == 7:
+            # no segments in the distance range, no synapses are created
+            edge = MockEdge(edge_type_id=5, nsyns=3, target_sections=['soma'], target_distance=[300.0, 500.0])
+        elif i % 2 == 0:
+            edge = MockEdge(edge_type_id=1, nsyns=i % 4 + 1, target_sections=['dend', 'apic'],
+                            target_distance=[0.0, 150.0])
+        else:
+            edge = MockEdge(edge_type_id=2, nsyns=2, target_sections=['soma', 'dend'], target_distance=[0.0, 1.0e20])
+        edges.append((edge, MockSrcNode(i), stim))
+
+    expected_cell = _create_cell(hobj, morph)
+    expected_counts = [expected_cell.set_syn_connection(edge, src_node, stim) for edge, src_node, stim in edges]
+
+    cell = _create_cell(hobj, morph)
+    counts = cell.set_syn_connections(edges)
+
+    assert(counts == expected_counts)
+    assert(len(cell._synapses) == len(expected_cell._synapses) == sum(expected_counts))
+    assert(_syn_locations(cell) == _syn_locations(expected_cell))
+    assert(cell._edge_type_ids == expected_cell._edge_type_ids)
+    assert(cell._src_gids == expected_cell._src_gids)
+    assert([nc.weight[0] for nc in cell.netcons] == [nc.weight[0] for nc in expected_cell.netcons])
+    assert([c.edge_prop for c in cell.connections()] == [c.edge_prop for c in expected_cell.connections()])
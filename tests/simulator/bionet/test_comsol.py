@@ -0,0 +1,195 @@
+import pytest
+import os
+import tempfile
+import numpy as np
+
+from .conftest import *
+
+try:
+    from scipy.interpolate import NearestNDInterpolator, LinearNDInterpolator
+    from bmtk.simulator.bionet.modules.comsol import ComsolMod, ComsolData, interp_rows
+    has_comsol = nrn_installed
+except ImportError:
+    has_comsol = False
+
+
+def _comsol_grid():
+    xs, ys, zs = np.meshgrid(np.linspace(-60, 160, 12), np.linspace(-20, 260, 15), np.linspace(-10, 10, 3))
+    return np.stack([xs.ravel(), ys.ravel(), zs.ravel()], axis=1)
+
+
+def _write_comsol(file_path, coords, potentials, times=None):
+    """Writes a COMSOL text export, potentials (in V) is n_nodes x n_times."""
+    with open(file_path, 'w') as f:
+        for i in range(8):
+            f.write('% Header line {}\n'.format(i))
+        cols = ['% x', 'y', 'z']
+        cols += ['V (V)'] if times is None else ['V (V) @ t={}'.format(t) for t in times]
+        f.write('      '.join(cols) + '\n')
+        for xyz, vals in zip(coords, potentials):
+            f.write(' '.join('{:.8g}'.format(v) for v in list(xyz) + list(vals)) + '\n')
+
+
+@pytest.mark.skipif(not has_comsol, reason='NEURON or scipy is not installed')
+def test_interp_rows():
+    xp = np.array([0.0, 0.5, 1.5, 2.0])
+    fp = np.random.RandomState(1).rand(5, 4)
+    x = np.linspace(-0.5, 2.5, 31)
+    expected = np.array([np.interp(x, xp, row) for row in fp])
+    assert(np.allclose(interp_rows(x, xp, fp), expected))
+
+
+def _cache_opt(cache, tmp_dir):
+    if cache == 'dir':
+        # directory doesn't exist yet, created by the module
+        return os.path.join(tmp_dir, 'cache')
+    return cache
+
+
+@pytest.mark.skipif(not has_comsol, reason='NEURON or scipy is not installed')
+@pytest.mark.parametrize('cache', [False, True, 'dir'])
+def test_comsol_time_dependent(cache):
+    tmp_dir = tempfile.mkdtemp()
+    coords = _comsol_grid()
+    times = np.array([0.0, 0.0002, 0.0005])  # seconds
+    potentials = np.sin(coords[:, [0]]/50.0)*np.array([[0.0, 0.002, -0.001]])
+    comsol_file = os.path.join(tmp_dir, 'comsol.txt')
+    _write_comsol(comsol_file, coords, potentials, times)
+
+    sim = MockSim(MockNetwork(3), tstop=1.0)
+    mod = ComsolMod(comsol_files=comsol_file, amplitudes=2.0, cache=_cache_opt(cache, tmp_dir))
+    vext = run_extracellular_mod(mod, sim)
+
+    nn = NearestNDInterpolator(coords, np.arange(len(coords)))
+    times_bmtk = np.arange(0.0, 0.5 + sim.dt, sim.dt)
+    period = int((times_bmtk[-1] - times_bmtk[0])/sim.dt)
+    n_active = 0
+    for gid, cell in sim.net.cells.items():
+        nodes = nn(cell.seg_coords.p05.T).astype(int)
+        for tstep in range(sim.n_steps):
+            expected = np.array([np.interp(times_bmtk[tstep % period], times*1000.0, potentials[n]*1000.0)*2.0
+                                 for n in nodes])
+            assert(np.allclose(vext[tstep][gid], expected, atol=1.0e-6))
+            n_active += np.any(expected != 0.0)
+    assert(n_active > 0)
+
+
+@pytest.mark.skipif(not has_comsol, reason='NEURON or scipy is not installed')
+@pytest.mark.parametrize('cache,same_mesh', [(False, True), (True, True), ('dir', True), (False, False),
+                                             (True, False)])
+def test_comsol_stationary(cache, same_mesh):
+    tmp_dir = tempfile.mkdtemp()
+    grid = _comsol_grid()
+    comsol_files, waveform_files, meshes, potentials = [], [], [], []
+    for i in range(2):
+        # the second mesh doesn't include the cell at x=100
+        coords = grid if same_mesh or i == 0 else grid[grid[:, 0] <= 60.0]
+        meshes.append(coords)
+        potentials.append(((coords[:, 0] + 100.0*i)/1.0e4 + coords[:, 1]/2.0e4)[:, np.newaxis])
+        comsol_files.append(os.path.join(tmp_dir, 'comsol_{}.txt'.format(i)))
+        _write_comsol(comsol_files[-1], coords, potentials[-1])
+
+        waveform_files.append(os.path.join(tmp_dir, 'waveform_{}.csv'.format(i)))
+        with open(waveform_files[-1], 'w') as f:
+            f.write('time amplitude\n')
+            for t, amp in [(0.0, 0.0), (0.1 + 0.1*i, 1.0), (0.3 + 0.2*i, -0.5)]:
+                f.write('{} {}\n'.format(t, amp))
+
+    sim = MockSim(MockNetwork(3), tstop=1.0)
+    mod = ComsolMod(comsol_files=comsol_files, waveforms=list(waveform_files), amplitudes=[1.0, 3.0],
+                    cache=_cache_opt(cache, tmp_dir))
+    vext = run_extracellular_mod(mod, sim)
+
+    n_active = 0
+    for gid, cell in sim.net.cells.items():
+        seg_pots = [LinearNDInterpolator(m, p[:, 0]*1000.0)(cell.seg_coords.p05.T) for m, p in zip(meshes, potentials)]
+        for tstep in range(sim.n_steps):
+            expected = np.zeros(cell.seg_coords.p05.shape[1])
+            for i, waveform in enumerate(mod._waveforms):
+                wf_times = waveform.definition['time']
+                period = (wf_times.iloc[-1] - wf_times.iloc[0])/sim.dt + 1
+                expected += seg_pots[i]*waveform.calculate((tstep % period)*sim.dt)*[1.0, 3.0][i]
+            # segments outside of any of the meshes are set to 0
+            expected[np.isnan(expected)] = 0.0
+            assert(np.allclose(vext[tstep][gid], expected, atol=1.0e-6))
+            n_active += np.any(expected != 0.0)
+    assert(n_active > 0)
+    if not same_mesh:
+        assert(all(np.all(v[2] == 0.0) for v in vext))
+
+
+@pytest.mark.skipif(not has_comsol, reason='NEURON or scipy is not installed')
+@pytest.mark.parametrize('times', [None, np.array([0.0, 0.0002, 0.0005])])
+def test_comsol_data_cache(times):
+    tmp_dir = tempfile.mkdtemp()
+    coords = _comsol_grid()
+    potentials = np.random.RandomState(0).rand(len(coords), 1 if times is None else len(times))
+    comsol_file = os.path.join(tmp_dir, 'comsol.txt')
+    _write_comsol(comsol_file, coords, potentials, times)
+    cache_path = comsol_file + '.h5'
+
+    mod = ComsolMod(comsol_files=comsol_file, cache=True)
+    assert(not ComsolData.is_valid_cache(cache_path, comsol_file))
+    expected = ComsolData.from_dataframe(mod.load_comsol(comsol_file))
+    comsol_data = mod.get_comsol_data(comsol_file)
+    assert(ComsolData.is_valid_cache(cache_path, comsol_file))
+    assert(comsol_data.is_stationary == (times is None))
+    assert(np.allclose(comsol_data.coords, expected.coords))
+    assert(np.allclose(comsol_data.timestamps, expected.timestamps))
+    assert(np.allclose(comsol_data.get_potentials(), expected.get_potentials()))
+    for nodes in [np.array([], dtype=int), np.array([3, 4, 9]), np.array([0, 250, len(coords) - 1])]:
+        assert(np.allclose(comsol_data.get_potentials(nodes), expected.get_potentials()[nodes]))
+
+    # points spread over the whole mesh, some outside of it, and points clustered in a small part of the mesh
+    rng = np.random.RandomState(1)
+    for points in [rng.rand(200, 3)*[260.0, 320.0, 30.0] + [-80.0, -40.0, -15.0],
+                   rng.rand(30, 3)*[15.0, 10.0, 4.0] + [20.0, 100.0, -2.0]]:
+        if times is None:
+            assert(comsol_data._simplices is not None)  # triangulation was loaded from the cache
+            assert(np.allclose(comsol_data.interpolate_linear(points),
+                               LinearNDInterpolator(coords, expected.get_potentials()[:, 0])(points), equal_nan=True))
+            assert(comsol_data._delaunay is None)
+        assert(np.all(comsol_data.nearest_nodes(points) ==
+                      NearestNDInterpolator(coords, np.arange(len(coords)))(points).astype(int)))
+    comsol_data.close()
+
+    # cache is out of date once the export changes
+    with open(comsol_file, 'a') as f:
+        f.write('\n')
+    assert(not ComsolData.is_valid_cache(cache_path, comsol_file))
+
+
+@pytest.mark.skipif(not has_comsol, reason='NEURON or scipy is not installed')
+def test_comsol_cache_unwritable():
+    tmp_dir = tempfile.mkdtemp()
+    coords = _comsol_grid()
+    potentials = np.random.RandomState(0).rand(len(coords), 1)
+    comsol_file = os.path.join(tmp_dir, 'comsol.txt')
+    _write_comsol(comsol_file, coords, potentials)
+
+    # cache directory can't be created since its parent is a file
+    cache_dir = os.path.join(comsol_file, 'cache')
+    mod = ComsolMod(comsol_files=comsol_file, cache=cache_dir)
+    comsol_data = mod.get_comsol_data(comsol_file)
+    assert(comsol_data._h5_handle is None)
+    assert(np.allclose(comsol_data.get_potentials(), potentials*1000.0))
+    assert(os.listdir(tmp_dir) == ['comsol.txt'])
+
+
+@pytest.mark.skipif(not has_comsol, reason='NEURON or scipy is not installed')
+def test_find_simplices():
+    from scipy.spatial import Delaunay
+
+    rng = np.random.RandomState(2)
+    coords = rng.rand(3000, 3)*[100.0, 200.0, 50.0]
+    potentials = rng.rand(len(coords), 1)
+    tri = Delaunay(coords)
+    comsol_data = ComsolData(coords, np.array([0.0]), potentials, simplices=tri.simplices, neighbors=tri.neighbors)
+
+    points = np.concatenate([rng.rand(500, 3)*[100.0, 200.0, 50.0], rng.rand(100, 3)*[140.0, 240.0, 90.0] - 20.0])
+    inside, vertices, bary = comsol_data.find_simplices(points)
+    assert(np.all(inside == (tri.find_simplex(points) >= 0)))
+    assert(np.allclose(np.einsum('ijk,ij->ik', coords[vertices], bary), points[inside]))
+    assert(np.allclose(comsol_data.interpolate_linear(points), LinearNDInterpolator(tri, potentials[:, 0])(points),
+                       equal_nan=True))
+    assert(comsol_data._delaunay is None)  # triangulation wasn't recomputed
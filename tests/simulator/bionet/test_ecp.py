@@ -0,0 +1,64 @@
+import pytest
+import os
+import numpy as np
+import tempfile
+import h5py
+
+from .conftest import *
+
+try:
+    from bmtk.simulator.bionet.modules import ecp
+    from bmtk.simulator.bionet.modules.ecp import EcpMod
+except ImportError:
+    nrn_installed = False
+
+
+def _run_ecp(tmp_dir, **ecp_args):
+    sim = MockSim(MockNetwork(3))
+    for cell in sim.net.cells.values():
+        cell.setup_ecp()
+    electrodes_file = os.path.join(tmp_dir, 'electrodes.csv')
+    with open(electrodes_file, 'w') as f:
+        f.write('channel x_pos y_pos z_pos\n')
+        for ch in range(4):
+            f.write('{} {} {} {}\n'.format(ch, 25.0, ch*50.0, 10.0))
+
+    mod = EcpMod(tmp_dir=tmp_dir, file_name='ecp.h5', electrode_positions=electrodes_file, cells='all',
+                 contributions_dir='contributions', minimum_distance='auto', **ecp_args)
+    mod.initialize(sim)
+    h.finitialize(-65.0)
+    block_beg = 0
+    for tstep in range(sim.n_steps):
+        h.fadvance()
+        mod.step(sim, tstep)
+        if (tstep + 1) % sim.nsteps_block == 0:
+            mod.block(sim, (block_beg, tstep + 1))
+            block_beg = tstep + 1
+    mod.finalize(sim)
+    mod._fih1 = None  # so the handler doesn't get called by other tests
+    h.cvode.use_fast_imem(0)
+    assert(not any(fname.startswith('tmp_') for fname in os.listdir(tmp_dir)))
+
+    with h5py.File(os.path.join(tmp_dir, 'ecp.h5'), 'r') as h5:
+        ecp_data = np.array(h5['/ecp/data'])
+    with h5py.File(os.path.join(tmp_dir, 'contributions', '1.h5'), 'r') as h5:
+        cell_data = np.array(h5['/ecp/data'])
+    return ecp_data, cell_data
+
+
+@pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
+@pytest.mark.parametrize('ecp_args,buffer_bytes,rtol', [
+    ({'batched': True}, 2**28, 1.0e-7),
+    ({'batched': True}, 2**10, 1.0e-7),  # buffer is flushed multiple times per block
+    ({'batched': True, 'dtype': 'float32'}, 2**28, 1.0e-3)
+])
+def test_batched_ecp(monkeypatch, ecp_args, buffer_bytes, rtol):
+    expected, expected_cell = _run_ecp(tempfile.mkdtemp(), batched=False)
+    assert(np.max(np.abs(expected)) > 0.0)
+
+    monkeypatch.setattr(ecp, 'IM_BUFFER_BYTES', buffer_bytes)
+    ecp_data, cell_data = _run_ecp(tempfile.mkdtemp(), **ecp_args)
+    assert(ecp_data.shape == expected.shape == (400, 4))
+    atol = rtol*np.max(np.abs(expected))
+    assert(np.allclose(ecp_data, expected, rtol=rtol, atol=atol))
+    assert(np.allclose(cell_data, expected_cell, rtol=rtol, atol=atol))
@@ -0,0 +1,56 @@
+import os
+import pytest
+import numpy as np
+
+from bmtk.simulator.bionet import load_balance
+
+
+MORPH_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'components/morphology')
+
+
+@pytest.mark.parametrize('method', ['round_robin', 'greedy', 'lpt'])
+def test_partition_methods(method):
+    costs = np.array([1.0, 10.0, 1.0, 1.0, 10.0, 1.0, 1.0, 1.0])
+    ranks = load_balance.partition_methods[method](costs, 3)
+    assert(len(ranks) == len(costs))
+    assert(set(ranks) == {0, 1, 2})
+    if method == 'round_robin':
+        assert(np.all(ranks == np.arange(8) % 3))
+    elif method == 'lpt':
+        # the two expensive cells go on different ranks, and the third rank gets all the cheap cells
+        assert(ranks[1] != ranks[4])
+        assert(load_balance.predicted_balance(costs, ranks, 3) == pytest.approx(26.0/3.0/10.0))
+
+
+def test_lpt_balance():
+    np.random.seed(1)
+    costs = np.concatenate([np.random.uniform(100, 1000, 200), np.random.uniform(1, 10, 2000)])
+    rr_balance = load_balance.predicted_balance(costs, load_balance.partition_round_robin(costs, 16), 16)
+    lpt_balance = load_balance.predicted_balance(costs, load_balance.partition_lpt(costs, 16), 16)
+    assert(lpt_balance > 0.99)
+    assert(lpt_balance > rr_balance)
+
+
+def test_add_partition_method():
+    load_balance.add_partition_method('all_on_zero', lambda costs, n_ranks: np.zeros(len(costs), dtype=int))
+    assert(np.all(load_balance.partition_methods['all_on_zero']([1.0, 2.0], 4) == 0))
+    del load_balance.partition_methods['all_on_zero']
+
+
+def test_swc_compartments(tmpdir):
+    # soma + two 50um dendrites branching off a 100um trunk
+    swc_path = str(tmpdir.join('test.swc'))
+    with open(swc_path, 'w') as f:
+        f.write('# test morphology\n')
+        f.write('1 1 0.0 0.0 0.0 5.0 -1\n')
+        f.write('2 3 0.0 50.0 0.0 1.0 1\n')
+        f.write('3 3 0.0 100.0 0.0 1.0 2\n')
+        f.write('4 3 50.0 100.0 0.0 1.0 3\n')
+        f.write('5 3 0.0 150.0 0.0 1.0 3\n')
+
+    # trunk (nseg=5), two branches (nseg=3) and soma
+    assert(load_balance.swc_compartments(swc_path, dL=20.0) == 12)
+    assert(load_balance.swc_compartments(swc_path, dL=1000.0) == 4)
+
+    # matches the number of segments NEURON creates for the test morphology using dL=20
+    assert(load_balance.swc_compartments(os.path.join(MORPH_DIR, 'rorb_480169178_morphology.swc'), dL=20.0) == 205)
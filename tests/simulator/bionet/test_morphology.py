@@ -227,6 +227,30 @@ def test_find_sections():
     assert(len(secs) == 1 and sec_probs[0] == 1.0)
 
 
+@pytest.mark.skipif(not has_mechanism, reason='Mechanisms has not been compiled, run nrnivmodl mechanisms.')
+@pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
+def test_find_sections_cdf():
+    hobj = load_hobj()
+    fix_axon_peri(hobj)
+    morph = Morphology(hobj)
+    morph.set_segment_dl(20.0)
+
+    for section_names, distance_range in [(['dend', 'apic'], [150.0, 200.0]), (['soma'], [0.0, 100.0]),
+                                          (['dend', 'apic', 'soma', 'axon'], [0.0, 1.0e20])]:
+        secs, sec_probs = morph.find_sections(section_names, distance_range)
+        cdf_secs, cdf = morph.find_sections_cdf(section_names, distance_range)
+        assert(np.all(cdf_secs == secs))
+        assert(np.isclose(cdf[-1], 1.0))
+
+        # sampling from the cdf should give the exact same segments as choice() for the same random stream
+        expected = np.random.RandomState(10).choice(secs, 500, p=sec_probs)
+        sampled = cdf_secs[cdf.searchsorted(np.random.RandomState(10).random_sample(500), side='right')]
+        assert(np.all(sampled == expected))
+
+    secs, cdf = morph.find_sections_cdf(['soma'], [300.0, 500.0])
+    assert(len(secs) == 0 and len(cdf) == 0)
+
+
 @pytest.mark.skipif(not has_mechanism, reason='Mechanisms has not been compiled, run nrnivmodl mechanisms.')
 @pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
 @pytest.mark.skip(reason='no longer using get_target_segments() method in new Morphology')
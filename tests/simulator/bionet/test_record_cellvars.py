@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+import tempfile
+import h5py
+
+from .conftest import *
+
+try:
+    from bmtk.simulator.bionet.modules.record_cellvars import MembraneReport, SomaReport
+except ImportError:
+    nrn_installed = False
+
+
+def _run_report(report_cls, use_ptr_vectors, **report_args):
+    net = MockNetwork(3)
+    sim = MockSim(net)
+    tmp_file = tempfile.NamedTemporaryFile(suffix='.h5').name
+    report = report_cls(tmp_dir='.', file_name=tmp_file, variable_name=['v'], cells='all', gids=[0, 1, 2],
+                        **report_args)
+    if not use_ptr_vectors:
+        report._setup_ptr_recorders = lambda sim: None
+
+    h.finitialize(-65.0)
+    report.initialize(sim)
+    assert((report._ptr_recorders is not None) == use_ptr_vectors)
+    n_steps = sim.n_steps
+    for tstep in range(n_steps):
+        h.fadvance()
+        report.step(sim, tstep)
+        if (tstep + 1) % sim.nsteps_block == 0 or tstep + 1 == n_steps:
+            report.block(sim, (0, tstep + 1))
+    report.finalize(sim)
+
+    with h5py.File(tmp_file, 'r') as h5:
+        return np.array(h5['/report/cells/data'])
+
+
+@pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
+@pytest.mark.parametrize('report_cls,report_args', [
+    (MembraneReport, {'sections': 'all'}),
+    (MembraneReport, {'sections': 'dend', 'dt': 0.1}),
+    (SomaReport, {}),
+    (SomaReport, {'start_time': 2.5, 'end_time': 7.5})
+])
+def test_ptr_vector_recording(report_cls, report_args):
+    expected = _run_report(report_cls, use_ptr_vectors=False, **report_args)
+    data = _run_report(report_cls, use_ptr_vectors=True, **report_args)
+    assert(data.shape == expected.shape)
+    assert(np.allclose(data, expected))
+    assert(np.max(data) > -60.0)  # make sure the cells actually did something
@@ -0,0 +1,72 @@
+import pytest
+import os
+import math
+import tempfile
+import numpy as np
+
+from .conftest import *
+
+try:
+    from bmtk.simulator.bionet.modules.xstim import XStimMod, StimXElectrode
+except ImportError:
+    nrn_installed = False
+
+
+def _electrode_files(tmp_dir, mesh=True):
+    positions_file = os.path.join(tmp_dir, 'electrode.csv')
+    with open(positions_file, 'w') as f:
+        mesh_col = ' electrode_mesh_file' if mesh else ''
+        f.write('ip pos_x pos_y pos_z rotation_x rotation_y rotation_z{}\n'.format(mesh_col))
+        f.write('0 100.0 50.0 30.0 0.0 0.0 0.0{}\n'.format(' mesh0.csv' if mesh else ''))
+        f.write('1 -50.0 150.0 -20.0 0.5 0.0 0.2{}\n'.format(' mesh1.csv' if mesh else ''))
+
+    if mesh:
+        for i, n_pts in enumerate([4, 7]):
+            with open(os.path.join(tmp_dir, 'mesh{}.csv'.format(i)), 'w') as f:
+                f.write('x_pos y_pos z_pos\n')
+                for k in range(n_pts):
+                    f.write('{} {} {}\n'.format(k*2.0, (k % 3)*1.5, -k*1.0))
+
+    waveform = {'shape': 'sin', 'del': 0.1, 'dur': 0.6, 'amp': 0.1, 'freq': 2000.0}
+    return positions_file, waveform
+
+
+@pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
+@pytest.mark.parametrize('mesh', [True, False])
+def test_transfer_resistance(mesh):
+    tmp_dir = tempfile.mkdtemp()
+    positions_file, waveform = _electrode_files(tmp_dir, mesh=mesh)
+    electrode = StimXElectrode(positions_file, waveform, tmp_dir, 0.025)
+    cell = MockCell(2)
+    electrode.set_transfer_resistance(2, cell.seg_coords, rho=300.0)
+
+    # compare with looping over every electrode and mesh point
+    r05 = cell.seg_coords.p05
+    expected = np.zeros((electrode.elnsites, r05.shape[1]))
+    for el in range(electrode.elnsites):
+        for k in range(electrode.el_mesh_size[el]):
+            rel_05 = np.expand_dims(electrode.el_mesh[el][:, k], axis=1) - r05
+            expected[el, :] += 1.0/np.sqrt(np.einsum('ij,ij->j', rel_05, rel_05))
+    expected *= (300.0 / (4 * math.pi)) * 0.01
+
+    assert(electrode.trans_X[2].shape == expected.shape)
+    assert(np.allclose(electrode.trans_X[2], expected))
+
+
+@pytest.mark.skipif(not nrn_installed, reason='NEURON is not installed')
+def test_xstim_mod():
+    tmp_dir = tempfile.mkdtemp()
+    positions_file, waveform = _electrode_files(tmp_dir)
+    sim = MockSim(MockNetwork(3), tstop=1.0)
+    mod = XStimMod(positions_file=positions_file, waveform=waveform, mesh_files_dir=tmp_dir)
+    vext = run_extracellular_mod(mod, sim)
+
+    electrode = mod._electrode
+    n_active = 0
+    for tstep in range(sim.n_steps):
+        electrode.calculate_waveforms(tstep + 1)
+        for gid in sim.net.cells.keys():
+            expected = np.array(electrode.get_vext(gid))
+            assert(np.allclose(vext[tstep][gid], expected))
+        n_active += np.any(vext[tstep][0] != 0.0)
+    assert(0 < n_active < sim.n_steps)
@@ -0,0 +1,49 @@
+import pytest
+import os
+import h5py
+import tempfile
+
+from bmtk.simulator.core.simulator_network import SimNetwork
+
+
+@pytest.fixture
+def gj_network():
+    tmp_dir = tempfile.mkdtemp()
+    gj_path = os.path.join(tmp_dir, 'net_gap_juncs.h5')
+    with h5py.File(gj_path, 'w') as h5:
+        h5.create_dataset('source_ids', data=[0, 1, 2, 3, 0])
+        h5.create_dataset('target_ids', data=[1, 0, 3, 2, 2])
+        h5.create_dataset('src_gap_ids', data=[0, 2, 4, 6, 8])
+        h5.create_dataset('trg_gap_ids', data=[1, 3, 5, 7, 9])
+
+    net = SimNetwork()
+    net.load_gap_junc_files([{'gap_juncs_file': gj_path}])
+    return net
+
+
+def test_get_gj_id(gj_network):
+    assert(gj_network.get_gj_id('net', 0, 1, True) == [0, 1])
+    assert(gj_network.get_gj_id('net', 0, 1, False) == [1, 0])
+    assert(gj_network.get_gj_id('net', 3, 2, True) == [6, 7])
+    assert(gj_network.get_gj_id('net', 0, 2, False) == [9, 8])
+
+    with pytest.raises(Exception):
+        gj_network.get_gj_id('net', 1, 1, True)
+
+    with pytest.raises(Exception):
+        gj_network.get_gj_id('net', 1, 3, True)
+
+
+def test_index_gap_juncs_local(gj_network):
+    # only keep junctions touching node 1, the only node on the current rank
+    gj_network.index_gap_juncs(local_node_ids={'net': [1]})
+    assert(gj_network.get_gj_id('net', 0, 1, True) == [0, 1])
+    assert(gj_network.get_gj_id('net', 1, 0, False) == [3, 2])
+    with pytest.raises(Exception):
+        gj_network.get_gj_id('net', 2, 3, True)
+
+
+def test_index_gap_juncs_duplicates(gj_network):
+    gj_network._gap_juncs['net']['target_ids'][4] = 1
+    with pytest.raises(Exception):
+        gj_network.index_gap_juncs()
@@ -1,5 +1,7 @@
 import os
+import tempfile
 import numpy as np
+import pytest
 
 from bmtk.utils.reports import CompartmentReport
 
@@ -134,6 +136,78 @@ def test_compartment_reader2():
     assert(report.data(1, population='v2').shape == (1000, 50))
     assert(np.all(np.unique(report.data(1, population='v2')) == [1.0]))
 
+
+@pytest.mark.parametrize('chunks,compression', [
+    (True, None),
+    (None, None),
+    ('time', None),
+    ('element', 'gzip'),
+    ((7, 3), 'lzf')
+])
+def test_chunked_data(chunks, compression):
+    cells = [(0, 10), (1, 50), (2, 1), (3, 20)]
+    tmp_file = tempfile.NamedTemporaryFile(suffix='.h5')
+    cr = CompartmentReport(tmp_file.name, mode='w', default_population='v1', tstart=0.0, tstop=100.0, dt=0.1,
+                           chunks=chunks, compression=compression, use_mpio=False)
+    for node_id, n_elements in cells:
+        cr.add_cell(node_id=node_id, element_ids=np.arange(n_elements), element_pos=np.zeros(n_elements))
+    for i in range(1000):
+        for node_id, n_elements in cells:
+            cr.record_cell(node_id, vals=node_id*1000.0 + i + np.arange(n_elements)/100.0, tstep=i)
+    cr.close()
+
+    report = CompartmentReport(tmp_file.name, 'r', default_population='v1')
+    assert(report.data().shape == (1000, 81))
+    for node_id, n_elements in cells:
+        expected = node_id*1000.0 + np.arange(1000)[:, np.newaxis] + np.arange(n_elements)[np.newaxis, :]/100.0
+        assert(np.allclose(report.data(node_id), expected))
+        assert(np.allclose(report.data(node_id, time_window=(10.0, 35.5)), expected[100:355]))
+
+    assert(np.allclose(report.data(1, sections=[0, 5, 6, 49]), 1000.0 + np.arange(1000)[:, np.newaxis] +
+                       np.array([0, 5, 6, 49])/100.0))
+
+
+def test_streaming_reductions():
+    cells = [(0, 10), (1, 50), (2, 1), (3, 20)]
+    tmp_file = tempfile.NamedTemporaryFile(suffix='.h5')
+    cr = CompartmentReport(tmp_file.name, mode='w', default_population='v1', tstart=0.0, tstop=100.0, dt=0.1,
+                           chunks=(7, 3), use_mpio=False)
+    for node_id, n_elements in cells:
+        cr.add_cell(node_id=node_id, element_ids=np.arange(n_elements)//3, element_pos=np.zeros(n_elements))
+    data = np.random.RandomState(0).rand(1000, 81)
+    cr.initialize()
+    cr.record_block(data, 0)
+    cr.close()
+    offsets = {0: (0, 10), 1: (10, 60), 2: (60, 61), 3: (61, 81)}
+
+    report = CompartmentReport(tmp_file.name, 'r')
+    blocks = [block for _, block in report.iter_blocks(block_size=300)]
+    assert([b.shape for b in blocks] == [(300, 81), (300, 81), (300, 81), (100, 81)])
+    assert(np.allclose(np.concatenate(blocks), data))
+
+    stats = report.node_stats(block_size=33)
+    for node_id, (beg, end) in offsets.items():
+        node_data = data[:, beg:end]
+        assert(np.allclose(stats.loc[node_id].values, [node_data.mean(), node_data.min(), node_data.max()]))
+
+    stats = report.node_stats(node_ids=[3, 1], sections='origin', time_window=(10.0, 20.0))
+    assert(list(stats.index) == [1, 3])
+    assert(np.isclose(stats.loc[3, 'mean'], data[100:200, 61].mean()))
+
+    times, downsampled = report.downsample(10, block_size=95)
+    assert(downsampled.shape == (100, 81))
+    assert(np.allclose(downsampled, data.reshape(100, 10, 81).mean(axis=1)))
+
+    groups, sums = report.spatial_sum(block_size=77)
+    assert(list(groups['node_id']) == [0, 1, 2, 3])
+    assert(np.allclose(sums[:, 1], data[:, 10:60].sum(axis=1)))
+
+    groups, sums = report.spatial_sum(node_ids=[1], sections=[0, 2], group_by='section')
+    assert(groups.values.tolist() == [[1, 0], [1, 2]])
+    assert(np.allclose(sums[:, 0], data[:, 10:13].sum(axis=1)))
+    assert(np.allclose(sums[:, 1], data[:, 16:19].sum(axis=1)))
+
+
 if __name__ == '__main__':
     #build_file()
     #test_compartment_reader()
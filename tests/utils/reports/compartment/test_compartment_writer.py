@@ -248,6 +248,78 @@ def test_custom_columns():
     barrier()
 
 
+@pytest.mark.parametrize('use_mpio', [True, False])
+def test_shared_file_offsets(use_mpio):
+    # When running with parallel hdf5 each rank writes its own slice of the final file, otherwise the rank files are
+    # merged. Either way the index_pointer and data must line up with the node_ids.
+    cells = [(0, 10), (1, 50), (2, 100), (3, 1), (4, 200)]
+    total_elements = sum(n_elements for _, n_elements in cells)
+    rank_cells = [c for c in cells[rank::nhosts]]
+    output_file = os.path.join(cpath, 'output/shared_file_report.h5')
+    population = 'cortical'
+
+    cr = CompartmentReport(output_file, mode='w', default_population=population, tstart=0.0, tstop=10.0, dt=0.1,
+                           use_mpio=use_mpio)
+    for node_id, n_elements in rank_cells:
+        cr.add_cell(node_id=node_id, element_ids=np.arange(n_elements), element_pos=np.zeros(n_elements))
+    cr.initialize()
+
+    for i in range(100):
+        for node_id, n_elements in rank_cells:
+            cr.record_cell(node_id, [node_id+i/100.0]*n_elements, tstep=i)
+    cr.close()
+
+    if rank == 0:
+        report_h5 = h5py.File(output_file, 'r')
+        report_grp = report_h5['/report/{}'.format(population)]
+        data_ds = report_grp['data'][()]
+        assert(data_ds.shape == (100, total_elements))
+
+        node_ids = report_grp['mapping/node_ids'][()]
+        index_pointer = report_grp['mapping/index_pointer'][()]
+        assert(index_pointer[0] == 0 and index_pointer[-1] == total_elements)
+        for i, node_id in enumerate(node_ids):
+            beg, end = index_pointer[i], index_pointer[i+1]
+            assert(end - beg == dict(cells)[node_id])
+            assert(np.allclose(data_ds[:, beg:end], (node_id + np.arange(100)/100.0)[:, np.newaxis]))
+
+        report_h5.close()
+        os.remove(output_file)
+    barrier()
+
+
+@pytest.mark.parametrize('chunks,expected', [
+    ('time', (181, 361)),
+    ('element', (1000, 65)),
+    ([100, 10], (100, 10)),
+    (None, None)
+])
+def test_data_layout(chunks, expected):
+    cells = [(0, 10), (1, 50), (2, 100), (3, 1), (4, 200)]
+    rank_cells = [c for c in cells[rank::nhosts]]
+    output_file = os.path.join(cpath, 'output/data_layout_report.h5')
+
+    cr = CompartmentReport(output_file, mode='w', default_population='cortical', tstart=0.0, tstop=100.0, dt=0.1,
+                           chunks=chunks, compression='gzip' if chunks else None)
+    for node_id, n_elements in rank_cells:
+        cr.add_cell(node_id=node_id, element_ids=np.arange(n_elements), element_pos=np.zeros(n_elements))
+    cr.initialize()
+    for i in range(1000):
+        for node_id, n_elements in rank_cells:
+            cr.record_cell(node_id, [node_id+i/1000.0]*n_elements, tstep=i)
+    cr.close()
+
+    if rank == 0:
+        report_h5 = h5py.File(output_file, 'r')
+        data_ds = report_h5['/report/cortical/data']
+        assert(data_ds.shape == (1000, 361))
+        assert(data_ds.chunks == expected)
+        assert(data_ds.compression == ('gzip' if chunks else None))
+        report_h5.close()
+        os.remove(output_file)
+    barrier()
+
+
 if __name__ == '__main__':
     #test_one_compartment_report()
     #test_multi_compartment_report()
@@ -1,3 +1,4 @@
+import os
 import pytest
 import numpy as np
 import tempfile
@@ -239,6 +240,98 @@ def test_sonata_reader():
     assert(isinstance(all_spikes[0][2], (int, np.uint)))
 
 
+@pytest.mark.parametrize('sorting', ['by_id', 'by_time', None])
+@pytest.mark.parametrize('index_cache', [False, True])
+def test_sonata_reader_index(sorting, index_cache):
+    node_ids = np.random.RandomState(1).randint(0, 50, size=2000)
+    timestamps = np.sort(np.random.RandomState(2).uniform(0.0, 1000.0, size=2000))
+    if sorting == 'by_id':
+        order = np.argsort(node_ids, kind='stable')
+        node_ids, timestamps = node_ids[order], timestamps[order]
+
+    tmp_dir = tempfile.mkdtemp()
+    spikes_path = os.path.join(tmp_dir, 'spikes.h5')
+    with h5py.File(spikes_path, 'w') as h5:
+        add_hdf5_magic(h5)
+        add_hdf5_version(h5)
+        pop_grp = h5.create_group('/spikes/V1')
+        if sorting is not None:
+            pop_grp.attrs['sorting'] = sorting
+        pop_grp.create_dataset('node_ids', data=node_ids, dtype=np.uint)
+        pop_grp.create_dataset('timestamps', data=timestamps, dtype=float)
+
+    for _ in range(2):
+        # second time around the index will be loaded from the cache
+        st = SonataSTReader(path=spikes_path, index_cache=index_cache)
+        for node_id in [0, 7, 49]:
+            assert(np.allclose(st.get_times(node_id), timestamps[node_ids == node_id]))
+        assert(len(st.get_times(50)) == 0)
+        assert(np.allclose(st.get_times(7, time_window=(100.0, 500.0)),
+                           [t for t in timestamps[node_ids == 7] if 100.0 <= t <= 500.0]))
+
+        spikes_by_id = list(st.spikes(sort_order=sort_order.by_id))
+        assert(np.all(np.diff([s[2] for s in spikes_by_id]) >= 0))
+        assert(os.path.exists(spikes_path + '.index.h5') == index_cache)
+
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 100000])
+def test_sonata_reader_merge_by_time(buffer_size):
+    rng = np.random.RandomState(3)
+    tmp_h5 = tempfile.NamedTemporaryFile(suffix='.h5')
+    pop_spikes = {}
+    with h5py.File(tmp_h5.name, 'w') as h5:
+        for pop_name, n_spikes, sorting in [('V1', 200, 'by_time'), ('V2', 150, None), ('V3', 0, 'by_time'),
+                                            ('V4', 300, 'by_time')]:
+            # use rounded timestamps so there are ties within and across populations
+            timestamps = np.round(rng.uniform(0.0, 50.0, size=n_spikes))
+            if sorting == 'by_time':
+                timestamps = np.sort(timestamps)
+            node_ids = rng.randint(0, 20, size=n_spikes)
+            pop_grp = h5.create_group('/spikes/{}'.format(pop_name))
+            if sorting is not None:
+                pop_grp.attrs['sorting'] = sorting
+            pop_grp.create_dataset('timestamps', data=timestamps, dtype=float)
+            pop_grp.create_dataset('node_ids', data=node_ids, dtype=np.uint)
+            pop_spikes[pop_name] = [(t, pop_name, n) for t, n in zip(timestamps, node_ids)]
+
+    st = SonataSTReader(path=tmp_h5.name)
+    spikes = list(st.spikes(sort_order=sort_order.by_time, buffer_size=buffer_size))
+    assert(len(spikes) == 650)
+    assert(np.all(np.diff([s[0] for s in spikes]) >= 0))
+    for pop_name, expected in pop_spikes.items():
+        # spikes of the same population and time should stay in file order
+        pop_spikes_ordered = sorted(expected, key=lambda s: s[0])
+        assert([s for s in spikes if s[1] == pop_name] == pop_spikes_ordered)
+
+    spikes = list(st.spikes(populations=['V4', 'V2'], sort_order=sort_order.by_time, buffer_size=buffer_size))
+    assert(len(spikes) == 450)
+    assert(np.all(np.diff([s[0] for s in spikes]) >= 0))
+
+
+@pytest.mark.parametrize('sorting', [sort_order.none, sort_order.by_id, sort_order.by_time])
+def test_sonata_reader_spikes_blocks(sorting):
+    tmp_h5 = tempfile.NamedTemporaryFile(suffix='.h5')
+    with h5py.File(tmp_h5.name, 'w') as h5:
+        h5.create_dataset('/spikes/V1/node_ids', data=[0, 0, 0, 0, 2, 1, 2], dtype=np.uint)
+        h5.create_dataset('/spikes/V1/timestamps', data=[0.25, 0.5, 0.75, 1.0, 3.0, 0.001, 2.0], dtype=float)
+        h5.create_dataset('/spikes/V2/node_ids', data=[10, 10, 11], dtype=np.uint)
+        h5.create_dataset('/spikes/V2/timestamps', data=[4.0, 0.5, 4.0], dtype=float)
+
+    st = SonataSTReader(path=tmp_h5.name)
+    for kwargs in [{}, {'populations': 'V2'}, {'node_ids': [0, 10]}, {'time_window': (0.5, 3.0)}]:
+        blocks = list(st.spikes_blocks(sort_order=sorting, block_size=3, **kwargs))
+        assert(all(0 < len(b['timestamps']) <= 3 for b in blocks))
+        block_spikes = [s for b in blocks for s in zip(b['timestamps'], b['population'], b['node_ids'])]
+        assert(block_spikes == list(st.spikes(sort_order=sorting, **kwargs)))
+
+    # buffer_size is still accepted as an alias of block_size
+    blocks = list(st.spikes_blocks(sort_order=sorting, buffer_size=2))
+    assert(len(blocks) >= 5 and all(0 < len(b['timestamps']) <= 2 for b in blocks))
+
+    spikes = list(st.spikes(sort_order=sorting, node_ids=[0, 10], time_window=(0.5, 3.0)))
+    assert(sorted(spikes) == [(0.5, 'V1', 0), (0.5, 'V2', 10), (0.75, 'V1', 0), (1.0, 'V1', 0)])
+
+
 def test_oldsonata_reader():
     # A special reader for an older version of the spikes format
     tmp_h5 = tempfile.NamedTemporaryFile(suffix='.h5')
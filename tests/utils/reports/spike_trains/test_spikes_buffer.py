@@ -133,6 +133,30 @@ def test_iterator(spiketrain_buffer):
     assert(np.all(np.diff(v1_node_times) >= 0))
 
 
+@pytest.mark.parametrize('spiketrain_buffer', [
+    STMemoryBuffer(default_population='V1', store_type='list'),
+    STMemoryBuffer(default_population='V1', store_type='array'),
+    STCSVBuffer(default_population='V1', cache_dir=tempfile.mkdtemp())
+])
+def test_spikes_blocks(spiketrain_buffer):
+    st = spiketrain_buffer
+    st.add_spikes(node_ids=0, timestamps=np.linspace(0.1, 1.0, 10, endpoint=True))
+    st.add_spikes(node_ids=2, timestamps=np.full(9, 2.0))
+    st.add_spikes(node_ids=5, timestamps=[5.0, 4.5, 6.5, 7.0, 1.5, 0.0])
+    st.add_spikes(population='V2', node_ids=0, timestamps=np.linspace(0.1, 1.0, 10, endpoint=True))
+
+    blocks = list(st.spikes_blocks(block_size=4))
+    assert(all(0 < len(b['timestamps']) <= 4 for b in blocks))
+    assert(set(blocks[0].keys()) == {'timestamps', 'population', 'node_ids'})
+    assert(sum(len(b['node_ids']) for b in blocks) == 35)
+
+    blocks = list(st.spikes_blocks(populations='V1', node_ids=[2, 5], time_window=(1.0, 6.0),
+                                   sort_order=sort_order.by_time))
+    timestamps = np.concatenate([b['timestamps'] for b in blocks])
+    assert(np.allclose(timestamps, [1.5] + [2.0]*9 + [4.5, 5.0]))
+    assert(set(np.concatenate([b['population'] for b in blocks])) == {'V1'})
+
+
 @pytest.mark.parametrize('spiketrain_buffer', [
     STMemoryBuffer(default_population='V1', store_type='list'),
     STMemoryBuffer(default_population='V1', store_type='array'),
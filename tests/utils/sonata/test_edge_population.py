@@ -0,0 +1,158 @@
+import pytest
+import os
+import numpy as np
+import tempfile
+
+from bmtk.builder import NetworkBuilder
+from bmtk.utils import sonata
+from bmtk.utils.sonata import population
+
+
+@pytest.fixture
+def edges_pop():
+    np.random.seed(1)
+    net = NetworkBuilder('test')
+    net.add_nodes(5, ei='e')
+    net.add_nodes(10, ei='i')
+    net.add_edges(source={'ei': 'i'}, target={'ei': 'e'}, connection_rule=5, syn_model='i2e', syn_weight=0.1)
+    cm = net.add_edges(source={'ei': 'e'}, target={'ei': 'i'}, connection_rule=2, syn_model='e2i')
+    cm.add_properties('syn_weight', rule=lambda *_: np.random.choice([0.1, 0.2]), dtypes=float)
+    cm.add_properties('syn_loc', rule=lambda *_: int(np.random.choice([1, 2])), dtypes=int)
+    net.build()
+
+    net_dir = tempfile.mkdtemp()
+    net.save_edges('edges.h5', 'edge_types.csv', output_dir=net_dir)
+    sonata_file = sonata.File(data_files=os.path.join(net_dir, 'edges.h5'),
+                              data_type_files=os.path.join(net_dir, 'edge_types.csv'))
+    return sonata_file.edges['test_to_test']
+
+
+def _edge_keys(edges):
+    return [(e.source_node_id, e.target_node_id, e.edge_type_id, e.group_id) for e in edges]
+
+
+@pytest.mark.parametrize('filter_props,n_edges', [
+    ({}, 150),
+    ({'edge_type_id': 100}, 50),
+    ({'edge_type_id': [100, 101]}, 150),
+    ({'syn_model': 'e2i'}, 100),
+    ({'syn_model': ['i2e', 'e2i']}, 150),
+    ({'group_id': 0}, 50),
+    ({'syn_loc': 1}, None),
+    ({'syn_loc': 1, 'syn_weight': 0.1}, None),
+    ({'syn_loc': [1, 2], 'syn_model': 'e2i'}, 100),
+    ({'syn_model': 'e2e'}, 0)
+])
+def test_filter(edges_pop, filter_props, n_edges):
+    edge_ids = edges_pop.filter_indicies(chunk_size=7, **filter_props)
+    if n_edges is not None:
+        assert(len(edge_ids) == n_edges)
+    assert(np.all(np.diff(edge_ids.astype(np.int64)) > 0))
+
+    # Check against the edges found by going through each edge one at a time
+    expected_keys = [(e.source_node_id, e.target_node_id, e.edge_type_id, e.group_id) for e in edges_pop
+                     if all(k in e and e[k] in (v if isinstance(v, list) else [v]) for k, v in filter_props.items()
+                            if k not in ['group_id', 'edge_type_id']) and
+                     e.group_id in ([filter_props['group_id']] if 'group_id' in filter_props else [0, 1]) and
+                     e.edge_type_id in np.atleast_1d(filter_props.get('edge_type_id', [100, 101]))]
+    assert(_edge_keys(edges_pop.filter(**filter_props)) == expected_keys)
+    assert(_edge_keys(edges_pop.get_rows(edge_ids)) == expected_keys)
+
+
+def test_filter_missing_property(edges_pop):
+    with pytest.raises(Exception):
+        edges_pop.filter_indicies(not_a_property=1)
+
+
+def test_select_to_dataframe(edges_pop):
+    edge_set = edges_pop.select(syn_model='e2i', syn_loc=2)
+    edges_df = edge_set.to_dataframe()
+    assert(len(edges_df) == len(edge_set))
+    assert(np.all(edges_df.index.values == edge_set.edge_ids))
+    assert(np.all(edges_df['syn_model'] == 'e2i'))
+    assert(np.all(edges_df['syn_loc'] == 2))
+    assert(set(edges_df['syn_weight'].unique()) <= {0.1, 0.2})
+
+    edges_df = edges_pop.select().to_dataframe()
+    assert(len(edges_df) == 150)
+    assert(np.allclose(edges_df[edges_df['edge_type_id'] == 100]['syn_weight'], 0.1))  # from edge-types table
+    assert(np.all(np.isnan(edges_df[edges_df['edge_type_id'] == 100]['syn_loc'])))
+    for (edge_id, row), edge in zip(edges_df.iterrows(), edges_pop):
+        assert(row['source_node_id'] == edge.source_node_id)
+        assert(row['target_node_id'] == edge.target_node_id)
+        assert(row['syn_weight'] == edge['syn_weight'])
+
+
+class RecordedDataset(object):
+    """Wraps a numpy array, keeping track of the number of rows read."""
+    def __init__(self, data):
+        self._data = data
+        self.dtype = data.dtype
+        self.shape = data.shape
+        self.rows_read = 0
+
+    def __getitem__(self, item):
+        values = self._data[item]
+        self.rows_read += len(values)
+        return values
+
+
+def test_read_rows_sparse():
+    dataset = RecordedDataset(np.arange(100000)*2)
+    rows = np.array([0, 1, 5, 40000, 40003, 99990, 99999])
+    values = population._read_rows(dataset, rows, chunk_size=4, max_gap=10)
+    assert(np.all(values == rows*2))
+    assert(dataset.rows_read < 30)
+
+
+def test_rows_to_dataframe_sparse(edges_pop):
+    rows = np.array([0, 3, 77, 120, 149])
+    edges_df = edges_pop.rows_to_dataframe(rows, chunk_size=2)
+    assert(np.all(edges_df.index.values == rows))
+    for (edge_id, row), edge in zip(edges_df.iterrows(), edges_pop.get_rows(rows)):
+        assert(row['source_node_id'] == edge.source_node_id)
+        assert(row['target_node_id'] == edge.target_node_id)
+        assert(row['syn_weight'] == edge['syn_weight'])
+
+
+@pytest.mark.parametrize('target_ids', [
+    [0, 1, 2, 3, 4],
+    [12, 3, 7],
+    [4, 4, 100],
+    []
+])
+def test_get_target_columns(edges_pop, target_ids):
+    expected = [e for trg_id in target_ids for e in edges_pop.get_target(trg_id)]
+    edge_cols = edges_pop.get_target_columns(target_ids)
+    assert(len(edge_cols['edge_id']) == len(expected))
+    assert(list(edge_cols['source_node_id']) == [e.source_node_id for e in expected])
+    assert(list(edge_cols['target_node_id']) == [e.target_node_id for e in expected])
+    assert(list(edge_cols['edge_type_id']) == [e.edge_type_id for e in expected])
+    assert(list(edge_cols['edge_group_id']) == [e.group_id for e in expected])
+    assert(np.allclose(edge_cols['syn_weight'], [e['syn_weight'] for e in expected]))
+    for syn_loc, e in zip(edge_cols['syn_loc'], expected):
+        assert(syn_loc == e['syn_loc'] if 'syn_loc' in e else np.isnan(syn_loc))
+
+    edges = list(edges_pop.edges_from_columns(edge_cols))
+    assert(_edge_keys(edges) == _edge_keys(expected))
+    assert(all(e1['syn_model'] == e2['syn_model'] for e1, e2 in zip(edges, expected)))
+    assert(all(('syn_loc' in e1) == ('syn_loc' in e2) for e1, e2 in zip(edges, expected)))
+
+
+def test_get_target_columns_edge_types(edges_pop):
+    edge_cols = edges_pop.get_target_columns([0, 5], columns=['syn_model'])
+    assert(set(edge_cols.keys()) == {'edge_id', 'source_node_id', 'target_node_id', 'edge_type_id', 'edge_group_id',
+                                     'edge_group_index', 'syn_model'})
+    assert(list(edge_cols['syn_model']) == ['i2e']*10 + ['e2i']*10)
+
+    with pytest.raises(Exception):
+        edges_pop.get_target_columns([0], columns=['not_a_property'])
+
+
+def test_target_counts(edges_pop):
+    target_ids = [0, 4, 5, 14, 20, -1]
+    expected = [len(list(edges_pop.get_target(i))) if i >= 0 else 0 for i in target_ids]
+    assert(list(edges_pop.target_counts(target_ids)) == expected)
+
+    edges_pop._has_target_index = False
+    assert(list(edges_pop.target_counts(target_ids, chunk_size=7)) == expected)